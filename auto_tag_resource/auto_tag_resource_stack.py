@@ -1,15 +1,62 @@
+import importlib.util
+import os
+
 from aws_cdk import (
     CfnParameter,
     Duration,
     Stack,
     Aws,
+    RemovalPolicy,
+    aws_dynamodb as _dynamodb,
     aws_iam as _iam,
     aws_events as _events,
     aws_events_targets as _targets,
-    aws_lambda as _lambda
+    aws_lambda as _lambda,
+    aws_lambda_event_sources as _event_sources,
+    aws_sqs as _sqs
 )
 from constructs import Construct
 
+_LAMBDA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "lambda")
+
+
+# IAM prefixes for boto3 clients whose name differs from the service's
+# action prefix, and the odd operations whose IAM action is named differently.
+_IAM_PREFIXES = {"opensearch": "es", "elbv2": "elasticloadbalancing", "efs": "elasticfilesystem", "docdb": "rds"}
+_IAM_ACTIONS = {("s3", "list_buckets"): "s3:ListAllMyBuckets"}
+
+
+def _load_lambda_module(name):
+    """Load a module from lambda/ that only depends on the standard library, without importing the handler."""
+    spec = importlib.util.spec_from_file_location("lambda_" + name, os.path.join(_LAMBDA_DIR, name + ".py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def _load_handled_events():
+    """Load lambda/events.py to read the handler's event table."""
+    return _load_lambda_module("events")
+
+
+def _iam_action(service, operation):
+    """Return the IAM action a boto3 `service` client needs to call `operation`."""
+    if (service, operation) in _IAM_ACTIONS:
+        return _IAM_ACTIONS[service, operation]
+    return _IAM_PREFIXES.get(service, service) + ":" + "".join(part.title() for part in operation.split("_"))
+
+
+def _registry_actions():
+    """Return every IAM action the registry's list, describe, read and write operations need, sorted."""
+    actions = set()
+    for rtype in _load_lambda_module("registry").RESOURCE_TYPES:
+        for operation in (rtype.list_op, rtype.detail and rtype.detail[0], rtype.read and rtype.read[0],
+                          rtype.write and rtype.write[0]):
+            if operation:
+                actions.add(_iam_action(rtype.service, operation))
+    return sorted(actions)
+
+
 class AutoTagResourceStack(Stack):
 
     def __init__(self, scope: Construct, construct_id: str, **kwargs) -> None:
@@ -37,95 +84,160 @@ class AutoTagResourceStack(Stack):
             effect=_iam.Effect.ALLOW,
             resources=["*"],
             actions=[
-                "dynamodb:TagResource", "dynamodb:DescribeTable",
-                "lambda:TagResource", "lambda:ListTags",
-                "s3:GetBucketTagging", "s3:PutBucketTagging", 
-                "ec2:CreateTags", "ec2:DescribeNatGateways", "ec2:DescribeInternetGateways", 
-                "ec2:DescribeVolumes", "ec2:DescribeSubnets", "ec2:DescribeVpcs", "ec2:DescribeRouteTables", 
-                "rds:AddTagsToResource", "rds:DescribeDBInstances",
-                "sns:TagResource", "sqs:ListQueueTags", "sqs:TagQueue", 
-                "es:AddTags", "kms:ListResourceTags", "kms:TagResource", 
-                "elasticfilesystem:TagResource", "elasticfilesystem:CreateTags", 
-                "elasticfilesystem:DescribeTags", "elasticloadbalancing:AddTags",
-                "tag:getResources", "tag:getTagKeys", "tag:getTagValues", 
-                "tag:TagResources", "tag:UntagResources", 
-                "cloudformation:DescribeStacks", "cloudformation:ListStackResources", 
-                "elasticache:DescribeReplicationGroups", "elasticache:DescribeCacheClusters", 
-<<<<<<< HEAD
-                "elasticache:AddTagsToResource", "elasticache:Describe*", 
+                "dynamodb:TagResource", "dynamodb:DescribeTable", "lambda:TagResource", "lambda:ListTags",
+                "s3:GetBucketTagging", "s3:PutBucketTagging", "ec2:CreateTags", "ec2:DescribeTags", "ec2:DescribeNatGateways",
+                "ec2:DescribeInternetGateways", "ec2:DescribeVolumes", "ec2:DescribeSubnets",
+                "ec2:DescribeVpcs", "ec2:DescribeRouteTables", "rds:AddTagsToResource",
+                "rds:DescribeDBInstances", "sns:TagResource", "sqs:ListQueueTags", "sqs:TagQueue",
+                "es:AddTags", "kms:ListResourceTags", "kms:TagResource", "elasticfilesystem:TagResource",
+                "elasticfilesystem:CreateTags", "elasticfilesystem:DescribeTags",
+                "elasticloadbalancing:AddTags", "tag:getResources", "tag:getTagKeys", "tag:getTagValues",
+                "tag:TagResources", "tag:UntagResources", "cloudformation:DescribeStacks",
+                "cloudformation:ListStackResources", "elasticache:DescribeReplicationGroups",
+                "elasticache:DescribeCacheClusters", "elasticache:AddTagsToResource", "elasticache:Describe*",
                 "GameLift:TagResource", "kafka:TagResource", "kafka:UntagResource",
-                "docdb:ListTagsForResource", "docdb:AddTagsToResource", "docdb:RemoveTagsFromResource", 
-                "workspaces:TagResource", "workspaces:*","workspaces:UntagResource", "workspaces:DescribeWorkspaces",
-                "route53:ListTagsForResource", "route53:TagResource", "route53:UntagResource",
-                "msk:TagResource", "msk:UntagResource", "kafka:*", "resource-groups:*", "kafka:AddTagsToResource", "kafka:*", "ds:*"
-=======
-                "elasticache:AddTagsToResource", "resource-groups:*", 
-                "GameLift:TagResource", "kafka:TagResource", "kafka:UntagResource","kafka:List*","kafka:Describe*",
-                "docdb:ListTagsForResource", "docdb:AddTagsToResource", "docdb:RemoveTagsFromResource", 
-                "workspaces:TagResource", "workspaces:UntagResource", "workspaces:DescribeWorkspaces", "workspaces:Describe*", "workspaces:List*",
-                "route53:ListTagsForResource", "route53:TagResource", "route53:UntagResource",
-                "msk:TagResource", "msk:UntagResource", "ec2:DescribeNetworkInterfaces",
-                "ds:Describe*", "ds:ListTagsForResource", "ds:AddTagsToResource", "ds:CreateTags",
-                "workspaces:CreateTags"
->>>>>>> d49ad03bca15aa652579d1493d33ba60652e86a7
+                "docdb:ListTagsForResource", "docdb:AddTagsToResource", "docdb:RemoveTagsFromResource",
+                "workspaces:TagResource", "workspaces:*", "workspaces:UntagResource",
+                "workspaces:DescribeWorkspaces", "route53:ListTagsForResource", "route53:TagResource",
+                "route53:UntagResource", "msk:TagResource", "msk:UntagResource", "kafka:*",
+                "resource-groups:*", "kafka:AddTagsToResource", "ds:*", "kafka:List*", "kafka:Describe*",
+                "workspaces:Describe*", "workspaces:List*", "ec2:DescribeNetworkInterfaces", "ds:Describe*",
+                "ds:ListTagsForResource", "ds:AddTagsToResource", "ds:CreateTags", "workspaces:CreateTags"
             ]
         ))
+        # The scheduled reconciliation lists, reads and writes every registry
+        # type, so its actions are generated from the registry itself.
+        lambda_role.add_to_policy(_iam.PolicyStatement(
+            effect=_iam.Effect.ALLOW,
+            resources=["*"],
+            actions=_registry_actions()
+        ))
+
+        # Tag-state ledger: resources verified compliant are skipped by later
+        # sweeps until their entry is older than ledgerTtlSeconds
+        ledger_table = _dynamodb.Table(self, "resource_tagging_ledger",
+            partition_key=_dynamodb.Attribute(name="resource", type=_dynamodb.AttributeType.STRING),
+            billing_mode=_dynamodb.BillingMode.PAY_PER_REQUEST,
+            time_to_live_attribute="expires_at",
+            removal_policy=RemovalPolicy.DESTROY)
 
         # create lambda function
         tagging_function = _lambda.Function(self, "resource_tagging_automation_function",
             runtime=_lambda.Runtime.PYTHON_3_10,
-            memory_size=128,
+            # Lambda allocates CPU in proportion to memory; at 128 MB importing
+            # boto3 and loading service models dominates each cold start.
+            memory_size=int(self.node.try_get_context("memorySize") or 512),
             timeout=Duration.seconds(600),
-            handler="lambda-handler.main",
-            code=_lambda.Code.from_asset("./lambda"),
+            handler="index.main",
+            # "-c lambdaAsset=build/lambda" deploys the trimmed bundle from scripts/bundle_lambda.py
+            code=_lambda.Code.from_asset(self.node.try_get_context("lambdaAsset") or "./lambda"),
             function_name="resource-tagging-automation-function",
             role=lambda_role,
             environment={
                 "tags": tags.value_as_string,
-                "identityRecording": identityRecording.value_as_string
+                "identityRecording": identityRecording.value_as_string,
+                "LEDGER_TABLE": ledger_table.table_name,
+                "LEDGER_TTL_SECONDS": str(self.node.try_get_context("ledgerTtlSeconds") or 7 * 24 * 3600),
+                # Every event path tags through the Resource Groups Tagging API,
+                # so build that client during the init phase.
+                "PRELOAD_SERVICES": self.node.try_get_context("preloadServices") or "resourcegroupstaggingapi",
+                "LOG_LEVEL": self.node.try_get_context("logLevel") or "INFO",
+                "LOG_SAMPLE_RATE": str(self.node.try_get_context("logSampleRate") or 0),
+                "SELF_ROLE_ARN": lambda_role.role_arn
             }
         )
+        ledger_table.grant_read_write_data(tagging_function)
 
-        # Define event rule for resource creation events
+        # Profiling is switched on per deployment without code changes:
+        #   cdk deploy -c profiling=all -c profileS3Uri=s3://my-bucket/profiles
+        # or by setting PROFILING on the function directly.
+        _profiling = self.node.try_get_context("profiling")
+        if _profiling:
+            tagging_function.add_environment("PROFILING", _profiling)
+        _profileS3Uri = self.node.try_get_context("profileS3Uri")
+        if _profileS3Uri:
+            tagging_function.add_environment("PROFILE_S3_URI", _profileS3Uri)
+            tagging_function.add_to_role_policy(_iam.PolicyStatement(
+                actions=["s3:PutObject"],
+                resources=["arn:aws:s3:::" + _profileS3Uri[len("s3://"):].rstrip("/") + "/*"]))
+
+        # Resources that are still being created (NAT gateways, MSK and ElastiCache
+        # clusters) are re-checked through this queue with a growing delay instead
+        # of the function sleeping until they become taggable
+        _recheckQueue = _sqs.Queue(self, "resource-tagging-recheck-queue",
+            visibility_timeout=Duration.seconds(600 * 6))
+        _recheckQueue.grant_send_messages(tagging_function)
+        tagging_function.add_environment("RECHECK_QUEUE_URL", _recheckQueue.queue_url)
+        tagging_function.add_event_source(_event_sources.SqsEventSource(_recheckQueue,
+            batch_size=10, report_batch_item_failures=True))
+
+        # Resources whose tagging failed are journaled here and re-attempted by a
+        # scheduled replay instead of waiting for the next full reconciliation;
+        # "-c replaySchedule=off" disables the replay
+        _failureQueue = _sqs.Queue(self, "resource-tagging-failure-journal",
+            retention_period=Duration.days(14),
+            visibility_timeout=Duration.seconds(600 + 60))
+        _failureQueue.grant_send_messages(tagging_function)
+        _failureQueue.grant_consume_messages(tagging_function)
+        tagging_function.add_environment("FAILURE_QUEUE_URL", _failureQueue.queue_url)
+        _replaySchedule = self.node.try_get_context("replaySchedule") or "rate(1 hour)"
+        if _replaySchedule != "off":
+            _replayRule = _events.Rule(self, "resource-tagging-failure-replay-schedule",
+                schedule=_events.Schedule.expression(_replaySchedule))
+            _replayRule.add_target(_targets.LambdaFunction(tagging_function, retry_attempts=0,
+                event=_events.RuleTargetInput.from_object({"replay": {}})))
+
+        # Define event rule for resource creation events, generated from the
+        # (source, eventName) pairs the handler implements. Each source gets
+        # its own clause, so one service's event names never match another's;
+        # keep the pattern within PutRule's 4096-character limit.
+        # Calls made by this function's own role are skipped once, for every
+        # source, so its CreateTags and TagResource calls never invoke it
+        # again: the caller ARN of an assumed-role session is
+        # arn:<partition>:sts::<account>:assumed-role/<role name>/<session>,
+        # and IAM users and root have an ARN of another form.
+        _handled = _load_handled_events()
+        _handledEvents = _handled.HANDLED_EVENTS
+        _ownSessions = f"arn:{Aws.PARTITION}:sts::{Aws.ACCOUNT_ID}:assumed-role/{lambda_role.role_name}/"
         _eventRule = _events.Rule(self, "resource-tagging-automation-rule",
             event_pattern=_events.EventPattern(
-                source=["aws.ec2", "aws.elasticloadbalancing", "aws.rds", "aws.lambda", "aws.s3", 
-<<<<<<< HEAD
-                        "aws.dynamodb", "aws.elasticfilesystem", "aws.es", "aws.sqs", "aws.sns", 
-                        "aws.kms", "aws.elasticache", "aws.gamelift", "aws.msk", "aws.route53", "aws.workspaces", "aws.eks"],
-=======
-                        "aws.dynamodb", "aws.elasticfilesystem", "aws.es", "aws.sqs", "aws.sns", "aws.eks",
-                        "aws.kms", "aws.elasticache", "aws.gamelift", "aws.msk", "aws.route53","aws.workspaces"],
->>>>>>> d49ad03bca15aa652579d1493d33ba60652e86a7
+                source=sorted(_handledEvents),
                 detail_type=["AWS API Call via CloudTrail"],
                 detail={
-                    "eventSource": [
-                        "ec2.amazonaws.com", "elasticloadbalancing.amazonaws.com", "s3.amazonaws.com", 
-<<<<<<< HEAD
-                        "rds.amazonaws.com", "lambda.amazonaws.com", "dynamodb.amazonaws.com", 
-                        "elasticfilesystem.amazonaws.com", "es.amazonaws.com", "sqs.amazonaws.com", 
-                        "sns.amazonaws.com", "kms.amazonaws.com", "elasticache.amazonaws.com", 
-                        "gamelift.amazonaws.com", "dms.amazonaws.com", "kafka.amazonaws.com", "route53.amazonaws.com", "eks.amazonaws.com", "workspaces.amazonaws.com"
+                    "userIdentity": {"arn": [{"anything-but": {"prefix": _ownSessions}}]},
+                    "$or": [
+                        {"eventSource": [_handled.event_source(source)], "eventName": sorted(_handledEvents[source])}
+                        for source in sorted(_handledEvents)
                     ],
-                    "eventName": [
-                        "RunInstances", "CreateFunction20150331", "CreateBucket", "CreateDBInstance", 
-                        "CreateTable", "CreateVolume", "CreateLoadBalancer", "CreateMountTarget", 
-                        "CreateDomain", "CreateQueue", "CreateTopic", "CreateKey", "CreateReplicationGroup", 
-                        "CreateCacheCluster", "ModifyReplicationGroupShardConfiguration", "CreateFleet",
-                        "CreateNatGateway", "CreateSubnet", "CreateVpc", "CreateRoute", "CreateHostedZone", 
-                        "CreateCluster", "AllocateAddress", "DeregisterWorkspaceDirectory", "workspaceId", "CreateDirectory", "CreateInternetGateway", "CreateVpcEndpoint", "CreateTransitGateway", "CreateReplicationInstance", "CreateReplicationGroup", "ModifyCluster", "CreateWorkspaces", "ChangeResourceRecordSets", "CreateServerlessCache", "CreateCacheCluster", "CreateReplicationGroup", "CopyServerlessCacheSnapshot", "CopySnapshot", "CreateCacheParameterGroup", "CreateCacheSecurityGroup", "CreateCacheSubnetGroup", "CreateServerlessCacheSnapshot", "CreateSnapshot", "CreateUserGroup", "CreateUser", "PurchaseReservedCacheNodesOffering", "CreateRecordSet", "CreateInboundEndpoint", "CreateHostedZone", "UpdateCluster", "CreateStream", "UpdateStream", "CreateWorkspace", "CreateVpcPeeringConnection", "DeleteVpcPeeringConnection", "CreateTags"
-                    ]
-=======
-                        "rds.amazonaws.com", "lambda.amazonaws.com", "dynamodb.amazonaws.com", "eks.amazonaws.com",
-                        "elasticfilesystem.amazonaws.com", "es.amazonaws.com", "sqs.amazonaws.com", "skylight.amazonaws.com",
-                        "sns.amazonaws.com", "kms.amazonaws.com", "elasticache.amazonaws.com", "workspaces.amazonaws.com",
-                        "gamelift.amazonaws.com", "kafka.amazonaws.com", "route53.amazonaws.com"
-                    ],
-                    "eventName": ["RunInstances", "CreateFunction20150331", "CreateBucket", "DeregisterWorkspaceDirectory", "CreateDBInstance", "workspaceId", "CreateDirectory", "CreateTable", "CreateVolume", "CreateLoadBalancer", "CreateMountTarget", "CreateDomain", "CreateQueue", "CreateTopic", "CreateKey", "CreateVpc", "CreateInternetGateway", "CreateNatGateway", "AllocateAddress", "CreateVpcEndpoint", "CreateTransitGateway", "CreateReplicationInstance", "CreateReplicationGroup", "CreateCluster", "ModifyCluster", "CreateWorkspaces", "CreateHostedZone", "ChangeResourceRecordSets", "CreateServerlessCache", "CreateCacheCluster", "CreateReplicationGroup", "CopyServerlessCacheSnapshot", "CopySnapshot", "CreateCacheParameterGroup", "CreateCacheSecurityGroup", "CreateCacheSubnetGroup", "CreateServerlessCacheSnapshot", "CreateSnapshot", "CreateUserGroup", "CreateUser", "PurchaseReservedCacheNodesOffering", "CreateRecordSet", "CreateInboundEndpoint", "CreateHostedZone", "CreateCluster", "UpdateCluster", "DeleteCluster", "CreateStream", "UpdateStream", "DeleteStream", "CreateWorkspace", "TerminateWorkspace", "CreateVpcPeeringConnection", "DeleteVpcPeeringConnection", "CreateHealthCheck", "CreateTags", "UpdateHealthCheck", "DeleteHealthCheck"]
->>>>>>> d49ad03bca15aa652579d1493d33ba60652e86a7
+                    # Failed API calls created nothing to tag.
+                    "errorCode": [{"exists": False}]
                 }
             )
         )
 
-        # Add Lambda function as the target for the event rule
-        _eventRule.add_target(_targets.LambdaFunction(tagging_function, retry_attempts=2))
+        # Periodically reconcile every resource in the region so anything the
+        # event path missed is still tagged; "-c reconcileSchedule=off" disables it.
+        _reconcileSchedule = self.node.try_get_context("reconcileSchedule") or "rate(12 hours)"
+        if _reconcileSchedule != "off":
+            _scheduleRule = _events.Rule(self, "resource-tagging-reconciliation-schedule",
+                schedule=_events.Schedule.expression(_reconcileSchedule))
+            _scheduleRule.add_target(_targets.LambdaFunction(tagging_function, retry_attempts=0))
+
+        # Optionally buffer events in SQS so bursts are handled in batches, with one
+        # sweep per service and region per batch instead of one per event:
+        #   cdk deploy -c eventBuffer=true -c eventBatchSize=100 -c eventBatchWindowSeconds=30
+        if str(self.node.try_get_context("eventBuffer")).lower() == "true":
+            _deadLetterQueue = _sqs.Queue(self, "resource-tagging-automation-dlq",
+                retention_period=Duration.days(14))
+            _eventQueue = _sqs.Queue(self, "resource-tagging-automation-queue",
+                # AWS recommends at least six times the function timeout.
+                visibility_timeout=Duration.seconds(600 * 6),
+                dead_letter_queue=_sqs.DeadLetterQueue(max_receive_count=3, queue=_deadLetterQueue))
+            _eventRule.add_target(_targets.SqsQueue(_eventQueue))
+            tagging_function.add_event_source(_event_sources.SqsEventSource(_eventQueue,
+                batch_size=int(self.node.try_get_context("eventBatchSize") or 100),
+                max_batching_window=Duration.seconds(int(self.node.try_get_context("eventBatchWindowSeconds") or 30)),
+                report_batch_item_failures=True))
+        else:
+            # Add Lambda function as the target for the event rule
+            _eventRule.add_target(_targets.LambdaFunction(tagging_function, retry_attempts=2))
@@ -0,0 +1,73 @@
+"""Measure the tagging function's cold start: module import plus the first invocation.
+
+Each sample runs in a fresh interpreter, so nothing is cached between them.
+The first invocation handles a CreateFunction event against a stubbed tagging
+API, which covers importing boto3, building the client and loading its model.
+
+    python benchmarks/cold_start.py --samples 5
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LAMBDA_DIR = os.path.join(ROOT, 'lambda')
+
+EVENT = {
+    'source': 'aws.lambda', 'region': 'us-east-1', 'account': '111122223333',
+    'detail': {'eventName': 'CreateFunction20150331',
+               'responseElements': {'functionArn': 'arn:aws:lambda:us-east-1:111122223333:function:cold-start'}},
+}
+
+_CHILD = '''
+import json, sys, time
+started = time.perf_counter()
+import index
+imported = time.perf_counter()
+eager = sorted(name for name in ('boto3', 'botocore', 'jmespath') if name in sys.modules)
+
+from botocore.stub import Stubber
+from clients import get_client
+client = get_client('resourcegroupstaggingapi', region_name='us-east-1')
+with Stubber(client) as stub:
+    stub.add_response('get_resources', {'ResourceTagMappingList': []})
+    stub.add_response('tag_resources', {'FailedResourcesMap': {}})
+    response = index.main(json.loads(sys.argv[1]), None)
+    finished = time.perf_counter()
+print(json.dumps({'import': imported - started, 'first_invocation': finished - imported,
+                  'status': response.get('statusCode'), 'eager_modules': eager}))
+'''
+
+
+def sample(env=None):
+    """Run one cold start in a fresh interpreter and return its timings in seconds."""
+    child_env = dict(os.environ, tags=json.dumps({'map-migrated': 'mig123'}), AWS_DEFAULT_REGION='us-east-1',
+                     AWS_ACCESS_KEY_ID='testing', AWS_SECRET_ACCESS_KEY='testing', **(env or {}))
+    child_env.pop('LEDGER_TABLE', None)
+    child_env.pop('RECHECK_QUEUE_URL', None)
+    output = subprocess.run([sys.executable, '-c', _CHILD, json.dumps(EVENT)], cwd=LAMBDA_DIR, env=child_env,
+                            capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def measure(samples=5, env=None):
+    """Return median import and first-invocation seconds over `samples` cold starts."""
+    runs = [sample(env) for _ in range(samples)]
+    return {
+        'samples': samples,
+        'import': statistics.median(run['import'] for run in runs),
+        'first_invocation': statistics.median(run['first_invocation'] for run in runs),
+        'eager_modules': runs[0]['eager_modules'],
+        'status': runs[0]['status'],
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--samples', type=int, default=5)
+    parser.add_argument('--preload', default='', help='PRELOAD_SERVICES value to measure, e.g. resourcegroupstaggingapi')
+    args = parser.parse_args()
+    print(json.dumps(measure(args.samples, {'PRELOAD_SERVICES': args.preload}), indent=2))
@@ -0,0 +1,240 @@
+"""An in-process stand-in for one AWS account, answering boto3 calls without the network.
+
+FakeAccount hooks a boto3 session's 'before-call' event, so every client
+built from that session gets its responses from an in-memory set of
+synthetic resources instead of AWS. The resources are EC2 instances, EBS
+volumes and snapshots, RDS instances, S3 buckets and ElastiCache clusters.
+Writes change the stored tags, so a second sweep sees the first one's work.
+Operations the fake does not model return an empty response. Every call is
+counted per (service, operation).
+"""
+import threading
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+
+from botocore import xform_name
+from botocore.awsrequest import AWSResponse
+
+REGION = 'us-east-1'
+ACCOUNT = '111122223333'
+
+# Share of each kind in a generated account.
+DEFAULT_MIX = {'instance': 0.4, 'volume': 0.25, 'snapshot': 0.2, 'db': 0.05, 'bucket': 0.05, 'cache': 0.05}
+
+PAGE_SIZE = 1000
+
+
+def _arn(kind, ident):
+    return {
+        'instance': f'arn:aws:ec2:{REGION}:{ACCOUNT}:instance/{ident}',
+        'volume': f'arn:aws:ec2:{REGION}:{ACCOUNT}:volume/{ident}',
+        'snapshot': f'arn:aws:ec2:{REGION}::snapshot/{ident}',
+        'db': f'arn:aws:rds:{REGION}:{ACCOUNT}:db:{ident}',
+        'bucket': f'arn:aws:s3:::{ident}',
+        'cache': f'arn:aws:elasticache:{REGION}:{ACCOUNT}:cluster:{ident}',
+    }[kind]
+
+
+_PREFIX = {'instance': 'i-', 'volume': 'vol-', 'snapshot': 'snap-', 'db': 'db-', 'bucket': 'bench-bucket-', 'cache': 'cache-'}
+
+
+def _tag_list(tags):
+    return [{'Key': key, 'Value': value} for key, value in tags.items()]
+
+
+def _page(items, token, size=PAGE_SIZE):
+    """Return (page, next token) for an offset token."""
+    start = int(token or 0)
+    end = start + size
+    return items[start:end], (str(end) if end < len(items) else None)
+
+
+class FakeAccount:
+    def __init__(self, size, tagged_ratio=0.5, required_tags=None, mix=None, now=None):
+        self.required_tags = required_tags or {'map-migrated': 'mig123'}
+        self.calls = Counter()
+        self.written = set()
+        self._lock = threading.Lock()
+        self.resources = {}    # id -> {'kind', 'id', 'arn', 'tags', ...}
+        self.by_kind = {kind: [] for kind in _PREFIX}
+        self.by_arn = {}
+        self._listings = {}
+        now = now or datetime.now(timezone.utc)
+
+        mix = mix or DEFAULT_MIX
+        total = sum(mix.values())
+        for kind, share in mix.items():
+            count = int(round(size * share / total))
+            for n in range(count):
+                ident = f'{_PREFIX[kind]}{n:08x}'
+                tagged = n < count * tagged_ratio
+                resource = {'kind': kind, 'id': ident, 'arn': _arn(kind, ident),
+                            'tags': dict(self.required_tags) if tagged else {}}
+                if kind == 'snapshot':
+                    resource['created'] = now - timedelta(minutes=n)
+                self.resources[ident] = resource
+                self.by_kind[kind].append(resource)
+                self.by_arn[resource['arn']] = resource
+        # One volume attached to each of the first instances.
+        self.attached = {}    # instance id -> volumes
+        for instance, volume in zip(self.by_kind['instance'], self.by_kind['volume']):
+            volume['attached'] = instance['id']
+            self.attached[instance['id']] = [volume]
+
+    # -- hooking -----------------------------------------------------------
+
+    def install(self, session):
+        """Answer every call made by clients later built from `session` (a boto3 Session)."""
+        session.events.register('before-parameter-build', self._capture)
+        session.events.register('before-call', self._respond)
+
+    def _capture(self, params, context, **kwargs):
+        context['fake_params'] = dict(params)
+
+    def _respond(self, model, context, **kwargs):
+        service = model.service_model.service_name
+        operation = xform_name(model.name)
+        params = context.get('fake_params', {})
+        with self._lock:
+            self.calls[(service, operation)] += 1
+            handler = getattr(self, f'_{service.replace("-", "_")}_{operation}', None)
+            result = handler(params) if handler else {}
+        status, parsed = result if isinstance(result, tuple) else (200, result)
+        parsed.setdefault('ResponseMetadata', {'HTTPStatusCode': status, 'HTTPHeaders': {}})
+        return AWSResponse('https://fake.invalid/', status, {}, None), parsed
+
+    # -- inspection --------------------------------------------------------
+
+    def untagged(self):
+        """Resources still missing a required tag."""
+        return [resource for resource in self.resources.values()
+                if any(resource['tags'].get(key) != value for key, value in self.required_tags.items())]
+
+    def _listing(self, name, token, build):
+        """Build a listing on its first page and serve later pages from the same list."""
+        if not token or name not in self._listings:
+            self._listings[name] = build()
+        return self._listings[name]
+
+    def _write(self, resource, tags, replace=False):
+        resource['tags'] = dict(tags) if replace else dict(resource['tags'], **tags)
+        self.written.add(resource['id'])
+
+    # -- Resource Groups Tagging API ---------------------------------------
+
+    def _resourcegroupstaggingapi_get_resources(self, params):
+        if 'ResourceARNList' in params:
+            found = [self.by_arn[arn] for arn in params['ResourceARNList'] if arn in self.by_arn]
+            page, token = [r for r in found if r['tags']], None
+        else:
+            token = params.get('PaginationToken')
+            tagged = self._listing('get_resources', token, lambda: [r for r in self.resources.values() if r['tags']])
+            page, token = _page(tagged, token, 100)
+        response = {'ResourceTagMappingList': [{'ResourceARN': r['arn'], 'Tags': _tag_list(r['tags'])} for r in page]}
+        if token:
+            response['PaginationToken'] = token
+        return response
+
+    def _resourcegroupstaggingapi_tag_resources(self, params):
+        for arn in params['ResourceARNList']:
+            if arn in self.by_arn:
+                self._write(self.by_arn[arn], params['Tags'])
+        return {'FailedResourcesMap': {}}
+
+    # -- EC2 ---------------------------------------------------------------
+
+    def _ec2_resources(self):
+        return self.by_kind['instance'] + self.by_kind['volume'] + self.by_kind['snapshot']
+
+    def _ec2_describe_tags(self, params):
+        keys = set()
+        for flt in params.get('Filters', []):
+            if flt['Name'] == 'key':
+                keys.update(flt['Values'])
+        tags = self._listing('describe_tags', params.get('NextToken'), lambda: [
+            {'ResourceId': r['id'], 'ResourceType': r['kind'], 'Key': key, 'Value': value}
+            for r in self._ec2_resources() for key, value in r['tags'].items() if key in keys])
+        page, token = _page(tags, params.get('NextToken'), params.get('MaxResults', PAGE_SIZE))
+        return dict({'Tags': page}, **({'NextToken': token} if token else {}))
+
+    def _ec2_listing(self, params, kind, key, item):
+        resources = self.by_kind[kind]
+        for flt in params.get('Filters', []):
+            if flt['Name'] == 'attachment.instance-id':
+                attached = [r for ident in flt['Values'] for r in self.attached.get(ident, [])]
+                resources = [r for r in attached if r['kind'] == kind]
+            elif flt['Name'] == 'start-time':
+                days = tuple(value.rstrip('*') for value in flt['Values'])
+                resources = [r for r in resources if r['created'].strftime('%Y-%m-%d').startswith(days)]
+        page, token = _page(resources, params.get('NextToken'))
+        return dict({key: [item(r) for r in page]}, **({'NextToken': token} if token else {}))
+
+    def _ec2_describe_instances(self, params):
+        return self._ec2_listing(params, 'instance', 'Reservations',
+                                 lambda r: {'Instances': [{'InstanceId': r['id'], 'Tags': _tag_list(r['tags'])}]})
+
+    def _ec2_describe_volumes(self, params):
+        return self._ec2_listing(params, 'volume', 'Volumes', lambda r: {'VolumeId': r['id'], 'Tags': _tag_list(r['tags'])})
+
+    def _ec2_describe_snapshots(self, params):
+        return self._ec2_listing(params, 'snapshot', 'Snapshots', lambda r: {
+            'SnapshotId': r['id'], 'StartTime': r['created'], 'Tags': _tag_list(r['tags'])})
+
+    def _ec2_create_tags(self, params):
+        tags = {tag['Key']: tag['Value'] for tag in params['Tags']}
+        for ident in params['Resources']:
+            if ident in self.resources:
+                self._write(self.resources[ident], tags)
+        return {}
+
+    # -- RDS and ElastiCache -----------------------------------------------
+
+    def _marker_listing(self, params, kind, key, item):
+        page, marker = _page(self.by_kind[kind], params.get('Marker'), 100)
+        return dict({key: [item(r) for r in page]}, **({'Marker': marker} if marker else {}))
+
+    def _rds_describe_db_instances(self, params):
+        return self._marker_listing(params, 'db', 'DBInstances', lambda r: {'DBInstanceArn': r['arn']})
+
+    def _elasticache_describe_cache_clusters(self, params):
+        return self._marker_listing(params, 'cache', 'CacheClusters', lambda r: {'CacheClusterId': r['id'], 'ARN': r['arn']})
+
+    def _list_tags(self, params):
+        return {'TagList': _tag_list(self.by_arn[params['ResourceName']]['tags'])}
+
+    def _add_tags(self, params):
+        self._write(self.by_arn[params['ResourceName']], {tag['Key']: tag['Value'] for tag in params['Tags']})
+        return {}
+
+    _rds_list_tags_for_resource = _elasticache_list_tags_for_resource = _list_tags
+    _rds_add_tags_to_resource = _elasticache_add_tags_to_resource = _add_tags
+
+    # -- S3 ----------------------------------------------------------------
+
+    def _s3_list_buckets(self, params):
+        return {'Buckets': [{'Name': r['id']} for r in self.by_kind['bucket']]}
+
+    def _s3_get_bucket_tagging(self, params):
+        tags = self.resources[params['Bucket']]['tags']
+        if not tags:
+            return 404, {'Error': {'Code': 'NoSuchTagSet', 'Message': 'The TagSet does not exist'}}
+        return {'TagSet': _tag_list(tags)}
+
+    def _s3_put_bucket_tagging(self, params):
+        self._write(self.resources[params['Bucket']], {tag['Key']: tag['Value'] for tag in params['Tagging']['TagSet']},
+                    replace=True)
+        return {}
+
+    # -- CloudTrail events -------------------------------------------------
+
+    def creation_events(self):
+        """EventBridge events announcing every instance, RDS instance and bucket, as the event mode receives them."""
+        for resource in self.by_kind['instance']:
+            yield {'source': 'aws.ec2', 'region': REGION, 'account': ACCOUNT, 'detail': {
+                'eventName': 'RunInstances', 'responseElements': {'instancesSet': {'items': [{'instanceId': resource['id']}]}}}}
+        for resource in self.by_kind['db']:
+            yield {'source': 'aws.rds', 'region': REGION, 'account': ACCOUNT, 'detail': {
+                'eventName': 'CreateDBInstance', 'responseElements': {'dBInstanceArn': resource['arn']}}}
+        for resource in self.by_kind['bucket']:
+            yield {'source': 'aws.s3', 'region': REGION, 'account': ACCOUNT, 'detail': {
+                'eventName': 'CreateBucket', 'requestParameters': {'bucketName': resource['id']}}}
@@ -0,0 +1,152 @@
+"""Offline scale benchmark: run index.main's sweep modes against synthetic accounts.
+
+Every (mode, size) pair runs in a fresh interpreter against a FakeAccount,
+so nothing touches AWS and peak RSS covers that run only. The modes are:
+
+    event             every instance, RDS instance and bucket arrives as a
+                      creation event, in SQS batches of 100 records
+    reconcile         one scheduled reconciliation with no tag ledger
+    reconcile-repeat  a second scheduled reconciliation after a first one
+                      filled an in-memory tag ledger (the steady state)
+
+Each run reports wall time, API calls per operation, peak RSS and calls per
+resource tagged. Results are appended to benchmarks/results/scale.jsonl with
+the current commit, and each line is compared with the previous result for
+the same mode, size and tagged ratio.
+
+    python benchmarks/scale.py --sizes 1000 10000 --tagged-ratio 0.5
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LAMBDA_DIR = os.path.join(ROOT, 'lambda')
+RESULTS = os.path.join(ROOT, 'benchmarks', 'results', 'scale.jsonl')
+
+MODES = ('event', 'reconcile', 'reconcile-repeat')
+BATCH_SIZE = 100
+
+
+def run_scenario(mode, size, tagged_ratio=0.5):
+    """Run one mode in this process against a fresh FakeAccount and return its measurements."""
+    if LAMBDA_DIR not in sys.path:
+        sys.path.insert(0, LAMBDA_DIR)
+    import clients
+    import index
+    import ledger
+    from benchmarks.fake_account import ACCOUNT, REGION, FakeAccount
+
+    account = FakeAccount(size, tagged_ratio)
+    required = json.dumps(account.required_tags)
+    os.environ['tags'] = required
+    clients.reset_clients()
+    import boto3
+    session = boto3.session.Session(region_name=REGION)
+    account.install(session)
+    clients._sessions[None] = session
+    ledger._ledger = ledger.Ledger(ledger.SqliteStore()) if mode == 'reconcile-repeat' else None
+
+    scheduled = {'source': 'aws.events', 'detail-type': 'Scheduled Event', 'region': REGION, 'account': ACCOUNT}
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            if mode == 'reconcile-repeat':
+                index.main(scheduled, None)
+                account.calls.clear()
+                account.written.clear()
+            started = time.perf_counter()
+            if mode == 'event':
+                events = list(account.creation_events())
+                for start in range(0, len(events), BATCH_SIZE):
+                    records = [{'messageId': str(n), 'body': json.dumps(event)}
+                               for n, event in enumerate(events[start:start + BATCH_SIZE], start)]
+                    index.main({'Records': records}, None)
+            else:
+                index.main(scheduled, None)
+            wall = time.perf_counter() - started
+    finally:
+        clients.reset_clients()
+        ledger._ledger = None
+
+    calls = sum(account.calls.values())
+    return {
+        'mode': mode,
+        'size': size,
+        'tagged_ratio': tagged_ratio,
+        'wall_seconds': round(wall, 3),
+        'api_calls': calls,
+        'calls_by_operation': {f'{service}.{operation}': count for (service, operation), count in sorted(account.calls.items())},
+        'resources_tagged': len(account.written),
+        'calls_per_tagged': round(calls / len(account.written), 2) if account.written else None,
+        'still_untagged': len(account.untagged()),
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+
+
+def _child(mode, size, tagged_ratio):
+    output = subprocess.run([sys.executable, os.path.abspath(__file__), '--child', mode, str(size), str(tagged_ratio)],
+                            cwd=ROOT, capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def _commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _previous(result):
+    if not os.path.exists(RESULTS):
+        return None
+    last = None
+    with open(RESULTS) as history:
+        for line in history:
+            entry = json.loads(line)
+            if (entry['mode'], entry['size'], entry['tagged_ratio']) == (result['mode'], result['size'], result['tagged_ratio']):
+                last = entry
+    return last
+
+
+def _change(now, before):
+    if not before:
+        return ''
+    return f"{(now - before) / before:+.0%}" if before else ''
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000])
+    parser.add_argument('--modes', nargs='+', choices=MODES, default=list(MODES))
+    parser.add_argument('--tagged-ratio', type=float, default=0.5)
+    parser.add_argument('--no-save', action='store_true', help='print results without appending them to the history')
+    args = parser.parse_args()
+
+    commit = _commit()
+    print(f"{'mode':<18}{'size':>8}{'wall s':>10}{'calls':>9}{'calls/tag':>11}{'rss MB':>9}   vs previous (wall, calls)")
+    for size in args.sizes:
+        for mode in args.modes:
+            result = dict(_child(mode, size, args.tagged_ratio), commit=commit, recorded_at=int(time.time()))
+            before = _previous(result) or {}
+            print(f"{mode:<18}{size:>8}{result['wall_seconds']:>10.2f}{result['api_calls']:>9}"
+                  f"{result['calls_per_tagged'] or 0:>11}{result['peak_rss_mb']:>9}   "
+                  f"{_change(result['wall_seconds'], before.get('wall_seconds'))} {_change(result['api_calls'], before.get('api_calls'))}")
+            if not args.no_save:
+                os.makedirs(os.path.dirname(RESULTS), exist_ok=True)
+                with open(RESULTS, 'a') as history:
+                    history.write(json.dumps(result, sort_keys=True) + '\n')
+
+
+if __name__ == '__main__':
+    if len(sys.argv) == 5 and sys.argv[1] == '--child':
+        sys.path.insert(0, ROOT)
+        print(json.dumps(run_scenario(sys.argv[2], int(sys.argv[3]), float(sys.argv[4]))))
+    else:
+        main()
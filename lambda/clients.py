@@ -0,0 +1,110 @@
+import os
+import threading
+import time
+
+from metrics import METRICS_ENABLED, metrics
+from ratelimit import limiter
+
+# One connection per sweep worker so concurrent calls on a shared client never
+# wait on the urllib3 pool.
+MAX_WORKERS = int(os.getenv('SWEEP_MAX_WORKERS', '10'))
+
+# Route every client through the shared per-operation rate limiter.
+RATE_LIMIT_ENABLED = os.getenv('RATE_LIMIT_ENABLED', 'true').lower() == 'true'
+
+# Module-level state survives across warm invocations of the same container.
+_sessions = {}
+_clients = {}
+_lock = threading.Lock()
+_stats = {'hits': 0, 'misses': 0, 'construction_seconds': 0.0}
+_config = None
+
+
+def client_config():
+    # boto3 and botocore take a couple of hundred milliseconds to import, so
+    # they are loaded with the first client instead of with the handler.
+    global _config
+    if _config is None:
+        from botocore.config import Config
+        _config = Config(
+            max_pool_connections=MAX_WORKERS,
+            tcp_keepalive=True,
+            retries={'mode': 'adaptive', 'max_attempts': 5},
+        )
+    return _config
+
+
+def _credentials_key(credentials):
+    if not credentials:
+        return None
+    return (credentials.get('AccessKeyId'), credentials.get('SecretAccessKey'), credentials.get('SessionToken'))
+
+
+def _session(credentials_key):
+    session = _sessions.get(credentials_key)
+    if session is None:
+        import boto3
+        if credentials_key is None:
+            session = boto3.session.Session()
+        else:
+            access_key, secret_key, token = credentials_key
+            session = boto3.session.Session(aws_access_key_id=access_key, aws_secret_access_key=secret_key,
+                                            aws_session_token=token)
+        _sessions[credentials_key] = session
+    return session
+
+
+def get_client(service, region_name=None, credentials=None):
+    """Return a cached boto3 client for (service, region, credentials).
+
+    `credentials` is an STS-style dict with AccessKeyId, SecretAccessKey and
+    SessionToken; omit it to use the function's own role.
+    """
+    region = region_name or os.getenv('AWS_REGION') or os.getenv('AWS_DEFAULT_REGION')
+    key = (service, region, _credentials_key(credentials))
+    client = _clients.get(key)
+    if client is not None:
+        # += on a dict entry is not atomic across threads.
+        with _lock:
+            _stats['hits'] += 1
+        return client
+
+    # Sessions are not thread-safe, so construction is serialised.
+    with _lock:
+        client = _clients.get(key)
+        if client is not None:
+            _stats['hits'] += 1
+            return client
+        started = time.perf_counter()
+        client = _session(key[2]).client(service, region_name=region, config=client_config())
+        if RATE_LIMIT_ENABLED:
+            limiter.attach(client, service)
+        if METRICS_ENABLED:
+            metrics.attach(client, service)
+        _stats['construction_seconds'] += time.perf_counter() - started
+        _stats['misses'] += 1
+        _clients[key] = client
+    return client
+
+
+def preload(services, region_name=None):
+    """Build the clients for `services` now, loading only those services' botocore models.
+
+    Called at import time so the work lands in the Lambda init phase instead of
+    the first invocation.
+    """
+    for service in services:
+        get_client(service, region_name=region_name)
+
+
+def client_stats():
+    """Return hit/miss counts and total seconds spent constructing clients."""
+    return dict(_stats, cached=len(_clients))
+
+
+def reset_clients():
+    """Drop every cached client and session and zero the counters."""
+    with _lock:
+        _clients.clear()
+        _sessions.clear()
+        _stats.update(hits=0, misses=0, construction_seconds=0.0)
@@ -0,0 +1,160 @@
+import json
+import os
+import random
+import threading
+import time
+from datetime import datetime
+
+from clients import get_client
+from logs import log
+
+# Resources that cannot be tagged yet are re-checked by a later invocation
+# instead of a sleeping one: the first re-check runs after RECHECK_BASE_DELAY
+# seconds, each further one waits twice as long (capped at SQS's 900 second
+# maximum delay), and a resource still not ready after RECHECK_MAX_AGE seconds
+# is given up on and left to the scheduled reconciliation.
+RECHECK_QUEUE_URL = os.getenv('RECHECK_QUEUE_URL')
+RECHECK_BASE_DELAY = int(os.getenv('RECHECK_BASE_DELAY', '30'))
+RECHECK_MAX_DELAY = 900
+RECHECK_MAX_AGE = int(os.getenv('RECHECK_MAX_AGE', '3600'))
+
+# A NAT gateway created without an id in the event is found by its subnet and
+# creation time. The search starts NAT_GATEWAY_SINCE_SLACK seconds before the
+# event time, to allow for clock skew between CloudTrail and EC2.
+NAT_GATEWAY_SINCE_SLACK = 60
+
+READY = 'ready'
+PENDING = 'pending'
+GONE = 'gone'
+
+
+def nat_gateway_since(event):
+    """Return the epoch time from which NAT gateways count as created by a CreateNatGateway event."""
+    try:
+        created = datetime.fromisoformat(event['time'].replace('Z', '+00:00')).timestamp()
+    except (KeyError, ValueError):
+        created = time.time()
+    return created - NAT_GATEWAY_SINCE_SLACK
+
+
+def _nat_gateways(job):
+    """NAT gateways created in the job's subnet since the event, once one is available."""
+    client = get_client('ec2', region_name=job['region'])
+    response = client.describe_nat_gateways(Filters=[{'Name': 'subnet-id', 'Values': [job['params']['subnetId']]}])
+    created = [gw for gw in response['NatGateways'] if gw['CreateTime'].timestamp() >= job['params']['since']]
+    if not created:
+        return PENDING, []
+    if all(gw['State'] in ('failed', 'deleting', 'deleted') for gw in created):
+        return GONE, []
+    arns = [f"arn:aws:ec2:{job['region']}:{job['account']}:natgateway/{gw['NatGatewayId']}"
+            for gw in created if gw['State'] == 'available']
+    return (READY, arns) if arns else (PENDING, [])
+
+
+def _status_check(service, describe, param, path, ready, gone):
+    def check(job):
+        response = getattr(get_client(service, region_name=job['region']), describe)(**{param: job['params']['id']})
+        status = path(response)
+        if status in ready:
+            return READY, [job['arn']]
+        if status in gone:
+            return GONE, []
+        return PENDING, []
+    return check
+
+
+CHECKS = {
+    'nat-gateway': _nat_gateways,
+    'msk-cluster': _status_check('kafka', 'describe_cluster_v2', 'ClusterArn',
+                                 lambda r: r['ClusterInfo']['State'], ('ACTIVE',), ('FAILED', 'DELETING')),
+    'elasticache-serverless': _status_check('elasticache', 'describe_serverless_caches', 'ServerlessCacheName',
+                                            lambda r: r['ServerlessCaches'][0]['Status'], ('available',), ('create-failed', 'deleting')),
+    'elasticache-replication-group': _status_check('elasticache', 'describe_replication_groups', 'ReplicationGroupId',
+                                                   lambda r: r['ReplicationGroups'][0]['Status'], ('available',), ('create-failed', 'deleting')),
+    'elasticache-cache-cluster': _status_check('elasticache', 'describe_cache_clusters', 'CacheClusterId',
+                                               lambda r: r['CacheClusters'][0]['CacheClusterStatus'], ('available',), ('deleting', 'deleted')),
+    'dynamodb-table': _status_check('dynamodb', 'describe_table', 'TableName',
+                                    lambda r: r['Table']['TableStatus'], ('ACTIVE',), ('DELETING',)),
+}
+
+
+class SqsDelayQueue:
+    """Delivers each job back to the function through an SQS queue with a per-message delay."""
+
+    def __init__(self, queue_url, client=None):
+        self.queue_url = queue_url
+        self.client = client or get_client('sqs')
+
+    def send(self, job, delay):
+        self.client.send_message(QueueUrl=self.queue_url, MessageBody=json.dumps({'recheck': job}),
+                                 DelaySeconds=int(min(delay, RECHECK_MAX_DELAY)))
+
+
+class LocalDelayQueue:
+    """In-process stand-in for tests and local runs; due() hands back the jobs whose delay has passed."""
+
+    def __init__(self):
+        self.jobs = []
+        self._lock = threading.Lock()
+
+    def send(self, job, delay):
+        with self._lock:
+            self.jobs.append((time.time() + delay, job))
+
+    def due(self, now=None):
+        now = now or time.time()
+        with self._lock:
+            ready = [job for when, job in self.jobs if when <= now]
+            self.jobs = [(when, job) for when, job in self.jobs if when > now]
+        return ready
+
+
+_queue = None
+
+
+def get_queue():
+    global _queue
+    if _queue is None:
+        if RECHECK_QUEUE_URL:
+            _queue = SqsDelayQueue(RECHECK_QUEUE_URL)
+        else:
+            log.warning("RECHECK_QUEUE_URL is not set; deferred re-checks only live as long as this process")
+            _queue = LocalDelayQueue()
+    return _queue
+
+
+def _schedule(job, queue=None):
+    age = time.time() - job['first_seen']
+    if age > RECHECK_MAX_AGE:
+        log.resources('recheck', 'failed', [job.get('arn') or json.dumps(job['params'])], service=job['check'],
+                      error=f"not ready after {int(age)} seconds")
+        return False
+    delay = min(RECHECK_BASE_DELAY * 2 ** job['attempt'], RECHECK_MAX_DELAY)
+    (queue or get_queue()).send(job, delay * random.uniform(0.8, 1.2))
+    return True
+
+
+def defer(check, region, params, arn=None, account=None, queue=None):
+    """Queue a re-check for a resource that is not ready to be tagged yet."""
+    job = {'check': check, 'region': region, 'account': account, 'arn': arn, 'params': params,
+           'attempt': 0, 'first_seen': time.time()}
+    log.info("Deferring a re-check", service=check, arn=arn, params=params)
+    return _schedule(job, queue)
+
+
+def recheck(job, queue=None):
+    """Run a deferred check once and return the ARNs that are now ready to tag.
+
+    A resource that is still pending is queued again with a longer delay; a
+    failed check counts as pending.
+    """
+    try:
+        status, arns = CHECKS[job['check']](job)
+    except Exception as e:
+        log.warning("Error re-checking resource", service=job['check'], arn=job.get('arn'), params=job['params'], error=str(e))
+        status, arns = PENDING, []
+    if status == PENDING:
+        _schedule(dict(job, attempt=job['attempt'] + 1), queue)
+    elif status == GONE:
+        log.warning("Resource will never become ready, dropping it", service=job['check'], arn=job.get('arn'), params=job['params'])
+    return arns
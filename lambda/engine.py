@@ -0,0 +1,409 @@
+import os
+import time
+from datetime import datetime, timedelta, timezone
+
+import jmespath
+
+from clients import get_client
+from executor import map_resources
+from journal import get_journal
+from ledger import GET_BATCH_SIZE, get_ledger, tags_hash
+from logs import log
+from profiling import phase
+from registry import partition_for, type_by_kind, types_in_group
+from tagging import TagWriter, chunked, tag_delta
+
+# EC2 Describe* calls accept at most 200 values per filter.
+EC2_FILTER_VALUES = 200
+
+# Types with a creation-time filter (snapshots, AMIs) are listed incrementally
+# once a full pass has been recorded in the tag ledger: only the days since the
+# newest creation time seen are listed, and a full pass is made again every
+# WATERMARK_FULL_SWEEP_SECONDS or when the watermark is more than
+# WATERMARK_MAX_DAYS old.
+WATERMARK_FULL_SWEEP_SECONDS = int(os.getenv('WATERMARK_FULL_SWEEP_SECONDS', str(7 * 24 * 3600)))
+WATERMARK_MAX_DAYS = 30
+
+
+def parse_tags(shape, raw):
+    """Turn a service's tag representation into {key: value}."""
+    if not raw:
+        return {}
+    if shape == 'map':
+        return dict(raw)
+    if shape == 'kms':
+        return {tag['TagKey']: tag['TagValue'] for tag in raw}
+    return {tag['Key']: tag['Value'] for tag in raw}
+
+
+def format_tags(shape, tags):
+    """Turn {key: value} into the representation a service's write call expects."""
+    if shape == 'map':
+        return dict(tags)
+    if shape == 'kms':
+        return [{'TagKey': key, 'TagValue': value} for key, value in tags.items()]
+    return [{'Key': key, 'Value': value} for key, value in tags.items()]
+
+
+def _param(name, value):
+    """Build the call parameter for `name`: 'Ids[]' wraps value in a list, 'A.B' nests it."""
+    if name.endswith('[]'):
+        name = name[:-2]
+        value = value if isinstance(value, list) else [value]
+    *outer, inner = name.split('.')
+    params = {inner: value}
+    for key in reversed(outer):
+        params = {key: params}
+    return params
+
+
+def iter_items(client, rtype, params=None):
+    """Yield listed items one page at a time.
+
+    Every operation with a botocore paginator is paged through to the end;
+    the few without one (DescribeAddresses, ListDomainNames) return everything
+    in a single response.
+    """
+    params = dict(rtype.list_params, **(params or {}))
+    if client.can_paginate(rtype.list_op):
+        for page in client.get_paginator(rtype.list_op).paginate(**params):
+            yield from jmespath.search(rtype.items, page) or []
+    else:
+        yield from jmespath.search(rtype.items, getattr(client, rtype.list_op)(**params)) or []
+
+
+def _listed(client, rtype):
+    """Yield (item, parent id) pairs, walking the parent type first when there is one."""
+    if not rtype.parent:
+        for item in iter_items(client, rtype):
+            yield item, None
+        return
+    parent = type_by_kind(rtype.parent)
+    for parent_item, _ in _listed(client, parent):
+        parent_id = jmespath.search(parent.id, parent_item)
+        for item in iter_items(client, rtype, {rtype.parent_param: parent_id}):
+            yield item, parent_id
+
+
+def _guarded(listed, rtype, summary):
+    """Stop the stream on a listing error instead of failing the whole sweep."""
+    try:
+        yield from listed
+    except Exception as e:
+        log.error("Error listing resources", service=rtype.kind, error=str(e))
+        summary['error'] = e
+
+
+def ledger_key(rtype, ident, parent_id, region, account):
+    """Identify a listed resource in the tag ledger before any per-item call is made."""
+    if isinstance(ident, str) and ident.startswith('arn:'):
+        return ident
+    if rtype.arn_template:
+        return rtype.arn_template.format(partition=partition_for(region), region=region, account=account, id=ident)
+    scope = f'{parent_id}/{ident}' if parent_id else ident
+    return f'{rtype.service}:{region}:{account}:{scope}'
+
+
+def _unverified(entries, key_of, ledger, digest, summary):
+    """Drop entries the ledger verified recently, looking them up a batch at a time."""
+    for chunk in chunked(entries, GET_BATCH_SIZE):
+        fresh = ledger.fresh([key_of(entry) for entry in chunk], digest)
+        for entry in chunk:
+            if key_of(entry) in fresh:
+                summary['skipped'] += 1
+            else:
+                yield entry
+
+
+def resource_arn(rtype, item, ident, region, account):
+    if rtype.arn:
+        return jmespath.search(rtype.arn, item)
+    if rtype.arn_template:
+        return rtype.arn_template.format(partition=partition_for(region), region=region, account=account, id=ident)
+    return None
+
+
+def write_target(rtype, item, ident, region, account):
+    """Return the ARN or id the type's write call takes for a listed item, or None if the listing lacks it."""
+    target = ident if rtype.target == 'id' else resource_arn(rtype, item, ident, region, account)
+    return target if isinstance(target, str) else None
+
+
+def read_tags(client, rtype, item, target):
+    """Return the item's current tags, from the listing itself when it carries them."""
+    if rtype.tags:
+        return parse_tags(rtype.tag_shape, jmespath.search(rtype.tags, item))
+    if not rtype.read:
+        return {}
+    from botocore.exceptions import ClientError
+    op, param, path = rtype.read
+    try:
+        response = getattr(client, op)(**_param(param, target))
+    except ClientError as e:
+        if e.response['Error']['Code'] in rtype.missing_codes:
+            return {}
+        raise
+    return parse_tags(rtype.tag_shape, jmespath.search(path, response))
+
+
+def write_tags(client, rtype, targets, tags):
+    op, id_param, tags_param = rtype.write
+    params = _param(id_param, targets)
+    params.update(_param(tags_param, format_tags(rtype.tag_shape, tags)))
+    with phase('writes'):
+        getattr(client, op)(**params)
+
+
+def sweep_type(rtype, region, account, required_tags, ledger=None):
+    """List every resource of one registry type and bring its tags up to `required_tags`.
+
+    Listing, diffing and writing form one pipeline: pages are pulled lazily as
+    the bounded worker window drains, reads and single-resource writes run on
+    the service's worker pool, and types whose write call takes a list of
+    identifiers are grouped by identical delta and written `write_batch` at a
+    time. Memory holds a page, the in-flight window and the partial batches,
+    whatever the account size.
+
+    With a tag ledger, resources verified against the same tag set within its
+    TTL are skipped before any per-item call, and every resource found
+    compliant or tagged is recorded. Types whose listing already carries the
+    tags gain nothing from it and bypass it. Returns {'kind', 'examined',
+    'skipped', 'tagged', 'failed'}.
+    """
+    client = get_client(rtype.service, region_name=region)
+    summary = {'kind': rtype.kind, 'examined': 0, 'skipped': 0, 'tagged': 0, 'failed': []}
+    ledger = None if rtype.tags else (ledger or get_ledger())
+    digest = tags_hash(required_tags)
+
+    def key_of(entry):
+        item, parent_id = entry
+        return ledger_key(rtype, jmespath.search(rtype.id, item), parent_id, region, account)
+
+    def verified(keys):
+        if ledger:
+            ledger.record(keys, digest)
+
+    def journaled(targets, tags, error):
+        # The kind lets replay() write identifiers that are not ARNs with this type's own call.
+        get_journal().record(targets, region, tags, error, service=rtype.service, kind=rtype.kind)
+
+    writer = None
+    if rtype.write_batch > 1:
+        writer = TagWriter(client, rtype.write_batch, write=lambda targets, tags: write_tags(client, rtype, targets, tags),
+                           service=rtype.kind, on_written=lambda targets: verified([ledger_key(rtype, target, None, region, account) for target in targets]),
+                           on_failed=journaled)
+
+    def process(entry):
+        item, parent_id = entry
+        ident = jmespath.search(rtype.id, item)
+        key = ledger_key(rtype, ident, parent_id, region, account)
+        if rtype.detail:
+            op, params, path = rtype.detail
+            response = getattr(client, op)(**{key: value.format(id=ident, parent=parent_id) for key, value in params.items()})
+            item = jmespath.search(path, response)
+        if rtype.where and not jmespath.search(rtype.where, item):
+            verified([key])
+            return None
+        arn = resource_arn(rtype, item, ident, region, account)
+        target = arn if rtype.target == 'arn' else ident
+        existing = read_tags(client, rtype, item, target)
+        delta = tag_delta(existing, required_tags)
+        if not delta:
+            verified([key])
+            return None
+        if writer:
+            return target, delta
+        write_tags(client, rtype, target, dict(existing, **delta) if rtype.merge else delta)
+        verified([key])
+        log.resources('tag', 'tagged', [target], service=rtype.kind)
+        return target, None
+
+    def on_result(result):
+        target, delta = result
+        if writer:
+            writer.add(target, delta)
+        else:
+            summary['tagged'] += 1
+
+    entries = _guarded(_listed(client, rtype), rtype, summary)
+    if ledger:
+        entries = _unverified(entries, key_of, ledger, digest, summary)
+    result = map_resources(rtype.service, process, entries, key=lambda entry: entry, on_result=on_result)
+    summary['examined'] = result['processed']
+    for (item, parent_id), e in result['errors']:
+        ident = jmespath.search(rtype.id, item)
+        target = write_target(rtype, item, ident, region, account)
+        failed = target or ledger_key(rtype, ident, parent_id, region, account)
+        log.resources('tag', 'failed', [failed], service=rtype.kind, error=e)
+        # Without a target (an ARN only a detail call returns) the next sweep retries it.
+        if target:
+            journaled([target], required_tags, e)
+        summary['failed'].append(failed)
+    if writer:
+        writer.flush()
+        summary['tagged'] += writer.tagged
+        summary['failed'].extend(writer.failed)
+    if ledger:
+        ledger.flush()
+    return summary
+
+
+def ec2_tag_index(client, keys):
+    """Return {resource id: {key: value}} for every EC2 resource carrying any of `keys`.
+
+    One paginated DescribeTags call, filtered on the keys, covers every EC2
+    resource type at once and returns only the tags that matter for the diff.
+    """
+    index = {}
+    paginator = client.get_paginator('describe_tags')
+    for page in paginator.paginate(Filters=[{'Name': 'key', 'Values': list(keys)}], PaginationConfig={'PageSize': 1000}):
+        for tag in page.get('Tags', []):
+            index.setdefault(tag['ResourceId'], {})[tag['Key']] = tag['Value']
+    return index
+
+
+def _timestamp(value):
+    """Epoch seconds of a datetime or an ISO 8601 string such as an AMI's CreationDate."""
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    return value.timestamp()
+
+
+def _watermark_name(rtype, region, account):
+    return f'watermark:{rtype.service}:{rtype.list_op}:{region}:{account}'
+
+
+def incremental_params(rtype, ledger, digest, region, account, now=None):
+    """Return list params limiting `rtype` to the days since its watermark, or None for a full pass."""
+    if not (ledger and rtype.created_filter):
+        return None
+    now = now or time.time()
+    name = _watermark_name(rtype, region, account)
+    full = ledger.mark(name + ':full', digest)
+    since = ledger.mark(name, digest)
+    if not full or not since or now - full > WATERMARK_FULL_SWEEP_SECONDS:
+        return None
+    first = datetime.fromtimestamp(since, timezone.utc).date()
+    days = (datetime.fromtimestamp(now, timezone.utc).date() - first).days
+    if days > WATERMARK_MAX_DAYS:
+        return None
+    return {'Filters': [{'Name': rtype.created_filter, 'Values': [f'{first + timedelta(days=day)}*' for day in range(days + 1)]}]}
+
+
+def sweep_ec2(rtypes, region, account, required_tags, ledger=None):
+    """Sweep several EC2 registry types against one DescribeTags index.
+
+    Each type's listing is only used for its ids. Ids whose indexed tags differ
+    from `required_tags` are grouped by delta across all the types and written
+    with CreateTags, which takes up to 1000 mixed resource ids per call. When
+    DescribeTags fails, the types are swept one by one from their inline tags.
+
+    With a tag ledger, types that declare a creation-time filter only list the
+    days since the newest resource seen by the last sweep (see
+    incremental_params). A type's watermark only moves when its listing and
+    every write for it succeeded.
+    """
+    client = get_client('ec2', region_name=region)
+    try:
+        tagged = ec2_tag_index(client, required_tags)
+    except Exception as e:
+        log.warning("Error describing EC2 tags, falling back to per-type sweeps", region=region, error=str(e))
+        return [sweep_type(rtype, region, account, required_tags) for rtype in rtypes]
+
+    ledger = ledger or get_ledger()
+    digest = tags_hash(required_tags)
+    waiting = {}   # id -> summary of its type, while the id sits in the writer
+
+    def written(ids):
+        for ident in ids:
+            waiting.pop(ident)['tagged'] += 1
+
+    writer = TagWriter(client, min(rtype.write_batch for rtype in rtypes),
+                       write=lambda ids, tags: write_tags(client, rtypes[0], ids, tags), on_written=written, service='ec2')
+    summaries = []
+    watermarks = []
+    for rtype in rtypes:
+        summary = {'kind': rtype.kind, 'examined': 0, 'skipped': 0, 'tagged': 0, 'failed': []}
+        summaries.append(summary)
+        started = time.time()
+        params = incremental_params(rtype, ledger, digest, region, account, started)
+        newest = None
+        for item in _guarded(iter_items(client, rtype, params), rtype, summary):
+            ident = jmespath.search(rtype.id, item)
+            summary['examined'] += 1
+            if rtype.created_filter:
+                created = _timestamp(jmespath.search(rtype.created, item))
+                newest = max(newest or created, created)
+            delta = tag_delta(tagged.get(ident, {}), required_tags)
+            if delta:
+                waiting[ident] = summary
+                writer.add(ident, delta)
+        if ledger and rtype.created_filter and 'error' not in summary:
+            watermarks.append((rtype, summary, params is None, started, newest))
+    writer.flush()
+    for ident in writer.failed:
+        waiting.pop(ident)['failed'].append(ident)
+
+    # Only move a watermark once everything listed under it has been written.
+    for rtype, summary, full, started, newest in watermarks:
+        if summary['failed']:
+            continue
+        name = _watermark_name(rtype, region, account)
+        newest = newest or (started if full else None)
+        if newest:
+            ledger.set_mark(name, digest, max(newest, ledger.mark(name, digest) or 0))
+        if full:
+            ledger.set_mark(name + ':full', digest, started)
+    return summaries
+
+
+def ec2_attached(client, instance_ids):
+    """Return the ids of every volume and network interface attached to any of `instance_ids`.
+
+    Each describe call is filtered on attachment.instance-id for a whole batch
+    of instances (EC2 accepts up to EC2_FILTER_VALUES values per filter).
+    """
+    ids = []
+    for chunk in chunked(instance_ids, EC2_FILTER_VALUES):
+        filters = [{'Name': 'attachment.instance-id', 'Values': chunk}]
+        for page in client.get_paginator('describe_volumes').paginate(Filters=filters):
+            ids.extend(volume['VolumeId'] for volume in page.get('Volumes', []))
+        for page in client.get_paginator('describe_network_interfaces').paginate(Filters=filters):
+            ids.extend(eni['NetworkInterfaceId'] for eni in page.get('NetworkInterfaces', []))
+    return ids
+
+
+def tag_ec2_launch(region, instance_ids, required_tags):
+    """Tag launched instances and their volumes and network interfaces with as few CreateTags calls as possible.
+
+    A launch of up to 1000 resources is tagged in a single call. Ids that still
+    fail go to the failure journal like any other batched write; if the
+    attachments cannot be listed, the instances are tagged on their own.
+    Returns {'examined', 'tagged', 'failed', 'rejected'}.
+    """
+    client = get_client('ec2', region_name=region)
+    try:
+        attached = ec2_attached(client, instance_ids)
+    except Exception as e:
+        log.warning("Error listing launch attachments, tagging the instances only", region=region, error=str(e))
+        attached = []
+    ids = list(dict.fromkeys(list(instance_ids) + attached))
+    rtype = type_by_kind('EC2 instance')
+    writer = TagWriter(client, rtype.write_batch, write=lambda targets, tags: write_tags(client, rtype, targets, tags),
+                       service='ec2')
+    for ident in ids:
+        writer.add(ident, required_tags)
+    writer.flush()
+    return {'examined': len(ids), 'tagged': writer.tagged, 'failed': writer.failed, 'rejected': writer.rejected}
+
+
+def sweep_group(group, region, account, required_tags, ledger=None):
+    """Sweep every registry type belonging to one aws_* handler.
+
+    EC2 types share one DescribeTags index and one CreateTags writer; every
+    other type is swept on its own, one after another.
+    """
+    rtypes = types_in_group(group)
+    ec2 = [rtype for rtype in rtypes if rtype.service == 'ec2']
+    summaries = sweep_ec2(ec2, region, account, required_tags, ledger) if ec2 else []
+    return summaries + [sweep_type(rtype, region, account, required_tags, ledger) for rtype in rtypes if rtype.service != 'ec2']
@@ -0,0 +1,65 @@
+import os
+
+# The (source, eventName) pairs index.main implements, one entry per aws_*
+# handler. The stack builds its EventBridge rule from this table, and the
+# handler drops anything else before it is parsed, so the two cannot drift
+# apart. The CloudTrail eventSource of source 'aws.<service>' is
+# '<service>.amazonaws.com'. DocumentDB calls arrive as aws.rds events and are
+# tagged by aws_rds; WorkSpaces directories are created through aws.ds, so
+# both are left to the scheduled reconciliation.
+HANDLED_EVENTS = {
+    'aws.ec2': ('RunInstances', 'CreateVolume', 'CreateVpc', 'CreateSubnet', 'CreateRouteTable',
+                'CreateInternetGateway', 'CreateNatGateway', 'AllocateAddress', 'CreateVpcEndpoint',
+                'CreateTransitGateway'),
+    'aws.kafka': ('CreateClusterV2', 'CreateCluster', 'CreateConfiguration'),
+    'aws.rds': ('CreateDBInstance', 'CreateDBCluster', 'CreateDBSubnetGroup', 'CreateDBParameterGroup',
+                'CreateOptionGroup', 'CreateDBClusterParameterGroup', 'CreateDBSnapshot', 'CreateDBClusterSnapshot'),
+    'aws.elasticache': ('CreateServerlessCache', 'CreateReplicationGroup', 'CreateCacheCluster',
+                        'CreateCacheSubnetGroup', 'CreateCacheParameterGroup', 'CreateSnapshot', 'CreateUser'),
+    'aws.memorydb': ('CreateCluster', 'CreateUser'),
+    'aws.eks': ('CreateCluster', 'CreateNodegroup'),
+    'aws.s3': ('CreateBucket',),
+    'aws.lambda': ('CreateFunction20150331',),
+    'aws.dynamodb': ('CreateTable',),
+    'aws.sns': ('CreateTopic',),
+    'aws.sqs': ('CreateQueue',),
+    'aws.elasticfilesystem': ('CreateFileSystem',),
+    'aws.es': ('CreateDomain',),
+    'aws.opensearch': ('CreateDomain',),
+    'aws.kms': ('CreateKey',),
+    'aws.elasticloadbalancing': ('CreateLoadBalancer',),
+    'aws.dms': ('CreateReplicationInstance',),
+    'aws.mq': ('CreateBroker',),
+    'aws.route53resolver': ('CreateResolverEndpoint',),
+    'aws.workspaces': ('CreateWorkspaces',),
+}
+
+
+def event_source(source):
+    """Return the CloudTrail eventSource for an EventBridge source, e.g. 'aws.ec2' -> 'ec2.amazonaws.com'."""
+    return f"{source[len('aws.'):]}.amazonaws.com"
+
+
+def is_handled(event):
+    """Return True if index.main implements the event and the API call it records succeeded."""
+    detail = event.get('detail') or {}
+    return detail.get('eventName') in HANDLED_EVENTS.get(event.get('source'), ()) and not detail.get('errorCode')
+
+# CloudTrail records the function's own CreateTags and TagResource calls like
+# any other API call. The stack also excludes them from the EventBridge rule.
+# The handlers drop any that still arrive before building a client, so
+# tagging never triggers more tagging. SELF_ROLE_ARN is set by the stack. The
+# Lambda session name, which is the function name, covers deployments
+# without it.
+SELF_ROLE_ARN = os.getenv('SELF_ROLE_ARN')
+
+
+def is_self_event(event):
+    """Return True if a CloudTrail event was caused by this function's own role."""
+    identity = (event.get('detail') or {}).get('userIdentity') or {}
+    issuer = ((identity.get('sessionContext') or {}).get('sessionIssuer') or {}).get('arn')
+    if SELF_ROLE_ARN and issuer == SELF_ROLE_ARN:
+        return True
+    function_name = os.getenv('AWS_LAMBDA_FUNCTION_NAME')
+    principal = identity.get('arn') or ''
+    return bool(function_name) and ':assumed-role/' in principal and principal.endswith(f'/{function_name}')
@@ -0,0 +1,85 @@
+import json
+import os
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from clients import MAX_WORKERS
+from logs import log
+from profiling import traced
+
+# Per-service worker counts for tag reads and writes, e.g. '{"ec2": 8, "kms": 2}'.
+# Services not listed use SWEEP_DEFAULT_CONCURRENCY.
+DEFAULT_CONCURRENCY = int(os.getenv('SWEEP_DEFAULT_CONCURRENCY', '4'))
+
+try:
+    SERVICE_CONCURRENCY = json.loads(os.getenv('SWEEP_CONCURRENCY', '{}'))
+except json.JSONDecodeError as e:
+    log.error("Error parsing 'SWEEP_CONCURRENCY' environment variable", error=str(e))
+    SERVICE_CONCURRENCY = {}
+
+
+def concurrency_for(service):
+    """Return the number of workers allowed to call `service` at once."""
+    return max(1, min(int(SERVICE_CONCURRENCY.get(service, DEFAULT_CONCURRENCY)), MAX_WORKERS))
+
+
+def map_resources(service, process, items, key=None, on_result=None):
+    """Run process(item) for every item on a pool bounded by the service's concurrency.
+
+    At most twice the worker count is in flight at once, so `items` may be a
+    lazy generator of any length. Returns {'processed': n, 'results': [...],
+    'errors': [(key(item), exception), ...]}; an exception in one item never
+    stops the others. With `on_result`, each non-None result is handed to
+    on_result(result) on the calling thread as it completes instead of being
+    kept in 'results'.
+    """
+    key = key or (lambda item: item)
+    process = traced(process)
+    workers = concurrency_for(service)
+    summary = {'processed': 0, 'results': [], 'errors': []}
+
+    def collect(done):
+        for future in done:
+            item = in_flight.pop(future)
+            summary['processed'] += 1
+            try:
+                result = future.result()
+            except Exception as e:
+                summary['errors'].append((key(item), e))
+                continue
+            if result is None:
+                continue
+            if on_result:
+                on_result(result)
+            else:
+                summary['results'].append(result)
+
+    in_flight = {}
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for item in items:
+            if len(in_flight) >= workers * 2:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                collect(done)
+            in_flight[pool.submit(process, item)] = item
+        collect(list(in_flight))
+    return summary
+
+
+def run_sweeps(sweeps, max_workers=MAX_WORKERS):
+    """Run independent sweeps concurrently and aggregate their outcome per service.
+
+    `sweeps` maps a service name to a zero-argument callable. Returns
+    {service: {'result': value or None, 'error': exception or None}}.
+    """
+    outcome = {}
+    if not sweeps:
+        return outcome
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(sweeps))) as pool:
+        futures = {pool.submit(traced(sweep)): service for service, sweep in sweeps.items()}
+        for future in futures:
+            service = futures[future]
+            try:
+                outcome[service] = {'result': future.result(), 'error': None}
+            except Exception as e:
+                log.error("Error sweeping", service=service, error=str(e))
+                outcome[service] = {'result': None, 'error': e}
+    return outcome
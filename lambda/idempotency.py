@@ -0,0 +1,165 @@
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from clients import get_client
+from logs import log
+
+# EventBridge delivers at least once and the rule target retries, so one
+# CloudTrail event can reach the function several times. Each event is
+# claimed by its detail.eventID before it is processed. A claim is in flight
+# until the invocation would time out, and at most for
+# IDEMPOTENCY_IN_FLIGHT_SECONDS (no more than the function timeout), so the
+# retry of a crashed or timed-out invocation processes it. A completed event
+# is remembered for IDEMPOTENCY_TTL_SECONDS. Recent claims are kept in an LRU
+# of IDEMPOTENCY_CACHE_SIZE entries per warm container. The conditional-put
+# store shares duplicates across containers. It uses the ledger table unless
+# IDEMPOTENCY_TABLE names another one.
+IDEMPOTENCY_TTL_SECONDS = int(os.getenv('IDEMPOTENCY_TTL_SECONDS', '3600'))
+IDEMPOTENCY_IN_FLIGHT_SECONDS = int(os.getenv('IDEMPOTENCY_IN_FLIGHT_SECONDS', '600'))
+IDEMPOTENCY_CACHE_SIZE = int(os.getenv('IDEMPOTENCY_CACHE_SIZE', '10000'))
+IDEMPOTENCY_TABLE = os.getenv('IDEMPOTENCY_TABLE') or os.getenv('LEDGER_TABLE')
+IDEMPOTENCY_PATH = os.getenv('IDEMPOTENCY_PATH')
+
+IN_FLIGHT = 'in_flight'
+COMPLETE = 'complete'
+
+# Event keys share the ledger table with resource ARNs, so they get a prefix.
+KEY_PREFIX = 'event#'
+
+
+class SqliteStore:
+    """Local stand-in for the DynamoDB conditional put, for tests and runs outside Lambda."""
+
+    def __init__(self, path=':memory:'):
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('CREATE TABLE IF NOT EXISTS events (event_id TEXT PRIMARY KEY, state TEXT, expires_at REAL)')
+        self._lock = threading.Lock()
+
+    def claim(self, key, expires_at, now):
+        """Store `key` as in flight unless an unexpired claim exists; return whether it was stored."""
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                'INSERT INTO events VALUES (?, ?, ?) ON CONFLICT(event_id) DO UPDATE SET state = excluded.state, '
+                'expires_at = excluded.expires_at WHERE events.expires_at < ?', (key, IN_FLIGHT, expires_at, now))
+            return cursor.rowcount == 1
+
+    def complete(self, key, expires_at):
+        with self._lock, self._conn:
+            self._conn.execute('UPDATE events SET state = ?, expires_at = ? WHERE event_id = ?', (COMPLETE, expires_at, key))
+
+    def release(self, key):
+        with self._lock, self._conn:
+            self._conn.execute('DELETE FROM events WHERE event_id = ?', (key,))
+
+
+class DynamoStore:
+    """Claims as items keyed by 'resource' with a conditional PutItem; 'expires_at' doubles as the table TTL."""
+
+    def __init__(self, table, client=None):
+        self.table = table
+        self.client = client or get_client('dynamodb')
+
+    def claim(self, key, expires_at, now):
+        try:
+            self.client.put_item(
+                TableName=self.table,
+                Item={'resource': {'S': key}, 'state': {'S': IN_FLIGHT}, 'expires_at': {'N': str(int(expires_at))}},
+                ConditionExpression='attribute_not_exists(#r) OR expires_at < :now',
+                ExpressionAttributeNames={'#r': 'resource'},
+                ExpressionAttributeValues={':now': {'N': str(int(now))}})
+        except self.client.exceptions.ConditionalCheckFailedException:
+            return False
+        return True
+
+    def complete(self, key, expires_at):
+        self.client.update_item(
+            TableName=self.table, Key={'resource': {'S': key}},
+            UpdateExpression='SET #s = :state, expires_at = :expires',
+            ExpressionAttributeNames={'#s': 'state'},
+            ExpressionAttributeValues={':state': {'S': COMPLETE}, ':expires': {'N': str(int(expires_at))}})
+
+    def release(self, key):
+        self.client.delete_item(TableName=self.table, Key={'resource': {'S': key}})
+
+
+class Idempotency:
+    """Claims CloudTrail event IDs so duplicate deliveries are skipped.
+
+    claim() returns False for an event that is in flight or complete, in
+    this container or, with a store, in any other. Call complete() once the
+    event is handled, or release() if it failed and should be retried.
+    """
+
+    def __init__(self, store=None, cache_size=IDEMPOTENCY_CACHE_SIZE,
+                 ttl=IDEMPOTENCY_TTL_SECONDS, in_flight=IDEMPOTENCY_IN_FLIGHT_SECONDS):
+        self.store = store
+        self.cache_size = cache_size
+        self.ttl = ttl
+        self.in_flight = in_flight
+        self.cache = OrderedDict()   # event id -> (state, expires_at)
+        self._lock = threading.Lock()
+
+    def _remember(self, event_id, state, expires_at):
+        with self._lock:
+            self.cache[event_id] = (state, expires_at)
+            self.cache.move_to_end(event_id)
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+
+    def claim(self, event_id, now=None, in_flight=None):
+        """Claim an event for `in_flight` seconds (the invocation's remaining time), capped at the default."""
+        now = now or time.time()
+        expires_at = now + min(self.in_flight, in_flight or self.in_flight)
+        with self._lock:
+            cached = self.cache.get(event_id)
+        if cached and cached[1] > now:
+            return False
+        if self.store:
+            try:
+                if not self.store.claim(KEY_PREFIX + event_id, expires_at, now):
+                    return False
+            except Exception as e:
+                # Processing twice is better than not at all.
+                log.warning("Error claiming event, processing it anyway", event_id=event_id, error=str(e))
+        self._remember(event_id, IN_FLIGHT, expires_at)
+        return True
+
+    def complete(self, event_id, now=None):
+        expires_at = (now or time.time()) + self.ttl
+        self._remember(event_id, COMPLETE, expires_at)
+        if self.store:
+            try:
+                self.store.complete(KEY_PREFIX + event_id, expires_at)
+            except Exception as e:
+                log.warning("Error completing event", event_id=event_id, error=str(e))
+
+    def release(self, event_id):
+        with self._lock:
+            self.cache.pop(event_id, None)
+        if self.store:
+            try:
+                self.store.release(KEY_PREFIX + event_id)
+            except Exception as e:
+                log.warning("Error releasing event", event_id=event_id, error=str(e))
+
+
+_idempotency = None
+_idempotency_lock = threading.Lock()
+
+
+def get_idempotency():
+    """Return the process-wide claims, backed by IDEMPOTENCY_TABLE or IDEMPOTENCY_PATH when either is set."""
+    global _idempotency
+    if _idempotency is None:
+        with _idempotency_lock:
+            if _idempotency is None:
+                store = None
+                if IDEMPOTENCY_TABLE:
+                    store = DynamoStore(IDEMPOTENCY_TABLE)
+                elif IDEMPOTENCY_PATH:
+                    store = SqliteStore(IDEMPOTENCY_PATH)
+                _idempotency = Idempotency(store)
+    return _idempotency
@@ -0,0 +1,213 @@
+import json
+import os
+import threading
+import time
+
+from clients import get_client
+from logs import log
+from metrics import metrics
+from registry import type_by_kind
+
+# Resources whose tag read or write failed are written to a failure journal
+# (an SQS queue) with the tags they still need and the error class, instead
+# of waiting for the next full sweep. replay() re-attempts only those
+# resources, grouped into batched writes. An entry that fails
+# REPLAY_MAX_ATTEMPTS times is dropped and left to the scheduled
+# reconciliation. Without FAILURE_QUEUE_URL the journal only lives as long
+# as the process.
+FAILURE_QUEUE_URL = os.getenv('FAILURE_QUEUE_URL')
+REPLAY_MAX_ATTEMPTS = int(os.getenv('REPLAY_MAX_ATTEMPTS', '5'))
+REPLAY_LIMIT = int(os.getenv('REPLAY_LIMIT', '1000'))
+
+# SendMessageBatch, ReceiveMessage and DeleteMessageBatch take at most 10 messages.
+SQS_BATCH_SIZE = 10
+# EC2 CreateTags accepts up to 1000 resource ids per call.
+EC2_WRITE_BATCH_SIZE = 1000
+
+
+def error_class(error):
+    """Return the AWS error code of a ClientError, or the exception's type name."""
+    code = getattr(error, 'response', {}).get('Error', {}).get('Code')
+    return code or type(error).__name__
+
+
+class SqsJournal:
+    """Keeps journal entries as messages on an SQS queue, read back by replay()."""
+
+    def __init__(self, queue_url, client=None):
+        self.queue_url = queue_url
+        self.client = client or get_client('sqs')
+
+    def write(self, entries):
+        for start in range(0, len(entries), SQS_BATCH_SIZE):
+            batch = entries[start:start + SQS_BATCH_SIZE]
+            response = self.client.send_message_batch(QueueUrl=self.queue_url, Entries=[
+                {'Id': str(n), 'MessageBody': json.dumps({'failure': entry})} for n, entry in enumerate(batch)])
+            for failed in response.get('Failed', []):
+                log.error("Error journaling failed resource", arn=batch[int(failed['Id'])]['target'],
+                          error=failed.get('Message'))
+
+    def read(self, limit):
+        """Return up to `limit` (receipt handle, entry) pairs."""
+        received = []
+        while len(received) < limit:
+            response = self.client.receive_message(QueueUrl=self.queue_url,
+                                                   MaxNumberOfMessages=min(SQS_BATCH_SIZE, limit - len(received)))
+            messages = response.get('Messages', [])
+            if not messages:
+                break
+            received.extend((message['ReceiptHandle'], json.loads(message['Body'])['failure']) for message in messages)
+        return received
+
+    def delete(self, handles):
+        for start in range(0, len(handles), SQS_BATCH_SIZE):
+            self.client.delete_message_batch(QueueUrl=self.queue_url, Entries=[
+                {'Id': str(n), 'ReceiptHandle': handle} for n, handle in enumerate(handles[start:start + SQS_BATCH_SIZE])])
+
+
+class LocalJournal:
+    """In-process stand-in for tests and local runs."""
+
+    def __init__(self):
+        self.entries = {}
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def write(self, entries):
+        with self._lock:
+            for entry in entries:
+                self.entries[str(self._next)] = entry
+                self._next += 1
+
+    def read(self, limit):
+        with self._lock:
+            return list(self.entries.items())[:limit]
+
+    def delete(self, handles):
+        with self._lock:
+            for handle in handles:
+                self.entries.pop(handle, None)
+
+
+class FailureJournal:
+    """Buffers failed (target, tags, error class) entries and writes them to a sink on flush()."""
+
+    def __init__(self, sink):
+        self.sink = sink
+        self.pending = []
+        self._lock = threading.Lock()
+
+    def record(self, targets, region, tags, error, service=None, attempt=0, kind=None):
+        """Buffer one entry per target; `kind` names the registry type whose write call takes a non-ARN target."""
+        now = time.time()
+        entries = [{'target': target, 'region': region, 'tags': tags, 'service': service, 'kind': kind,
+                    'error_class': error_class(error), 'error': str(error), 'attempt': attempt, 'failed_at': now}
+                   for target in targets]
+        with self._lock:
+            self.pending.extend(entries)
+        metrics.count('journal', journaled=len(entries))
+
+    def flush(self):
+        with self._lock:
+            entries, self.pending = self.pending, []
+        if not entries:
+            return
+        try:
+            self.sink.write(entries)
+        except Exception as e:
+            log.error("Error writing failure journal", entries=len(entries), error=str(e))
+
+
+_journal = None
+_journal_lock = threading.Lock()
+
+
+def get_journal():
+    global _journal
+    if _journal is None:
+        with _journal_lock:
+            if _journal is None:
+                if not FAILURE_QUEUE_URL:
+                    log.warning("FAILURE_QUEUE_URL is not set; the failure journal only lives as long as this process")
+                _journal = FailureJournal(SqsJournal(FAILURE_QUEUE_URL) if FAILURE_QUEUE_URL else LocalJournal())
+    return _journal
+
+
+def _registry_type(entry):
+    """Return the registry type that can write a non-ARN entry's target, or None."""
+    try:
+        if entry.get('kind'):
+            return type_by_kind(entry['kind'])
+        if entry.get('service') == 'ec2':
+            # CreateTags takes the id of any EC2 resource type.
+            return type_by_kind('EC2 instance')
+    except KeyError:
+        pass
+    return None
+
+
+def _writer_for(region, rtype, on_written, on_failed):
+    """Return a TagWriter for ARNs (TagResources) or for `rtype`'s own write call."""
+    from tagging import TagWriter
+    if rtype is None:
+        return TagWriter(get_client('resourcegroupstaggingapi', region_name=region), service='replay',
+                         on_written=on_written, on_failed=on_failed)
+    from engine import read_tags, write_tags
+    client = get_client(rtype.service, region_name=region)
+
+    def write(targets, tags):
+        target = targets if rtype.write_batch > 1 else targets[0]
+        if rtype.merge:
+            tags = dict(read_tags(client, rtype, None, target), **tags)
+        write_tags(client, rtype, target, tags)
+
+    return TagWriter(client, rtype.write_batch, write=write, service='replay', on_written=on_written, on_failed=on_failed)
+
+
+def replay(limit=REPLAY_LIMIT, journal=None):
+    """Re-attempt up to `limit` journaled failures and return a summary.
+
+    Entries are grouped by region and tag set so each group is rewritten with
+    as few TagResources calls as possible. Identifiers that are not ARNs are
+    written with the write call of the registry type they were journaled
+    under (CreateTags for EC2 ids), batched where that call takes a list.
+    Entries that fail again are journaled with their attempt count raised.
+    Entries that name neither an ARN nor a known registry type are dropped.
+    """
+    journal = journal or get_journal()
+    received = journal.sink.read(limit)
+    summary = {'examined': len(received), 'tagged': 0, 'failed': 0, 'dropped': 0}
+    groups = {}
+    for _, entry in received:
+        rtype = None
+        if not entry['target'].startswith('arn:'):
+            rtype = _registry_type(entry)
+            if rtype is None:
+                log.resources('replay', 'dropped', [entry['target']], service=entry.get('service'))
+                summary['dropped'] += 1
+                continue
+        groups.setdefault((entry['region'], rtype and rtype.kind, json.dumps(entry['tags'], sort_keys=True)), []).append(entry)
+
+    for (region, kind, _), entries in groups.items():
+        by_target = {entry['target']: entry for entry in entries}
+
+        def failed(targets, tags, error, region=region, by_target=by_target):
+            retry = [by_target[target] for target in targets if by_target[target]['attempt'] + 1 < REPLAY_MAX_ATTEMPTS]
+            for entry in retry:
+                journal.record([entry['target']], region, entry['tags'], error, entry.get('service'), entry['attempt'] + 1,
+                               kind=entry.get('kind'))
+            summary['failed'] += len(targets)
+            summary['dropped'] += len(targets) - len(retry)
+
+        writer = _writer_for(region, kind and type_by_kind(kind), None, failed)
+        for entry in entries:
+            writer.add(entry['target'], entry['tags'])
+        writer.flush()
+        summary['tagged'] += writer.tagged
+
+    # Failures were journaled again as new entries, so every entry read is done with.
+    journal.flush()
+    journal.sink.delete([handle for handle, _ in received])
+    metrics.count('replay', examined=summary['examined'], tagged=summary['tagged'], failed=summary['failed'])
+    log.info("Replayed failure journal", **summary)
+    return summary
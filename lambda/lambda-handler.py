@@ -1,22 +1,18 @@
-import boto3
 import os
 import json
-import time 
 
-def check_nat_gateway_status(region, nat_gateway_id):
-    """Polls the NAT Gateway status to check if it is in a 'available' state."""
-    ec2_client = boto3.client('ec2', region_name=region)
-    try:
-        response = ec2_client.describe_nat_gateways(NatGatewayIds=[nat_gateway_id])
-        status = response['NatGateways'][0]['State']
-        return status
-    except Exception as e:
-        print(f"Error checking NAT Gateway status: {e}")
-        return None
+from clients import get_client
+from deferred import defer, nat_gateway_since, recheck
+from events import is_self_event
+from journal import get_journal
+from logs import event_fields, log
+from metrics import metrics
+from profiling import phase, profiled
+from tagging import TagWriter
 
 def check_and_tag_resource(resource_arn, region, account_id):
     """Check if resource has tags."""
-    resourcegroupstaggingapi = boto3.client('resourcegroupstaggingapi', region_name=region)
+    resourcegroupstaggingapi = get_client('resourcegroupstaggingapi', region_name=region)
     try:
         # Check if the resource has tags
         response = resourcegroupstaggingapi.get_resources(
@@ -24,86 +20,78 @@ def check_and_tag_resource(resource_arn, region, account_id):
         )
 
         if 'ResourceTagMappingList' in response and len(response['ResourceTagMappingList']) == 0:
-            print(f"Resource {resource_arn} has no tags.")
+            log.debug("Resource has no tags", arn=resource_arn)
         else:
-            print(f"Resource {resource_arn} already has tags.")
+            log.debug("Resource already has tags", arn=resource_arn)
     except Exception as e:
-        print(f"Error checking or tagging resource {resource_arn}: {e}")
+        log.resources('read', 'failed', [resource_arn], error=e)
+
 
 
+def ec2_launch(event):
+    """Tag every instance of a RunInstances launch with its volumes and network interfaces and return the summary.
+
+    The whole launch goes out in one CreateTags call rather than through the tagging API.
+    """
+    log.debug("tagging for new EC2...")
+    from engine import tag_ec2_launch
+    _instanceIds = [item['instanceId'] for item in event['detail']['responseElements']['instancesSet']['items']]
+    _summary = tag_ec2_launch(event['region'], _instanceIds, json.loads(os.environ['tags']))
+    metrics.count('aws_ec2', examined=_summary['examined'], tagged=_summary['tagged'],
+                  failed=len(_summary['failed']), rejected=len(_summary['rejected']))
+    return _summary
 
 def aws_ec2(event):
     arnList = []
     _account = event['account']
     _region = event['region']
-    ec2ArnTemplate = 'arn:aws:ec2:@region@:@account@:instance/@instanceId@'
     volumeArnTemplate = 'arn:aws:ec2:@region@:@account@:volume/@volumeId@'
     resourceArnTemplate = 'arn:aws:ec2:@region@:@account@:resourceName/@resourceId@'
     
-    if event['detail']['eventName'] == 'RunInstances':
-        print("tagging for new EC2...")
-        _instanceId = event['detail']['responseElements']['instancesSet']['items'][0]['instanceId']
-        arnList.append(ec2ArnTemplate.replace('@region@', _region).replace('@account@', _account).replace('@instanceId@', _instanceId))
-
-        ec2_resource = boto3.resource('ec2')
-        _instance = ec2_resource.Instance(_instanceId)
-        for volume in _instance.volumes.all():
-            arnList.append(volumeArnTemplate.replace('@region@', _region).replace('@account@', _account).replace('@volumeId@', volume.id))
-
-    elif event['detail']['eventName'] == 'CreateVolume':
-        print("tagging for new EBS...")
+    # RunInstances is tagged by ec2_launch() rather than returned as ARNs.
+    if event['detail']['eventName'] == 'CreateVolume':
+        log.debug("tagging for new EBS...")
         _volumeId = event['detail']['responseElements']['volumeId']
         arnList.append(volumeArnTemplate.replace('@region@', _region).replace('@account@', _account).replace('@volumeId@', _volumeId))
     elif event['detail']['eventName'] == 'CreateVpc':
-        print("tagging for new VPC...")
+        log.debug("tagging for new VPC...")
         _vpcId = event['detail']['responseElements']['vpc']['vpcId']
         arnList.append(resourceArnTemplate.replace('@region@', _region).replace('@account@', _account).replace('resourceName', 'vpc').replace('@resourceId@', _vpcId))
         
     elif event['detail']['eventName'] == 'CreateInternetGateway':
-        print("tagging for new IGW...")
+        log.debug("tagging for new IGW...")
         _igwId = event['detail']['responseElements']['internetGateway']['internetGatewayId']
         arnList.append(resourceArnTemplate.replace('@region@', _region).replace('@account@', _account).replace('resourceName', 'internet-gateway').replace('@resourceId@', _igwId))
         
     elif event['detail']['eventName'] == 'CreateNatGateway':
-        print("Processing NAT Gateway creation...")
+        log.debug("Processing NAT Gateway creation...")
         _natgwResponse = event['detail']['responseElements'].get('CreateNatGatewayResponse', {})
         if 'natGateway' in _natgwResponse:
             _natgwId = _natgwResponse['natGateway'].get('natGatewayId')
             if _natgwId:
-                print(f"Found NAT Gateway ID: {_natgwId}")
+                log.debug("Found NAT Gateway ID", resource_id=_natgwId)
                 arn = resourceArnTemplate.replace('@region@', _region).replace('@account@', _account).replace('resourceName', 'natgateway').replace('@resourceId@', _natgwId)
                 arnList.append(arn)
                 check_and_tag_resource(arn, _region, _account)
             else:
-                print("NAT Gateway ID not found immediately, polling for status...")
-                retries = 5
-                while retries > 0:
-                    print(f"Retrying... {retries} attempts left.")
-                    time.sleep(10)  # Delay before retrying
-                    status = check_nat_gateway_status(_region, _natgwId)
-                    if status == 'available':
-                        print(f"NAT Gateway {natgwId} is now available.")
-                        arn = resourceArnTemplate.replace('@region@', _region).replace('@account@', _account).replace('resourceName', 'natgateway').replace('@resourceId@', _natgwId)
-                        arnList.append(arn)
-                        check_and_tag_resource(arn, _region, _account)
-                        break
-                    retries -= 1
-                if retries == 0:
-                    print(f"Failed to get NAT Gateway ID for {natgwId} after retries.")
+                log.debug("NAT Gateway ID not found immediately, deferring a re-check...")
+                _subnetId = event['detail'].get('requestParameters', {}).get('CreateNatGatewayRequest', {}).get('SubnetId')
+                if _subnetId:
+                    defer('nat-gateway', _region, {'subnetId': _subnetId, 'since': nat_gateway_since(event)}, account=_account)
         else:
-            print("NAT Gateway creation failed or did not include the expected information.")
+            log.debug("NAT Gateway creation failed or did not include the expected information.")
     elif event['detail']['eventName'] == 'AllocateAddress':
-        print("tagging for new EIP...")
+        log.debug("tagging for new EIP...")
         _allocationId = event['detail']['responseElements']['allocationId']
         arnList.append(resourceArnTemplate.replace('@region@', _region).replace('@account@', _account).replace('resourceName', 'natgateway').replace('@resourceId@', _allocationId))
         
     elif event['detail']['eventName'] == 'CreateVpcEndpoint':
-        print("tagging for new VPC Endpoint...")
+        log.debug("tagging for new VPC Endpoint...")
         _vpceId = event['detail']['responseElements']['CreateVpcEndpointResponse']['vpcEndpoint']['vpcEndpointId']
         arnList.append(resourceArnTemplate.replace('@region@', _region).replace('@account@', _account).replace('resourceName', 'vpc-endpoint').replace('@resourceId@', _vpceId))        
         
     elif event['detail']['eventName'] == 'CreateTransitGateway':
-        print("tagging for new Transit Gateway...")
+        log.debug("tagging for new Transit Gateway...")
         arnList.append(event['detail']['responseElements']['CreateTransitGatewayResponse']['transitGateway']['transitGatewayArn'])
     
     
@@ -112,7 +100,7 @@ def aws_ec2(event):
 def aws_elasticloadbalancing(event):
     arnList = []
     if event['detail']['eventName'] == 'CreateLoadBalancer':
-        print("tagging for new LoadBalancer...")
+        log.debug("tagging for new LoadBalancer...")
         lbs = event['detail']['responseElements']
         for lb in lbs['loadBalancers']:
             arnList.append(lb['loadBalancerArn'])
@@ -121,14 +109,14 @@ def aws_elasticloadbalancing(event):
 def aws_rds(event):
     arnList = []
     if event['detail']['eventName'] == 'CreateDBInstance':
-        print("tagging for new RDS...")
+        log.debug("tagging for new RDS...")
         arnList.append(event['detail']['responseElements']['dBInstanceArn'])
         return arnList
 
 def aws_dms(event):
     arnList = []
     if event['detail']['eventName'] == 'CreateReplicationInstance':
-        print("tagging for new DMS Instance...")
+        log.debug("tagging for new DMS Instance...")
         arnList.append(event['detail']['responseElements']['replicationInstance']['replicationInstanceArn'])
         return arnList
 
@@ -138,7 +126,7 @@ def aws_elasticache(event):
     _region = event.get('region')
 
     # Initialize ElastiCache client
-    elasticache_client = boto3.client('elasticache', region_name=_region)
+    elasticache_client = get_client('elasticache', region_name=_region)
 
     # Retrieve tags from environment variable and parse JSON
     try:
@@ -146,17 +134,17 @@ def aws_elasticache(event):
         tags = json.loads(tags_env)  # Parse JSON string into Python dictionary
         tag_migrated_value = tags.get('map-migrated', 'DefaultMigration')  # Get 'map-migrated' value
     except json.JSONDecodeError as e:
-        print(f"Error parsing 'tags' environment variable: {e}")
+        log.error("Error parsing 'tags' environment variable", error=str(e))
         tag_migrated_value = 'DefaultMigration'  # Default value
 
     # Check if the event contains 'detail' and necessary fields
     if 'detail' not in event:
-        print("Event missing 'detail' field.")
+        log.debug("Event missing 'detail' field.")
         return arn_list
 
     # Handling CreateServerlessCache event
     if event['detail'].get('eventName') == 'CreateServerlessCache':
-        print("Processing new ElastiCache serverless cache instance...")
+        log.debug("Processing new ElastiCache serverless cache instance...")
 
         # Extract ARN and instance name from the event
         try:
@@ -164,161 +152,52 @@ def aws_elasticache(event):
             serverless_cache_name = event['detail']['responseElements']['serverlessCache']['serverlessCacheName']
             arn_list.append(serverless_cache_arn)
         except KeyError as e:
-            print(f"Event missing expected fields: {e}")
+            log.error("Event missing expected fields", missing=str(e), **event_fields(event))
             return arn_list
 
-        # Set timeout and delay for waiting cache status to become 'available'
-        timeout = int(os.getenv('CACHE_STATUS_TIMEOUT', 600))  # Timeout configurable via env var
-        delay_interval = int(os.getenv('CACHE_STATUS_DELAY', 30))  # Retry delay interval
+        # The cache can only be tagged once it is 'available'; re-check it later
+        # instead of waiting here.
+        defer('elasticache-serverless', _region, {'id': serverless_cache_name}, arn=serverless_cache_arn, account=_account)
 
-        # Wait for the cache instance to become 'available'
-        try:
-            start_time = time.time()
-
-            while True:
-                # Get the cache instance status
-                response = elasticache_client.describe_serverless_caches(
-                    ServerlessCacheName=serverless_cache_name
-                )
-                cache_status = response['ServerlessCaches'][0]['Status']
-
-                if cache_status == 'available':
-                    print(f"Cache instance {serverless_cache_name} is available, adding tags...")
-                    elasticache_client.add_tags_to_resource(
-                        ResourceName=serverless_cache_arn,
-                        Tags=[{'Key': 'map-migrated', 'Value': tag_migrated_value}]
-                    )
-                    print(f"Successfully added tags to ElastiCache serverless cache instance: {serverless_cache_arn}")
-                    break
-                elif time.time() - start_time > timeout:
-                    print(f"Timeout reached ({timeout} seconds), current status: {cache_status}")
-                    break
-                else:
-                    print(f"Current status: {cache_status}. Retrying in {delay_interval} seconds...")
-                    time.sleep(delay_interval)
-
-        except Exception as e:
-            print(f"Error adding tags to ElastiCache serverless cache instance: {e}")
-
-    # Ensure this block is correctly indented
+    # 处理 CreateReplicationGroup 或 CreateCacheCluster 事件（传统类型集群）
     elif event['detail'].get('eventName') in ['CreateReplicationGroup', 'CreateCacheCluster']:
-        print("Handling ElastiCache replication group or cache cluster creation...")
+        log.debug("处理新的 ElastiCache 集群", event_name=event['detail']['eventName'])
 
-        # Extract replication group or cache cluster information and process accordingly
         try:
             if event['detail']['eventName'] == 'CreateReplicationGroup':
-                replication_group_arn = event['detail']['responseElements']['ReplicationGroup']['aRN']
-                arn_list.append(replication_group_arn)
-                # Further processing for CreateReplicationGroup can be added here
-            elif event['detail']['eventName'] == 'CreateCacheCluster':
-                cache_cluster_arn = event['detail']['responseElements']['CacheCluster']['aRN']
-                arn_list.append(cache_cluster_arn)
-                # Further processing for CreateCacheCluster can be added here
-
-            # Add tags if needed
-            # Assuming you want to add the same tag for these events as well:
-            for arn in arn_list:
-                elasticache_client.add_tags_to_resource(
-                    ResourceName=arn,
-                    Tags=[{'Key': 'map-migrated', 'Value': tag_migrated_value}]
-                )
-                print(f"Successfully added tags to ElastiCache resource: {arn}")
-
+                _replicationGroupId = event['detail']['responseElements']['replicationGroupId']
+                arn = f"arn:aws:elasticache:{_region}:{_account}:replicationgroup:{_replicationGroupId}"
+                defer('elasticache-replication-group', _region, {'id': _replicationGroupId}, arn=arn, account=_account)
+            else:
+                _cacheClusterId = event['detail']['responseElements']['cacheClusterId']
+                arn = f"arn:aws:elasticache:{_region}:{_account}:cluster:{_cacheClusterId}"
+                defer('elasticache-cache-cluster', _region, {'id': _cacheClusterId}, arn=arn, account=_account)
         except KeyError as e:
-            print(f"Event missing expected fields for replication group or cache cluster: {e}")
-            return arn_list
-        except Exception as e:
-            print(f"Error handling ElastiCache replication group or cache cluster creation: {e}")
-
-
-
-    
-    # 处理 CreateReplicationGroup 或 CreateCacheCluster 事件（传统类型集群）
-    elif event['detail']['eventName'] in ['CreateReplicationGroup', 'CreateCacheCluster']:
-        print(f"处理新的 ElastiCache 集群: {event['detail']['eventName']}")
+            log.error("Event missing expected fields for replication group or cache cluster", missing=str(e), **event_fields(event))
 
-        if event['detail']['eventName'] == 'CreateReplicationGroup':
-            _replicationGroupId = event['detail']['responseElements']['replicationGroupId']
-            arn = f"arn:aws:elasticache:{_region}:{_account}:replicationgroup:{_replicationGroupId}"
-        else:
-            _cacheClusterId = event['detail']['responseElements']['cacheClusterId']
-            arn = f"arn:aws:elasticache:{_region}:{_account}:cluster:{_cacheClusterId}"
-
-        arnList.append(arn)
-
-        try:
-            while True:
-                if event['detail']['eventName'] == 'CreateReplicationGroup':
-                    response = elasticache_client.describe_replication_groups(ReplicationGroupId=_replicationGroupId)
-                    status = response['ReplicationGroups'][0]['Status']
-                else:
-                    response = elasticache_client.describe_cache_clusters(CacheClusterId=_cacheClusterId)
-                    status = response['CacheClusters'][0]['CacheClusterStatus']
-
-                if status == 'available':
-                    print(f"集群状态为 available，准备添加标签...")
-
-                    # 添加标签
-                    elasticache_client.add_tags_to_resource(
-                        ResourceName=arn,
-                        Tags=[{'Key': 'map-migrated', 'Value': tag_migrated_value}]
-                    )
-                    print(f"成功为 ElastiCache 集群添加标签: {arn}")
-                    break
-                else:
-                    print(f"当前状态为 {status}，等待 30 秒后重试...")
-                    time.sleep(30)
-        except Exception as e:
-            print(f"为 ElastiCache 集群添加标签时出错: {e}")
-
-        return arnList
+        return arn_list
 
     # 处理 CreateCacheSubnetGroup 事件（ElastiCache 子网组）
+    # 子网组没有状态字段，创建后即可打标签
     elif event['detail']['eventName'] == 'CreateCacheSubnetGroup':
-        print("处理新的 ElastiCache 子网组...")
-
-        _subnetGroupArn = event['detail']['responseElements']['aRN']
-        arnList.append(_subnetGroupArn)
-
-        try:
-            while True:
-                response = elasticache_client.describe_cache_subnet_groups(
-                    CacheSubnetGroupName=_subnetGroupArn.split(":")[-1]
-                )
-                subnet_group_status = response['CacheSubnetGroups'][0]['Status']
-
-                if subnet_group_status == 'available':
-                    print("子网组状态为 available，准备添加标签...")
-
-                    # 添加标签
-                    elasticache_client.add_tags_to_resource(
-                        ResourceName=_subnetGroupArn,
-                        Tags=[{'Key': 'map-migrated', 'Value': tag_migrated_value}]
-                    )
-                    print(f"成功为 ElastiCache 子网组添加标签: {_subnetGroupArn}")
-                    break
-                else:
-                    print(f"当前状态为 {subnet_group_status}，等待 30 秒后重试...")
-                    time.sleep(30)
-        except Exception as e:
-            print(f"为 ElastiCache 子网组添加标签时出错: {e}")
-
-        return arnList
+        log.debug("处理新的 ElastiCache 子网组...")
+        arn_list.append(event['detail']['responseElements']['aRN'])
+        return arn_list
 
-    print("未识别的事件类型，未处理任何资源。")
-    return arnList
+    log.debug("未识别的事件类型，未处理任何资源。")
+    return arn_list
     
 def aws_eks(event):
     arnList = []
     if event['detail']['eventName'] == 'CreateCluster':
-        print("tagging for new EKS Cluster...") 
+        log.debug("tagging for new EKS Cluster...") 
         arnList.append(event['detail']['responseElements']['cluster']['arn'])
         return arnList
 
 def aws_s3(event):
     arnList = []
     if event['detail']['eventName'] == 'CreateBucket':
-        print("tagging for new S3...")
+        log.debug("tagging for new S3...")
         _bkcuetName = event['detail']['requestParameters']['bucketName']
         arnList.append('arn:aws:s3:::' + _bkcuetName)
         return arnList
@@ -329,7 +208,7 @@ def aws_lambda(event):
     _exist2 = event['detail']['eventName'] == 'CreateFunction20150331'
     if  _exist1!= None and _exist2:
         function_name = event['detail']['responseElements']['functionName']
-        print('Functin name is :', function_name)
+        log.debug("Function name", function_name=function_name)
         arnList.append(event['detail']['responseElements']['functionArn'])
         return arnList
 
@@ -337,15 +216,9 @@ def aws_dynamodb(event):
     arnList = []
     if event['detail']['eventName'] == 'CreateTable':
         table_name = event['detail']['responseElements']['tableDescription']['tableName']
-        waiter = boto3.client('dynamodb').get_waiter('table_exists')
-        waiter.wait(
-            TableName=table_name,
-            WaiterConfig={
-                'Delay': 123,
-                'MaxAttempts': 123
-            }
-        )
-        arnList.append(event['detail']['responseElements']['tableDescription']['tableArn'])
+        table_arn = event['detail']['responseElements']['tableDescription']['tableArn']
+        # Tag once the table is ACTIVE; a later invocation re-checks it.
+        defer('dynamodb-table', event['region'], {'id': table_name}, arn=table_arn, account=event['account'])
         return arnList
         
 def aws_kms(event):
@@ -360,7 +233,7 @@ def aws_sns(event):
     _region = event['region']
     snsArnTemplate = 'arn:aws:sns:@region@:@account@:@topicName@'
     if event['detail']['eventName'] == 'CreateTopic':
-        print("tagging for new SNS...")
+        log.debug("tagging for new SNS...")
         _topicName = event['detail']['requestParameters']['name']
         arnList.append(snsArnTemplate.replace('@region@', _region).replace('@account@', _account).replace('@topicName@', _topicName))
         return arnList
@@ -371,7 +244,7 @@ def aws_sqs(event):
     _region = event['region']
     sqsArnTemplate = 'arn:aws:sqs:@region@:@account@:@queueName@'
     if event['detail']['eventName'] == 'CreateQueue':
-        print("tagging for new SQS...")
+        log.debug("tagging for new SQS...")
         _queueName = event['detail']['requestParameters']['queueName']
         arnList.append(sqsArnTemplate.replace('@region@', _region).replace('@account@', _account).replace('@queueName@', _queueName))
         return arnList
@@ -382,7 +255,7 @@ def aws_elasticfilesystem(event):
     _region = event['region']
     efsArnTemplate = 'arn:aws:elasticfilesystem:@region@:@account@:file-system/@fileSystemId@'
     if event['detail']['eventName'] == 'CreateMountTarget':
-        print("tagging for new efs...")
+        log.debug("tagging for new efs...")
         _efsId = event['detail']['responseElements']['fileSystemId']
         arnList.append(efsArnTemplate.replace('@region@', _region).replace('@account@', _account).replace('@fileSystemId@', _efsId))
         return arnList
@@ -390,20 +263,10 @@ def aws_elasticfilesystem(event):
 def aws_es(event):
     arnList = []
     if event['detail']['eventName'] == 'CreateDomain':
-        print("tagging for new open search...")
+        log.debug("tagging for new open search...")
         arnList.append(event['detail']['responseElements']['domainStatus']['aRN'])
         return arnList
 
-def check_msk_cluster_status(region, cluster_arn):
-    msk_client = boto3.client('kafka', region_name=region)
-    try:
-        response = msk_client.describe_cluster(ClusterArn=cluster_arn)
-        status = response['ClusterInfo']['State']
-        return status
-    except Exception as e:
-        print(f"Error checking MSK cluster status: {e}")
-        return None
-
 def aws_kafka(event):
     arnList = []
 
@@ -412,196 +275,132 @@ def aws_kafka(event):
     _region = os.getenv('AWS_REGION')
 
     # Initialize the MSK client
-    msk_client = boto3.client('kafka', region_name=_region)
+    msk_client = get_client('kafka', region_name=_region)
 
     # Check for MSK cluster creation event
     if event['detail']['eventName'] == 'CreateCluster':
-        print("Processing new MSK Cluster...")
+        log.debug("Processing new MSK Cluster...")
 
         # Extract the Cluster ARN
         try:
             cluster_arn = event['detail']['responseElements']['ClusterArn']
-            arnList.append(cluster_arn)
-
-            # Optionally, check the status of the cluster
-            retries = 5
-            while retries > 0:
-                print(f"Retrying cluster status check... {retries} attempts left.")
-                time.sleep(10)  # Delay before retrying
-                status = check_msk_cluster_status(_region, cluster_arn)
-                if status == 'ACTIVE':
-                    print(f"MSK Cluster {cluster_arn} is now active.")
-                    break
-                retries -= 1
-            if retries == 0:
-                print(f"Failed to verify MSK Cluster status after retries.")
+
+            # Tag once the cluster is ACTIVE; a later invocation re-checks it.
+            defer('msk-cluster', _region, {'id': cluster_arn}, arn=cluster_arn, account=_account)
         except KeyError as e:
-            print(f"Event missing expected fields for MSK cluster: {e}")
+            log.error("Event missing expected fields for MSK cluster", missing=str(e), **event_fields(event))
             return arnList
         except Exception as e:
-            print(f"Error processing MSK cluster creation: {e}")
+            log.error("Error processing MSK cluster creation", error=str(e), **event_fields(event))
             return arnList
 
     return arnList
 
 
 def aws_workspaces(event):
-    # 创建 AWS 客户端
-    wsclient = boto3.client('workspaces')  # WorkSpaces 客户端
-    dsclient = boto3.client('ds')  # Directory Service 客户端
-    resource_group_client = boto3.client('resourcegroupstaggingapi')  # 资源分组标记 API 客户端
-
-    arnList = []  # 用于存储 ARN 列表
-    _region = event['region']  # 获取事件中的 AWS 区域
-    _account = event['account']  # 获取事件中的 AWS 账户 ID
-
-    # 从环境变量获取标签信息
-    try:
-        tags_env = os.getenv('tags', '{}')
-        tags = json.loads(tags_env)
-        tag_key = 'map-migrated'
-        tag_value = tags.get('map-migrated', 'DefaultMigration')
-        print(f"从环境变量获取的标签: {tag_key}={tag_value}")
-    except (json.JSONDecodeError, TypeError) as e:
-        print(f"解析 'tags' 环境变量时出错: {e}")
-        tag_key = 'map-migrated'
-        tag_value = 'DefaultMigration'
-    # 获取所有目录列表
-    try:
-        directories = []
-        next_token = None
-
-        while True:
-            if next_token:
-                response = dsclient.describe_directories(NextToken=next_token)
-            else:
-                response = dsclient.describe_directories()
+    arnList = []
+    event_name = event['detail']['eventName']
 
-            directories.extend(response['DirectoryDescriptions'])
-            next_token = response.get('NextToken')
-            if not next_token:
-                break
-    except Exception as e:
-        print(f"获取 WorkSpaces 目录时出错: {e}")
-        return {"statusCode": 500, "body": f"Error: {e}"}
+    # 处理新创建的资源；目录和已有的 WorkSpaces 由定时全量巡检打标签
+    if event_name == 'CreateWorkspaces':
+        for workspace in event['detail']['responseElements']['workspaces']:
+            arnList.append(workspace['workspaceArn'])
 
-    # 遍历所有目录，检查是否需要添加标签
-    for directory in directories:
-        directory_id = directory['DirectoryId']
-        directory_name = directory['Name']
-        print(f"正在检查目录 {directory_id} ({directory_name})")
+    return arnList
 
 
-        try:
-            # 直接调用 ds.add_tags_to_resource API 为目录打标签
-            response = dsclient.add_tags_to_resource(
-                ResourceId=directory_id,
-                Tags=[{'Key': tag_key, 'Value': tag_value}]  # 标签是列表格式
-            )
-            print(f"成功为目录 {directory_id} 添加标签: {response}")
-        except Exception as e:
-            print(f"为目录 {directory_id} 添加标签时出错: {e}")
-    else:
-        print("目录 ID 未找到，无法为目录添加标签")
-   
+@profiled
+def main(event, context):
+    if getattr(context, 'aws_request_id', None):
+        log.bind(request_id=context.aws_request_id)
+    log.debug("Input event", event=event)
+    if is_self_event(event):
+        return {
+            'statusCode': 200,
+            'body': json.dumps("Ignored self-caused event.")
+        }
 
-    # 获取所有 WorkSpaces 实例
     try:
-        workspaces = []
-        next_token = None
-
-        while True:
-            if next_token:
-                response = wsclient.describe_workspaces(NextToken=next_token)
-            else:
-                response = wsclient.describe_workspaces()
-
-            workspaces.extend(response['Workspaces'])
-            next_token = response.get('NextToken')
-            if not next_token:
-                break
-    except Exception as e:
-        print(f"获取 WorkSpaces 实例时出错: {e}")
-        return {"statusCode": 500, "body": f"Error: {e}"}
-
-    # 为 WorkSpaces 实例添加标签，进行重试
-    for workspace in workspaces:
-        workspace_id = workspace['WorkspaceId']
-        print(f"正在处理 WorkSpace 实例 {workspace_id}")
-
-        retries = 3
-        success = False
-
-        while retries > 0 and not success:
-            try:
-                # 获取当前 WorkSpace 标签
-                response = wsclient.describe_tags(ResourceId=workspace_id)
-                workspace_tags = response.get('TagList', [])
-                print(f"WorkSpace {workspace_id} 当前标签: {workspace_tags}")
-
-                # 检查标签是否已经存在
-                if not any(tag['Key'] == tag_key for tag in workspace_tags):
-                    wsclient.create_tags(
-                        ResourceId=workspace_id,
-                        Tags=[{'Key': tag_key, 'Value': tag_value}]
-                    )
-                    print(f"已为 WorkSpace {workspace_id} 添加 '{tag_key}' 标签")
-                else:
-                    print(f"WorkSpace {workspace_id} 已有 '{tag_key}' 标签")
-                success = True
-            except Exception as e:
-                print(f"为 WorkSpace {workspace_id} 添加标签时出错: {e}")
-                retries -= 1
-                if retries > 0:
-                    print(f"重试剩余次数: {retries}")
-                    time.sleep(5)
-                else:
-                    print(f"WorkSpace {workspace_id} 标签添加失败，已达到最大重试次数")
-
-    print("标签处理完成")
-    return {"statusCode": 200, "body": "所有目录和 WorkSpaces 实例的标签处理完成"}
-
+        # Deferred re-checks arrive from the recheck queue rather than EventBridge
+        if 'Records' in event:
+            resARNs = []
+            for record in event['Records']:
+                job = json.loads(record['body']).get('recheck')
+                if job:
+                    resARNs.extend(recheck(job))
+            writer = TagWriter(get_client('resourcegroupstaggingapi'), service='recheck')
+            for _arn in resARNs:
+                writer.add(_arn, json.loads(os.environ['tags']))
+            writer.flush()
+            return {
+                'statusCode': 200,
+                'body': json.dumps(f"Re-checked {len(event['Records'])} deferred resources")
+            }
 
-def main(event, context):
-    print("Input event is: ")
-    print(event)
-    
-    try:
         _method = event['source'].replace('.', "_")
-        print(f"Processing source: {_method}")
+        log.info("Processing event", **event_fields(event))
         
+        if _method == 'aws_ec2' and event['detail']['eventName'] == 'RunInstances':
+            with phase('event_parse'):
+                _summary = ec2_launch(event)
+            if _summary['failed']:
+                # Journaled for replay; report them instead of claiming success.
+                return {
+                    'statusCode': 500,
+                    'body': json.dumps({'message': "Failed to tag some resources", 'failed': _summary['failed']})
+                }
+            return {
+                'statusCode': 200,
+                'body': json.dumps(f"Successfully tagged resources with source {event['source']}")
+            }
+
         # Ensure the method exists before calling
         if _method in globals():
-            resARNs = globals()[_method](event)
-            print(f"Resource ARNs: {resARNs}")  # Debug print here
+            with phase('event_parse'):
+                resARNs = globals()[_method](event)
+            log.debug("Resource ARNs", arns=resARNs)
 
             if resARNs:  # Ensure ARN list is not empty
                 _res_tags = json.loads(os.environ['tags'])
-                boto3.client('resourcegroupstaggingapi').tag_resources(
-                    ResourceARNList=resARNs,
-                    Tags=_res_tags
-                )
+                metrics.count(_method, examined=len(resARNs))
+                # TagWriter batches the writes, retries the ARNs FailedResourcesMap
+                # reports as throttled or transient, and journals what still fails.
+                writer = TagWriter(get_client('resourcegroupstaggingapi'), service=_method)
+                for _arn in resARNs:
+                    writer.add(_arn, _res_tags)
+                writer.flush()
+                metrics.count(_method, tagged=writer.tagged, failed=len(writer.failed), rejected=len(writer.rejected))
+                if writer.failed:
+                    # Journaled for replay; report them instead of claiming success.
+                    return {
+                        'statusCode': 500,
+                        'body': json.dumps({'message': "Failed to tag some resources", 'failed': writer.failed})
+                    }
                 return {
                     'statusCode': 200,
                     'body': json.dumps(f"Successfully tagged resources with source {event['source']}")
                 }
             else:
-                print("No ARNs found to tag.")
+                log.debug("No ARNs found to tag.")
                 return {
                     'statusCode': 400,
                     'body': json.dumps("No resources to tag.")
                 }
 
         else:
-            print(f"Method {event['source']} not found.")
+            log.warning("Invalid event source", **event_fields(event))
             return {
                 'statusCode': 400,
                 'body': json.dumps("Invalid event source.")
             }
 
     except Exception as e:
-        print(f"Error processing event: {e}")
+        log.error("Error processing event", error=str(e), **event_fields(event))
         return {
             'statusCode': 500,
             'body': json.dumps(f"Internal error: {e}")
         }
+    finally:
+        get_journal().flush()
+        metrics.flush()
+        log.flush()
@@ -0,0 +1,166 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+from clients import get_client
+from logs import log
+
+# A resource verified compliant with the current tag set is not read again for
+# LEDGER_TTL_SECONDS. Each key's window is shortened by up to a quarter,
+# derived from the key, so re-verification is spread across sweeps instead
+# of arriving all at once.
+LEDGER_TTL_SECONDS = int(os.getenv('LEDGER_TTL_SECONDS', str(7 * 24 * 3600)))
+LEDGER_TABLE = os.getenv('LEDGER_TABLE')
+LEDGER_PATH = os.getenv('LEDGER_PATH')
+
+# DynamoDB BatchGetItem accepts 100 keys and BatchWriteItem 25 items per call.
+GET_BATCH_SIZE = 100
+PUT_BATCH_SIZE = 25
+
+
+def tags_hash(required_tags):
+    return hashlib.sha256(json.dumps(required_tags, sort_keys=True).encode()).hexdigest()[:16]
+
+
+class SqliteStore:
+    """Local stand-in for the DynamoDB table, for tests and runs outside Lambda."""
+
+    def __init__(self, path=':memory:'):
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('CREATE TABLE IF NOT EXISTS ledger (resource TEXT PRIMARY KEY, tags_hash TEXT, verified_at REAL)')
+        self._lock = threading.Lock()
+
+    def get_many(self, keys):
+        keys = list(keys)
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT resource, tags_hash, verified_at FROM ledger WHERE resource IN ({','.join('?' * len(keys))})", keys)
+            return {resource: (digest, verified_at) for resource, digest, verified_at in rows}
+
+    def put_many(self, entries):
+        with self._lock, self._conn:
+            self._conn.executemany('INSERT OR REPLACE INTO ledger VALUES (?, ?, ?)', entries)
+
+
+class DynamoStore:
+    """Ledger table keyed by 'resource', with an 'expires_at' TTL attribute so stale rows age out."""
+
+    def __init__(self, table, client=None):
+        self.table = table
+        self.client = client or get_client('dynamodb')
+
+    def get_many(self, keys):
+        found = {}
+        request = {self.table: {'Keys': [{'resource': {'S': key}} for key in dict.fromkeys(keys)],
+                                'ProjectionExpression': '#r, tags_hash, verified_at',
+                                'ExpressionAttributeNames': {'#r': 'resource'}}}
+        while request:
+            response = self.client.batch_get_item(RequestItems=request)
+            for item in response.get('Responses', {}).get(self.table, []):
+                found[item['resource']['S']] = (item['tags_hash']['S'], float(item['verified_at']['N']))
+            request = response.get('UnprocessedKeys')
+        return found
+
+    def put_many(self, entries, now=None):
+        # A batch may not name the same key twice; keep the latest entry.
+        entries = {key: (key, digest, verified_at) for key, digest, verified_at in entries}.values()
+        # Rows expire counting from when they are written, not from the value
+        # they hold: a watermark stores the creation time of the newest
+        # resource listed, which may be long past.
+        expires_at = str(int((now or time.time()) + 2 * LEDGER_TTL_SECONDS))
+        requests = [{'PutRequest': {'Item': {
+            'resource': {'S': key},
+            'tags_hash': {'S': digest},
+            'verified_at': {'N': str(int(verified_at))},
+            'expires_at': {'N': expires_at},
+        }}} for key, digest, verified_at in entries]
+        request = {self.table: requests}
+        while request:
+            response = self.client.batch_write_item(RequestItems=request)
+            request = response.get('UnprocessedItems')
+
+
+class Ledger:
+    """Remembers which resources were last verified compliant with which tag set, and when.
+
+    fresh() answers for a whole batch of keys in one lookup; record() buffers
+    entries and writes them PUT_BATCH_SIZE at a time. Call flush() when a
+    sweep finishes.
+    """
+
+    def __init__(self, store, ttl=LEDGER_TTL_SECONDS):
+        self.store = store
+        self.ttl = ttl
+        self.pending = []
+        self._lock = threading.Lock()
+
+    def _window(self, key):
+        return self.ttl * (0.75 + 0.25 * (zlib.crc32(key.encode()) % 1000) / 1000)
+
+    def fresh(self, keys, digest, now=None):
+        """Return the keys verified against `digest` recently enough to skip."""
+        now = now or time.time()
+        fresh = set()
+        keys = list(keys)
+        for start in range(0, len(keys), GET_BATCH_SIZE):
+            try:
+                entries = self.store.get_many(keys[start:start + GET_BATCH_SIZE])
+            except Exception as e:
+                log.error("Error reading tag ledger", error=str(e))
+                continue
+            for key, (entry_digest, verified_at) in entries.items():
+                if entry_digest == digest and now - verified_at < self._window(key):
+                    fresh.add(key)
+        return fresh
+
+    def mark(self, name, digest):
+        """Return the value last stored under `name` for the same tag set, or None."""
+        try:
+            entry = self.store.get_many([name]).get(name)
+        except Exception as e:
+            log.error("Error reading tag ledger", error=str(e))
+            return None
+        return entry[1] if entry and entry[0] == digest else None
+
+    def set_mark(self, name, digest, value):
+        """Store a timestamp such as a listing watermark alongside the resource entries."""
+        self._put([(name, digest, value)])
+
+    def record(self, keys, digest, now=None):
+        now = now or time.time()
+        with self._lock:
+            self.pending.extend((key, digest, now) for key in keys)
+            if len(self.pending) < PUT_BATCH_SIZE:
+                return
+            batch, self.pending = self.pending, []
+        self._put(batch)
+
+    def flush(self):
+        with self._lock:
+            batch, self.pending = self.pending, []
+        self._put(batch)
+
+    def _put(self, batch):
+        for start in range(0, len(batch), PUT_BATCH_SIZE):
+            try:
+                self.store.put_many(batch[start:start + PUT_BATCH_SIZE])
+            except Exception as e:
+                log.error("Error writing tag ledger", error=str(e))
+
+
+_ledger = None
+_ledger_lock = threading.Lock()
+
+
+def get_ledger():
+    """Return the ledger configured by LEDGER_TABLE or LEDGER_PATH, or None when neither is set."""
+    global _ledger
+    if _ledger is None and (LEDGER_TABLE or LEDGER_PATH):
+        with _ledger_lock:
+            if _ledger is None:
+                _ledger = Ledger(DynamoStore(LEDGER_TABLE) if LEDGER_TABLE else SqliteStore(LEDGER_PATH))
+    return _ledger
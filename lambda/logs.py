@@ -0,0 +1,107 @@
+import json
+import os
+import random
+import threading
+import time
+
+# Log lines are JSON records with a level, so CloudWatch Logs Insights can
+# filter them by event ID, service, ARN, action and outcome. Per-resource
+# successes are only counted and printed in one summary line per invocation;
+# LOG_SAMPLE_RATE (0.0-1.0) also prints that share of them individually.
+# Failures are always printed, so log volume follows errors, not resources.
+LEVELS = {'DEBUG': 10, 'INFO': 20, 'WARNING': 30, 'ERROR': 40}
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+try:
+    LOG_SAMPLE_RATE = float(os.getenv('LOG_SAMPLE_RATE', '0'))
+except ValueError as e:
+    print(f"Error parsing 'LOG_SAMPLE_RATE' environment variable: {e}")
+    LOG_SAMPLE_RATE = 0.0
+
+# Outcomes that are logged one line per resource every time.
+FAILED_OUTCOMES = ('failed', 'rejected')
+
+
+def event_fields(event):
+    """Identify a CloudTrail event in log records: its event ID, source and event name."""
+    detail = event.get('detail') or {}
+    fields = {'event_id': detail.get('eventID') or event.get('id'), 'source': event.get('source'),
+              'event_name': detail.get('eventName')}
+    return {key: value for key, value in fields.items() if value}
+
+
+class Logger:
+    """Leveled JSON log lines plus per-(service, action, outcome) resource counters.
+
+    bind() adds fields to every record until the next flush(); resources()
+    records what happened to a set of resources; flush() prints the counters
+    as one summary record and starts over.
+    """
+
+    def __init__(self, level=LOG_LEVEL, sample_rate=LOG_SAMPLE_RATE):
+        self.level = LEVELS.get(level, LEVELS['INFO'])
+        self.sample_rate = sample_rate
+        self.context = {}
+        self.outcomes = {}
+        self._lock = threading.Lock()
+
+    def enabled(self, level):
+        return LEVELS[level] >= self.level
+
+    def bind(self, **fields):
+        self.context.update(fields)
+
+    def _emit(self, level, message, fields):
+        record = {'timestamp': round(time.time(), 3), 'level': level, 'message': message}
+        record.update(self.context)
+        record.update((key, value) for key, value in fields.items() if value is not None)
+        print(json.dumps(record, default=str, ensure_ascii=False))
+
+    def log(self, level, message, **fields):
+        if self.enabled(level):
+            self._emit(level, message, fields)
+
+    def debug(self, message, **fields):
+        self.log('DEBUG', message, **fields)
+
+    def info(self, message, **fields):
+        self.log('INFO', message, **fields)
+
+    def warning(self, message, **fields):
+        self.log('WARNING', message, **fields)
+
+    def error(self, message, **fields):
+        self.log('ERROR', message, **fields)
+
+    def resources(self, action, outcome, arns, service=None, error=None, **fields):
+        """Count `outcome` of `action` for every ARN; failures are also logged, successes only sampled."""
+        arns = list(arns)
+        if not arns:
+            return
+        key = (service, action, outcome)
+        with self._lock:
+            self.outcomes[key] = self.outcomes.get(key, 0) + len(arns)
+        if outcome in FAILED_OUTCOMES:
+            for arn in arns:
+                self._emit('ERROR', f"{action} {outcome}", dict(fields, service=service, arn=arn, action=action,
+                                                               outcome=outcome, error=error and str(error)))
+            return
+        if not self.enabled('INFO'):
+            return
+        for arn in arns:
+            if self.level <= LEVELS['DEBUG'] or (self.sample_rate and random.random() < self.sample_rate):
+                self._emit('INFO', f"{action} {outcome}", dict(fields, service=service, arn=arn, action=action,
+                                                              outcome=outcome, sampled=self.level > LEVELS['DEBUG']))
+
+    def flush(self):
+        """Print the resource counters since the last flush as one summary record, then reset."""
+        with self._lock:
+            outcomes, self.outcomes = self.outcomes, {}
+        if outcomes and self.enabled('INFO'):
+            self._emit('INFO', 'summary', {'outcomes': [
+                {'service': service, 'action': action, 'outcome': outcome, 'count': count}
+                for (service, action, outcome), count in sorted(outcomes.items(), key=lambda item: [str(part) for part in item[0]])]})
+        self.context = {}
+
+
+# Process-wide logger shared by both handlers and every worker thread.
+log = Logger()
@@ -0,0 +1,157 @@
+import json
+import os
+import random
+import threading
+import time
+
+from ratelimit import THROTTLE_CODES
+
+# API calls and handler outcomes are written once per invocation as CloudWatch
+# Embedded Metric Format log lines, which CloudWatch turns into metrics without
+# any PutMetricData call.
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'true').lower() == 'true'
+METRICS_NAMESPACE = os.getenv('METRICS_NAMESPACE', 'ResourceTagging')
+
+# EMF accepts at most 100 values per metric, so latencies are kept as a
+# uniform sample of that size; the full distribution goes in LatencyHistogram.
+LATENCY_SAMPLES = 100
+LATENCY_BUCKETS_MS = (10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+
+class _Operation:
+    def __init__(self):
+        self.calls = 0
+        self.retries = 0
+        self.throttles = 0
+        self.errors = 0
+        self.latencies = []
+        self.histogram = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+
+    def observe(self, milliseconds):
+        self.calls += 1
+        if len(self.latencies) < LATENCY_SAMPLES:
+            self.latencies.append(milliseconds)
+        else:
+            # Reservoir sampling keeps every call equally likely to be kept.
+            slot = random.randrange(self.calls)
+            if slot < LATENCY_SAMPLES:
+                self.latencies[slot] = milliseconds
+        for index, bound in enumerate(LATENCY_BUCKETS_MS):
+            if milliseconds <= bound:
+                self.histogram[index] += 1
+                return
+        self.histogram[-1] += 1
+
+
+class Metrics:
+    """Per-(service, operation) call accounting and per-handler resource counts for one invocation.
+
+    attach() hooks a client's botocore events; count() adds resource outcomes
+    for a handler; flush() prints everything as EMF and starts over.
+    """
+
+    def __init__(self, namespace=METRICS_NAMESPACE):
+        self.namespace = namespace
+        self.operations = {}
+        self.handlers = {}
+        self._lock = threading.Lock()
+
+    def _operation(self, service, operation):
+        key = (service, operation)
+        entry = self.operations.get(key)
+        if entry is None:
+            with self._lock:
+                entry = self.operations.setdefault(key, _Operation())
+        return entry
+
+    def attach(self, client, service):
+        def started(context, **kwargs):
+            context['metrics_started'] = time.perf_counter()
+
+        def elapsed(context):
+            return (time.perf_counter() - context.get('metrics_started', time.perf_counter())) * 1000
+
+        def after_call(http_response, parsed, model, context, **kwargs):
+            entry = self._operation(service, model.name)
+            with self._lock:
+                entry.observe(elapsed(context))
+                entry.retries += parsed.get('ResponseMetadata', {}).get('RetryAttempts', 0)
+                if http_response.status_code >= 300:
+                    entry.errors += 1
+
+        def after_call_error(context, event_name='', model=None, **kwargs):
+            # after-call-error only passes the exception and context; the
+            # operation is the last part of 'after-call-error.<service>.<operation>'.
+            entry = self._operation(service, model.name if model else event_name.rsplit('.', 1)[-1])
+            with self._lock:
+                entry.observe(elapsed(context))
+                entry.errors += 1
+
+        def needs_retry(response, operation, **kwargs):
+            if response is not None and response[1].get('Error', {}).get('Code') in THROTTLE_CODES:
+                entry = self._operation(service, operation.name)
+                with self._lock:
+                    entry.throttles += 1
+            return None
+
+        client.meta.events.register('before-parameter-build', started)
+        client.meta.events.register('after-call', after_call)
+        client.meta.events.register('after-call-error', after_call_error)
+        client.meta.events.register('needs-retry', needs_retry)
+
+    def count(self, handler, **values):
+        """Add resource outcomes, e.g. count('aws_ec2', examined=10, tagged=3), for one handler."""
+        with self._lock:
+            counts = self.handlers.setdefault(handler, {})
+            for name, value in values.items():
+                counts[name] = counts.get(name, 0) + value
+
+    def _record(self, dimensions, metrics, values):
+        return {
+            '_aws': {
+                'Timestamp': int(time.time() * 1000),
+                'CloudWatchMetrics': [{
+                    'Namespace': self.namespace,
+                    'Dimensions': [list(dimensions)],
+                    'Metrics': [{'Name': name, 'Unit': unit} for name, unit in metrics],
+                }],
+            },
+            **dimensions,
+            **values,
+        }
+
+    def records(self):
+        """Return the EMF records for everything observed since the last flush."""
+        with self._lock:
+            operations, self.operations = self.operations, {}
+            handlers, self.handlers = self.handlers, {}
+        records = []
+        for (service, operation), entry in sorted(operations.items()):
+            records.append(self._record(
+                {'Service': service, 'Operation': operation},
+                [('Calls', 'Count'), ('Retries', 'Count'), ('Throttles', 'Count'), ('Errors', 'Count'),
+                 ('Latency', 'Milliseconds')],
+                {'Calls': entry.calls, 'Retries': entry.retries, 'Throttles': entry.throttles, 'Errors': entry.errors,
+                 'Latency': [round(value, 2) for value in entry.latencies],
+                 'LatencyHistogram': {f'le_{bound}': count for bound, count in
+                                      zip(LATENCY_BUCKETS_MS + ('inf',), entry.histogram)}}))
+        for handler, counts in sorted(handlers.items()):
+            names = {name: f'Resources{name.capitalize()}' for name in counts}
+            records.append(self._record(
+                {'Handler': handler},
+                [(metric, 'Count') for metric in names.values()],
+                {names[name]: value for name, value in counts.items()}))
+        return records
+
+    def flush(self):
+        """Print one EMF line per operation and per handler, then reset."""
+        # Collect even when disabled, so counters of a warm container never pile up.
+        records = self.records()
+        if not METRICS_ENABLED:
+            return
+        for record in records:
+            print(json.dumps(record))
+
+
+# Process-wide recorder shared by every client built through clients.get_client.
+metrics = Metrics()
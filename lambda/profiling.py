@@ -0,0 +1,168 @@
+import io
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from logs import log
+
+# PROFILING turns on a per-invocation profile without a code change:
+# 'cpu' runs cProfile, 'memory' runs tracemalloc, 'true' or 'all' both.
+# Reports go to PROFILE_DIR/profile-<request id>/ and, when PROFILE_S3_URI
+# (s3://bucket/prefix) is set, are uploaded there as well.
+PROFILING = os.getenv('PROFILING', 'false').lower()
+PROFILE_CPU = PROFILING in ('true', 'all', 'cpu')
+PROFILE_MEMORY = PROFILING in ('true', 'all', 'memory')
+PROFILE_DIR = os.getenv('PROFILE_DIR', '/tmp')
+PROFILE_S3_URI = os.getenv('PROFILE_S3_URI')
+PROFILE_TOP = int(os.getenv('PROFILE_TOP', '30'))
+
+
+class _Session:
+    """State of one profiled invocation: phase timers and one cProfile per thread."""
+
+    def __init__(self):
+        self.phases = {}
+        self.profilers = []
+        self.local = threading.local()
+        self._lock = threading.Lock()
+
+    def add_phase(self, name, seconds):
+        with self._lock:
+            total, count = self.phases.get(name, (0.0, 0))
+            self.phases[name] = (total + seconds, count + 1)
+
+    def thread_profiler(self):
+        import cProfile
+        profiler = getattr(self.local, 'profiler', None)
+        if profiler is None:
+            profiler = self.local.profiler = cProfile.Profile()
+            with self._lock:
+                self.profilers.append(profiler)
+        return profiler
+
+
+_session = None
+
+
+@contextmanager
+def phase(name):
+    """Time a block under `name` while an invocation is being profiled; free otherwise.
+
+    Phases run on several threads at once (and nest, e.g. 'writes' inside
+    'service_sweep'), so the totals are summed thread time, not elapsed time.
+    """
+    session = _session
+    if session is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        session.add_phase(name, time.perf_counter() - started)
+
+
+def traced(fn):
+    """Wrap a callable submitted to a worker pool so cProfile also covers that thread."""
+    session = _session
+    if session is None or not PROFILE_CPU:
+        return fn
+
+    @wraps(fn)
+    def run(*args, **kwargs):
+        profiler = session.thread_profiler()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Another profiler already owns the interpreter (Python 3.12+).
+            return fn(*args, **kwargs)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            profiler.disable()
+    return run
+
+
+def _write_reports(session, directory, started, memory_snapshot):
+    import pstats
+    os.makedirs(directory, exist_ok=True)
+    files = {}
+
+    phases = {name: {'seconds': round(total, 4), 'count': count} for name, (total, count) in
+              sorted(session.phases.items(), key=lambda item: -item[1][0])}
+    files['phases.json'] = json.dumps({'wall_seconds': round(time.perf_counter() - started, 4), 'phases': phases}, indent=2)
+
+    if session.profilers:
+        stats = None
+        for profiler in session.profilers:
+            if stats is None:
+                stats = pstats.Stats(profiler)
+            else:
+                stats.add(profiler)
+        stats.dump_stats(os.path.join(directory, 'cprofile.pstats'))
+        text = io.StringIO()
+        stats.stream = text
+        stats.sort_stats('cumulative').print_stats(PROFILE_TOP)
+        files['cprofile.txt'] = text.getvalue()
+
+    if memory_snapshot is not None:
+        lines = [str(stat) for stat in memory_snapshot.statistics('lineno')[:PROFILE_TOP]]
+        files['tracemalloc.txt'] = '\n'.join(lines) + '\n'
+
+    for name, content in files.items():
+        with open(os.path.join(directory, name), 'w') as report:
+            report.write(content)
+    return sorted(os.listdir(directory))
+
+
+def _upload(directory, names, request_id):
+    from clients import get_client
+    bucket, _, prefix = PROFILE_S3_URI[len('s3://'):].partition('/')
+    client = get_client('s3')
+    for name in names:
+        key = '/'.join(part for part in (prefix.strip('/'), request_id, name) if part)
+        with open(os.path.join(directory, name), 'rb') as report:
+            client.put_object(Bucket=bucket, Key=key, Body=report.read())
+    log.info("Uploaded profile", location=f"s3://{bucket}/{'/'.join(part for part in (prefix.strip('/'), request_id) if part)}/")
+
+
+def profiled(handler):
+    """Decorate a Lambda handler to profile each invocation when PROFILING is set."""
+
+    @wraps(handler)
+    def main(event, context):
+        global _session
+        if not (PROFILE_CPU or PROFILE_MEMORY):
+            return handler(event, context)
+
+        import tracemalloc
+        request_id = getattr(context, 'aws_request_id', None) or str(int(time.time() * 1000))
+        session = _session = _Session()
+        if PROFILE_MEMORY:
+            tracemalloc.start()
+        profiler = session.thread_profiler() if PROFILE_CPU else None
+        started = time.perf_counter()
+        if profiler:
+            profiler.enable()
+        try:
+            return handler(event, context)
+        finally:
+            if profiler:
+                profiler.disable()
+            _session = None
+            snapshot = None
+            if PROFILE_MEMORY:
+                snapshot = tracemalloc.take_snapshot()
+                tracemalloc.stop()
+            try:
+                directory = os.path.join(PROFILE_DIR, f'profile-{request_id}')
+                names = _write_reports(session, directory, started, snapshot)
+                log.info("Profile written", directory=directory, files=names)
+                if PROFILE_S3_URI:
+                    _upload(directory, names, request_id)
+            except Exception as e:
+                log.error("Error writing profile", error=str(e))
+    return main
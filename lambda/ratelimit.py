@@ -0,0 +1,132 @@
+import os
+import threading
+import time
+
+# Starting request rates (requests/second) per (service, operation), taken from
+# the published tagging and describe quotas. (service, '*') covers the rest of
+# a service and DEFAULT_RATE everything else; throttle feedback adjusts them.
+SEED_RATES = {
+    ('resourcegroupstaggingapi', 'GetResources'): 10,
+    ('resourcegroupstaggingapi', 'TagResources'): 5,
+    ('resourcegroupstaggingapi', 'UntagResources'): 5,
+    ('ec2', 'CreateTags'): 10,
+    ('ec2', 'DescribeTags'): 20,
+    ('ec2', '*'): 20,
+    ('rds', '*'): 10,
+    ('docdb', '*'): 10,
+    ('elasticache', '*'): 10,
+    ('kms', '*'): 50,
+    ('s3', '*'): 50,
+    ('lambda', '*'): 15,
+    ('dynamodb', 'ListTagsOfResource'): 10,
+    ('dynamodb', 'TagResource'): 5,
+    ('sns', '*'): 10,
+    ('sqs', '*'): 20,
+    ('efs', '*'): 10,
+    ('workspaces', '*'): 5,
+    ('ds', '*'): 5,
+}
+DEFAULT_RATE = float(os.getenv('RATE_LIMIT_DEFAULT', '10'))
+
+# AIMD tuning: halve the rate on a throttle, add a fraction of the seed back on
+# each success, never drop below MIN_RATE or rise above twice the seed.
+DECREASE_FACTOR = 0.5
+INCREASE_FRACTION = 0.05
+MIN_RATE = 0.5
+MAX_MULTIPLIER = 2.0
+
+THROTTLE_CODES = {
+    'Throttling', 'ThrottlingException', 'ThrottledException', 'RequestThrottledException',
+    'TooManyRequestsException', 'RequestLimitExceeded', 'RequestThrottled', 'SlowDown',
+    'ProvisionedThroughputExceededException', 'BandwidthLimitExceeded', 'LimitExceededException',
+    'EC2ThrottledException', 'PriorRequestNotComplete',
+}
+
+
+class TokenBucket:
+    """Token bucket whose refill rate shrinks on throttles and grows on successes."""
+
+    def __init__(self, rate):
+        self.seed = float(rate)
+        self.rate = float(rate)
+        self.tokens = max(1.0, self.rate)
+        self.updated = time.monotonic()
+        self.throttles = 0
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(max(1.0, self.rate), self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self):
+        """Block until a token is available and consume it."""
+        while True:
+            with self._lock:
+                self._refill(time.monotonic())
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def throttled(self):
+        with self._lock:
+            self.throttles += 1
+            self.rate = max(MIN_RATE, self.rate * DECREASE_FACTOR)
+            self.tokens = min(self.tokens, 0.0)
+
+    def succeeded(self):
+        with self._lock:
+            self.rate = min(self.seed * MAX_MULTIPLIER, self.rate + self.seed * INCREASE_FRACTION)
+
+
+class RateLimiter:
+    """Shares one token bucket per (service, operation) across every client and thread.
+
+    attach() hooks a client's botocore events: every HTTP attempt (retries
+    included) takes a token in before-send, and each attempt's outcome is fed
+    back from needs-retry.
+    """
+
+    def __init__(self, seed_rates=None, default_rate=DEFAULT_RATE):
+        self.seed_rates = dict(SEED_RATES if seed_rates is None else seed_rates)
+        self.default_rate = default_rate
+        self.buckets = {}
+        self._lock = threading.Lock()
+
+    def bucket(self, service, operation):
+        key = (service, operation)
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            with self._lock:
+                bucket = self.buckets.get(key)
+                if bucket is None:
+                    rate = self.seed_rates.get(key, self.seed_rates.get((service, '*'), self.default_rate))
+                    bucket = self.buckets[key] = TokenBucket(rate)
+        return bucket
+
+    def attach(self, client, service):
+        def before_send(event_name, **kwargs):
+            self.bucket(service, event_name.rsplit('.', 1)[-1]).acquire()
+
+        def needs_retry(response, operation, **kwargs):
+            if response is None:
+                return None
+            http_response, parsed = response
+            bucket = self.bucket(service, operation.name)
+            if parsed.get('Error', {}).get('Code') in THROTTLE_CODES or http_response.status_code == 429:
+                bucket.throttled()
+            elif http_response.status_code < 400:
+                bucket.succeeded()
+            return None
+
+        client.meta.events.register('before-send', before_send)
+        client.meta.events.register('needs-retry', needs_retry)
+
+    def snapshot(self):
+        """Return {(service, operation): (current rate, throttle count)}."""
+        return {key: (bucket.rate, bucket.throttles) for key, bucket in self.buckets.items()}
+
+
+# Process-wide limiter shared by every client built through clients.get_client.
+limiter = RateLimiter()
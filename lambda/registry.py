@@ -0,0 +1,186 @@
+from dataclasses import dataclass, field
+
+
+@dataclass(frozen=True)
+class ResourceType:
+    """Declares how to list one kind of resource and how to read and write its tags.
+
+    Paths (`items`, `id`, `arn`, `tags`, the read result and `where`) are
+    JMESPath expressions. Operation parameters name the value they receive: a
+    name ending in '[]' takes a list of identifiers (and lets the engine batch
+    writes), a dotted name such as 'Tagging.TagSet' is nested.
+    """
+
+    group: str                  # the aws_* handler that sweeps this type
+    kind: str                   # human-readable name used in logs
+    service: str                # boto3 client name
+    list_op: str
+    items: str                  # path to the resources in a list response
+    list_params: dict = field(default_factory=dict)
+    id: str = '@'               # path to the identifier within a listed item
+    arn: str = None             # path to the ARN within the (detailed) item
+    arn_template: str = None    # or an ARN built from {partition} {region} {account} {id}
+    target: str = 'arn'         # whether tag operations take the 'arn' or the 'id'
+    detail: tuple = None        # (op, params, result path) called per item before tagging
+    where: str = None           # keep only items for which this path is truthy
+    parent: str = None          # kind of the parent type whose ids are listed first
+    parent_param: str = None    # list parameter receiving the parent id
+    tags: str = None            # path to tags already present in the item
+    read: tuple = None          # (op, id param, result path)
+    write: tuple = None         # (op, id param, tags param)
+    tag_shape: str = 'list'     # 'list' [{Key, Value}], 'map' {k: v} or 'kms' [{TagKey, TagValue}]
+    write_batch: int = 1        # identifiers per write when the id param takes a list
+    merge: bool = False         # write the full merged tag set (the write replaces all tags)
+    missing_codes: tuple = ()   # error codes on read that mean "no tags yet"
+    created: str = None         # path to the creation time, for incremental listings
+    created_filter: str = None  # list filter on the creation time that accepts 'YYYY-MM-DD*'
+
+
+def partition_for(region):
+    if region.startswith('cn-'):
+        return 'aws-cn'
+    if region.startswith('us-gov-'):
+        return 'aws-us-gov'
+    return 'aws'
+
+
+_EC2_TAGS = dict(group='ec2', service='ec2', target='id', tags='Tags',
+                 write=('create_tags', 'Resources[]', 'Tags'), write_batch=1000)
+_RDS_TAGS = dict(group='rds', service='rds', arn='@',
+                 read=('list_tags_for_resource', 'ResourceName', 'TagList'),
+                 write=('add_tags_to_resource', 'ResourceName', 'Tags'))
+_ELASTICACHE_TAGS = dict(group='elasticache', service='elasticache', arn='ARN',
+                         read=('list_tags_for_resource', 'ResourceName', 'TagList'),
+                         write=('add_tags_to_resource', 'ResourceName', 'Tags'))
+_DOCDB_TAGS = dict(group='docdb', service='docdb', arn='@',
+                   read=('list_tags_for_resource', 'ResourceName', 'TagList'),
+                   write=('add_tags_to_resource', 'ResourceName', 'Tags'))
+_DOCDB_ELASTIC_TAGS = dict(group='docdb', service='docdb-elastic', arn='@', tag_shape='map',
+                           read=('list_tags_for_resource', 'resourceArn', 'tags'),
+                           write=('tag_resource', 'resourceArn', 'tags'))
+_KAFKA_TAGS = dict(group='kafka', service='kafka', arn='@', tag_shape='map',
+                   read=('list_tags_for_resource', 'ResourceArn', 'Tags'),
+                   write=('tag_resource', 'ResourceArn', 'Tags'))
+
+RESOURCE_TYPES = [
+    # EC2 types are diffed against one DescribeTags index (engine.sweep_ec2) and
+    # only fall back to the Tags their describe calls return.
+    ResourceType(kind='EC2 instance', list_op='describe_instances', items='Reservations[].Instances[]', id='InstanceId', **_EC2_TAGS),
+    ResourceType(kind='EBS volume', list_op='describe_volumes', items='Volumes', id='VolumeId', **_EC2_TAGS),
+    ResourceType(kind='snapshot', list_op='describe_snapshots', list_params={'OwnerIds': ['self']}, items='Snapshots', id='SnapshotId',
+                 created='StartTime', created_filter='start-time', **_EC2_TAGS),
+    ResourceType(kind='AMI', list_op='describe_images', list_params={'Owners': ['self']}, items='Images', id='ImageId',
+                 created='CreationDate', created_filter='creation-date', **_EC2_TAGS),
+    ResourceType(kind='VPC', list_op='describe_vpcs', items='Vpcs', id='VpcId', **_EC2_TAGS),
+    ResourceType(kind='subnet', list_op='describe_subnets', items='Subnets', id='SubnetId', **_EC2_TAGS),
+    ResourceType(kind='route table', list_op='describe_route_tables', items='RouteTables', id='RouteTableId', **_EC2_TAGS),
+    ResourceType(kind='IGW', list_op='describe_internet_gateways', items='InternetGateways', id='InternetGatewayId', **_EC2_TAGS),
+    ResourceType(kind='NAT Gateway', list_op='describe_nat_gateways', items='NatGateways', id='NatGatewayId', **_EC2_TAGS),
+    ResourceType(kind='EIP', list_op='describe_addresses', items='Addresses[?AllocationId]', id='AllocationId', **_EC2_TAGS),
+    ResourceType(kind='TGW', list_op='describe_transit_gateways', items='TransitGateways', id='TransitGatewayId', **_EC2_TAGS),
+    ResourceType(kind='VPC endpoint', list_op='describe_vpc_endpoints', items='VpcEndpoints', id='VpcEndpointId',
+                 **dict(_EC2_TAGS, group='ec2_vpc_endpoints')),
+
+    ResourceType(kind='MSK cluster', list_op='list_clusters_v2', items='ClusterInfoList[].ClusterArn', **_KAFKA_TAGS),
+    ResourceType(kind='MSK configuration', list_op='list_configurations', items='Configurations[].Arn', **_KAFKA_TAGS),
+
+    ResourceType(kind='RDS instance', list_op='describe_db_instances', items='DBInstances[].DBInstanceArn', **_RDS_TAGS),
+    ResourceType(kind='RDS cluster', list_op='describe_db_clusters', items='DBClusters[].DBClusterArn', **_RDS_TAGS),
+    ResourceType(kind='RDS subnet group', list_op='describe_db_subnet_groups', items='DBSubnetGroups[].DBSubnetGroupArn', **_RDS_TAGS),
+    ResourceType(kind='RDS parameter group', list_op='describe_db_parameter_groups', items='DBParameterGroups[].DBParameterGroupArn', **_RDS_TAGS),
+    ResourceType(kind='RDS cluster parameter group', list_op='describe_db_cluster_parameter_groups', items='DBClusterParameterGroups[].DBClusterParameterGroupArn', **_RDS_TAGS),
+    ResourceType(kind='RDS snapshot', list_op='describe_db_snapshots', list_params={'SnapshotType': 'manual'}, items='DBSnapshots[].DBSnapshotArn', **_RDS_TAGS),
+    ResourceType(kind='RDS cluster snapshot', list_op='describe_db_cluster_snapshots', list_params={'SnapshotType': 'manual'}, items='DBClusterSnapshots[].DBClusterSnapshotArn', **_RDS_TAGS),
+    ResourceType(kind='RDS option group', list_op='describe_option_groups', items='OptionGroupsList[].OptionGroupArn', **_RDS_TAGS),
+
+    ResourceType(kind='serverless cache', list_op='describe_serverless_caches', items='ServerlessCaches', **_ELASTICACHE_TAGS),
+    ResourceType(kind='replication group', list_op='describe_replication_groups', items='ReplicationGroups', **_ELASTICACHE_TAGS),
+    ResourceType(kind='cache cluster', list_op='describe_cache_clusters', items='CacheClusters', **_ELASTICACHE_TAGS),
+    ResourceType(kind='subnet group', list_op='describe_cache_subnet_groups', items='CacheSubnetGroups', **_ELASTICACHE_TAGS),
+    ResourceType(kind='parameter group', list_op='describe_cache_parameter_groups', items='CacheParameterGroups', **_ELASTICACHE_TAGS),
+    ResourceType(kind='ElastiCache snapshot', list_op='describe_snapshots', items='Snapshots', **_ELASTICACHE_TAGS),
+    ResourceType(kind='ElastiCache user', list_op='describe_users', items='Users', **_ELASTICACHE_TAGS),
+
+    ResourceType(group='memorydb', kind='MemoryDB cluster', service='memorydb', list_op='describe_clusters', items='Clusters[].ARN', arn='@',
+                 read=('list_tags', 'ResourceArn', 'TagList'), write=('tag_resource', 'ResourceArn', 'Tags')),
+
+    ResourceType(group='eks', kind='EKS cluster', service='eks', list_op='list_clusters', items='clusters',
+                 arn_template='arn:{partition}:eks:{region}:{account}:cluster/{id}', tag_shape='map',
+                 read=('list_tags_for_resource', 'resourceArn', 'tags'), write=('tag_resource', 'resourceArn', 'tags')),
+    ResourceType(group='eks', kind='EKS nodegroup', service='eks', list_op='list_nodegroups', items='nodegroups',
+                 parent='EKS cluster', parent_param='clusterName',
+                 detail=('describe_nodegroup', {'clusterName': '{parent}', 'nodegroupName': '{id}'}, 'nodegroup'),
+                 arn='nodegroupArn', tags='tags', tag_shape='map', write=('tag_resource', 'resourceArn', 'tags')),
+
+    ResourceType(group='s3', kind='bucket', service='s3', list_op='list_buckets', items='Buckets[].Name',
+                 arn_template='arn:{partition}:s3:::{id}', target='id', merge=True, missing_codes=('NoSuchTagSet',),
+                 read=('get_bucket_tagging', 'Bucket', 'TagSet'), write=('put_bucket_tagging', 'Bucket', 'Tagging.TagSet')),
+
+    ResourceType(group='lambda', kind='Lambda function', service='lambda', list_op='list_functions', items='Functions[].FunctionArn',
+                 arn='@', tag_shape='map', read=('list_tags', 'Resource', 'Tags'), write=('tag_resource', 'Resource', 'Tags')),
+
+    ResourceType(group='dynamodb', kind='DynamoDB table', service='dynamodb', list_op='list_tables', items='TableNames',
+                 arn_template='arn:{partition}:dynamodb:{region}:{account}:table/{id}',
+                 read=('list_tags_of_resource', 'ResourceArn', 'Tags'), write=('tag_resource', 'ResourceArn', 'Tags')),
+
+    ResourceType(group='sns', kind='SNS topic', service='sns', list_op='list_topics', items='Topics[].TopicArn', arn='@',
+                 read=('list_tags_for_resource', 'ResourceArn', 'Tags'), write=('tag_resource', 'ResourceArn', 'Tags')),
+
+    ResourceType(group='sqs', kind='SQS queue', service='sqs', list_op='list_queues', items='QueueUrls', target='id', tag_shape='map',
+                 read=('list_queue_tags', 'QueueUrl', 'Tags'), write=('tag_queue', 'QueueUrl', 'Tags')),
+
+    ResourceType(group='elasticfilesystem', kind='EFS', service='efs', list_op='describe_file_systems', items='FileSystems',
+                 id='FileSystemId', arn='FileSystemArn', target='id', tags='Tags',
+                 write=('tag_resource', 'ResourceId', 'Tags')),
+
+    ResourceType(group='opensearch', kind='OpenSearch domain', service='opensearch', list_op='list_domain_names', items='DomainNames[].DomainName',
+                 arn_template='arn:{partition}:es:{region}:{account}:domain/{id}',
+                 read=('list_tags', 'ARN', 'TagList'), write=('add_tags', 'ARN', 'TagList')),
+
+    ResourceType(group='kms', kind='KMS key', service='kms', list_op='list_keys', items='Keys[].KeyId', target='id', tag_shape='kms',
+                 detail=('describe_key', {'KeyId': '{id}'}, 'KeyMetadata'), where="KeyManager == 'CUSTOMER'", arn='Arn',
+                 read=('list_resource_tags', 'KeyId', 'Tags'), write=('tag_resource', 'KeyId', 'Tags')),
+
+    ResourceType(group='elasticloadbalancing', kind='ELB', service='elbv2', list_op='describe_load_balancers', items='LoadBalancers[].LoadBalancerArn',
+                 arn='@', read=('describe_tags', 'ResourceArns[]', 'TagDescriptions[0].Tags'),
+                 write=('add_tags', 'ResourceArns[]', 'Tags'), write_batch=20),
+
+    ResourceType(group='dms', kind='DMS instance', service='dms', list_op='describe_replication_instances', items='ReplicationInstances[].ReplicationInstanceArn',
+                 arn='@', read=('list_tags_for_resource', 'ResourceArn', 'TagList'), write=('add_tags_to_resource', 'ResourceArn', 'Tags')),
+
+    ResourceType(group='mq', kind='MQ broker', service='mq', list_op='list_brokers', items='BrokerSummaries[].BrokerArn', arn='@', tag_shape='map',
+                 read=('list_tags', 'ResourceArn', 'Tags'), write=('create_tags', 'ResourceArn', 'Tags')),
+
+    ResourceType(kind='DocumentDB cluster', list_op='describe_db_clusters', items='DBClusters[].DBClusterArn', **_DOCDB_TAGS),
+    ResourceType(kind='DocumentDB elastic cluster', list_op='list_clusters', items='clusters[].clusterArn', **_DOCDB_ELASTIC_TAGS),
+    ResourceType(kind='DocumentDB instance', list_op='describe_db_instances', items='DBInstances[].DBInstanceArn', **_DOCDB_TAGS),
+    ResourceType(kind='DocumentDB subnet group', list_op='describe_db_subnet_groups', items='DBSubnetGroups[].DBSubnetGroupArn', **_DOCDB_TAGS),
+    ResourceType(kind='DocumentDB cluster parameter group', list_op='describe_db_cluster_parameter_groups', items='DBClusterParameterGroups[].DBClusterParameterGroupArn', **_DOCDB_TAGS),
+    ResourceType(kind='DocumentDB cluster snapshot', list_op='describe_db_cluster_snapshots', list_params={'SnapshotType': 'manual'}, items='DBClusterSnapshots[].DBClusterSnapshotArn', **_DOCDB_TAGS),
+    ResourceType(kind='DocumentDB elastic snapshot', list_op='list_cluster_snapshots', items='snapshots[].snapshotArn', **_DOCDB_ELASTIC_TAGS),
+
+    ResourceType(group='route53resolver', kind='Route53 Resolver endpoint', service='route53resolver', list_op='list_resolver_endpoints',
+                 items='ResolverEndpoints[].Arn', arn='@',
+                 read=('list_tags_for_resource', 'ResourceArn', 'Tags'), write=('tag_resource', 'ResourceArn', 'Tags')),
+
+    ResourceType(group='workspaces', kind='WorkSpace', service='workspaces', list_op='describe_workspaces', items='Workspaces[].WorkspaceId',
+                 target='id', read=('describe_tags', 'ResourceId', 'TagList'), write=('create_tags', 'ResourceId', 'Tags')),
+    ResourceType(group='workspaces', kind='Directory', service='ds', list_op='describe_directories', items='DirectoryDescriptions[].DirectoryId',
+                 target='id', read=('list_tags_for_resource', 'ResourceId', 'Tags'), write=('add_tags_to_resource', 'ResourceId', 'Tags')),
+]
+
+
+def groups():
+    """Return every group name in registry order."""
+    return list(dict.fromkeys(rtype.group for rtype in RESOURCE_TYPES))
+
+
+def types_in_group(group):
+    return [rtype for rtype in RESOURCE_TYPES if rtype.group == group]
+
+
+def type_by_kind(kind):
+    for rtype in RESOURCE_TYPES:
+        if rtype.kind == kind:
+            return rtype
+    raise KeyError(kind)
@@ -0,0 +1,320 @@
+import os
+import random
+import re
+import time
+
+from clients import get_client
+from journal import error_class, get_journal
+from ledger import get_ledger, tags_hash
+from logs import log
+from profiling import phase
+from ratelimit import THROTTLE_CODES
+
+# Resource Groups Tagging API limits: GetResources accepts at most 100 ARNs
+# per ResourceARNList and TagResources at most 20 ARNs per call.
+READ_BATCH_SIZE = 100
+WRITE_BATCH_SIZE = 20
+
+# TagResources reports per-ARN failures in FailedResourcesMap instead of
+# failing the call. Throttled and transient failures are written again as a
+# smaller batch, up to WRITE_RETRIES times, after a random delay of up to
+# WRITE_RETRY_BASE_DELAY * 2**attempt seconds. ARNs the service rejects for
+# good (unsupported type, access denied, invalid or missing resource) are
+# not retried or journaled. A multi-resource call such as EC2 CreateTags
+# fails as a whole for one bad id: the ids the error message names are
+# rejected and the rest written again, or, when it names none, the batch is
+# split in half until the bad ids are isolated.
+WRITE_RETRIES = int(os.getenv('WRITE_RETRIES', '3'))
+WRITE_RETRY_BASE_DELAY = float(os.getenv('WRITE_RETRY_BASE_DELAY', '0.5'))
+
+THROTTLED = 'throttled'
+TRANSIENT = 'transient'
+UNSUPPORTED = 'unsupported'
+ACCESS_DENIED = 'access_denied'
+INVALID = 'invalid'
+RETRYABLE = (THROTTLED, TRANSIENT)
+
+ACCESS_DENIED_CODES = {'AccessDenied', 'AccessDeniedException', 'UnauthorizedOperation', 'UnauthorizedException'}
+INVALID_CODES = {'InvalidParameterException', 'InvalidParameterValue', 'ValidationException',
+                 'ResourceNotFoundException', 'InvalidResourceId', 'InvalidID'}
+# EC2 reports missing and malformed ids as e.g. InvalidInstanceID.NotFound or InvalidVolumeID.Malformed.
+INVALID_SUFFIXES = ('.NotFound', '.Malformed')
+
+
+def chunked(items, size):
+    """Yield lists of at most `size` items from any iterable."""
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def unique_arns(arns):
+    """Yield each ARN once, dropping empty values and non-ARN identifiers."""
+    seen = set()
+    for arn in arns or []:
+        if not isinstance(arn, str) or not arn.startswith('arn:') or arn in seen:
+            continue
+        seen.add(arn)
+        yield arn
+
+
+def tag_delta(existing_tags, required_tags):
+    """Return the required tags that are missing or carry a different value."""
+    return {key: value for key, value in required_tags.items() if existing_tags.get(key) != value}
+
+
+def read_tags(client, arns):
+    """Return {arn: {key: value}} for up to READ_BATCH_SIZE ARNs in one GetResources call.
+
+    ARNs that have never been tagged are not returned by GetResources, so they
+    are simply absent from the result.
+    """
+    existing = {}
+    params = {'ResourceARNList': list(arns)}
+    while True:
+        response = client.get_resources(**params)
+        for mapping in response.get('ResourceTagMappingList', []):
+            existing[mapping['ResourceARN']] = {tag['Key']: tag['Value'] for tag in mapping.get('Tags', [])}
+        token = response.get('PaginationToken')
+        if not token:
+            return existing
+        params['PaginationToken'] = token
+
+
+class WriteError(Exception):
+    """One ARN's entry in FailedResourcesMap, shaped like a ClientError so error_class() reads its code."""
+
+    def __init__(self, code, message, status=None):
+        super().__init__(f"{code}: {message}")
+        self.response = {'Error': {'Code': code, 'Message': message}, 'ResponseMetadata': {'HTTPStatusCode': status}}
+
+
+def classify_error(code, message='', status=None):
+    """Sort a tagging failure into THROTTLED, TRANSIENT, UNSUPPORTED, ACCESS_DENIED or INVALID.
+
+    Anything not known to be permanent counts as TRANSIENT, so it is retried
+    and journaled rather than dropped.
+    """
+    message = (message or '').lower()
+    if code in THROTTLE_CODES or status == 429 or 'rate exceeded' in message or 'throttl' in message:
+        return THROTTLED
+    if code in ACCESS_DENIED_CODES or status == 403 or 'not authorized' in message or 'access denied' in message:
+        return ACCESS_DENIED
+    if 'not supported' in message or 'unsupported' in message:
+        return UNSUPPORTED
+    if code in INVALID_CODES or (code or '').endswith(INVALID_SUFFIXES):
+        return INVALID
+    return TRANSIENT
+
+
+def classify_failure(failure):
+    """Classify a ClientError, a WriteError or any other exception with classify_error()."""
+    response = getattr(failure, 'response', None) or {}
+    return classify_error(error_class(failure), response.get('Error', {}).get('Message') or str(failure),
+                          response.get('ResponseMetadata', {}).get('HTTPStatusCode'))
+
+
+def _named_in(error, arns):
+    """Return the ARNs or ids that a whole-call error message names."""
+    response = getattr(error, 'response', None) or {}
+    message = response.get('Error', {}).get('Message') or str(error)
+    words = {word.rstrip('.') for word in re.findall(r'[\w:/.-]+', message)}
+    return [arn for arn in arns if arn in words]
+
+
+def _failures(response, arns, error):
+    """Return {arn: WriteError or exception} for the ARNs a write call did not tag."""
+    if error is not None:
+        return {arn: error for arn in arns}
+    failed = (response.get('FailedResourcesMap') if isinstance(response, dict) else None) or {}
+    return {arn: WriteError(detail.get('ErrorCode'), detail.get('ErrorMessage'), detail.get('StatusCode'))
+            for arn, detail in failed.items()}
+
+
+class TagWriter:
+    """Groups ARNs by identical tag delta and writes each group with TagResources.
+
+    TagResources overwrites the value of an existing key, so changed values are
+    written directly without an UntagResources call first. Pass `write` as
+    write(ids, tags) to batch through a service's own multi-resource tag call,
+    `on_written` to be told which ids each successful call covered, and
+    `service` to label the resource outcomes in the logs. Ids that still
+    fail after WRITE_RETRIES go to the failure journal, or to
+    on_failed(ids, tags, error) when it is given. Ids rejected for good are
+    listed in `rejected`.
+    """
+
+    def __init__(self, client, batch_size=WRITE_BATCH_SIZE, write=None, on_written=None, service='tagging',
+                 on_failed=None):
+        self.client = client
+        self.batch_size = batch_size
+        self.write = write or (lambda arns, tags: self.client.tag_resources(ResourceARNList=arns, Tags=tags))
+        self.on_written = on_written
+        self.on_failed = on_failed or (lambda ids, tags, error: get_journal().record(
+            ids, client.meta.region_name, tags, error, service=service))
+        self.service = service
+        self.pending = {}
+        self.tagged = 0
+        self.failed = []
+        self.rejected = []
+
+    def add(self, arn, delta):
+        key = tuple(sorted(delta.items()))
+        group = self.pending.setdefault(key, [])
+        group.append(arn)
+        if len(group) >= self.batch_size:
+            self._write(key, self.pending.pop(key))
+
+    def flush(self):
+        while self.pending:
+            key, arns = self.pending.popitem()
+            self._write(key, arns)
+
+    def _write(self, key, arns):
+        tags = dict(key)
+        for attempt in range(WRITE_RETRIES + 1):
+            if attempt:
+                time.sleep(random.uniform(0, WRITE_RETRY_BASE_DELAY * 2 ** (attempt - 1)))
+            response, error = None, None
+            try:
+                with phase('writes'):
+                    response = self.write(arns, tags)
+            except Exception as e:
+                error = e
+            if error is not None and len(arns) > 1 and classify_failure(error) not in RETRYABLE:
+                self._isolate(key, arns, error)
+                return
+            failures = _failures(response, arns, error)
+
+            written = [arn for arn in arns if arn not in failures]
+            if written:
+                self.tagged += len(written)
+                log.resources('tag', 'tagged', written, service=self.service)
+                if self.on_written:
+                    self.on_written(written)
+
+            retry = []
+            for arn, failure in failures.items():
+                kind = classify_failure(failure)
+                if kind in RETRYABLE:
+                    retry.append(arn)
+                else:
+                    log.resources('tag', 'rejected', [arn], service=self.service, error=f"{kind}: {failure}")
+                    self.rejected.append(arn)
+            if not retry:
+                return
+            arns = retry
+
+        log.resources('tag', 'failed', arns, service=self.service, error=failures[arns[0]])
+        self.failed.extend(arns)
+        self.on_failed(arns, tags, failures[arns[0]])
+
+    def _isolate(self, key, arns, error):
+        """Reject the ids a permanent whole-call error names and write the rest, or bisect when it names none."""
+        named = _named_in(error, arns)
+        if named:
+            log.resources('tag', 'rejected', named, service=self.service, error=f"{classify_failure(error)}: {error}")
+            self.rejected.extend(named)
+            rest = [arn for arn in arns if arn not in named]
+            if rest:
+                self._write(key, rest)
+            return
+        half = len(arns) // 2
+        self._write(key, arns[:half])
+        self._write(key, arns[half:])
+
+
+def reconcile_tags(arns, region, required_tags, client=None, ledger=None, on_written=None, journal=True):
+    """Bring every ARN in `arns` up to `required_tags` with batched reads and writes.
+
+    ARNs found compliant or tagged successfully are recorded in the tag ledger,
+    when one is configured, so later sweeps can skip them, and on_written(arns)
+    is told about each successful write. Returns a summary with the number of
+    ARNs examined and tagged and the list of ARNs whose read or write failed.
+    Failures go to the failure journal unless `journal` is False, for callers
+    whose input is redelivered anyway.
+    """
+    if client is None:
+        client = get_client('resourcegroupstaggingapi', region_name=region)
+    ledger = ledger or get_ledger()
+    digest = tags_hash(required_tags)
+    record = (lambda arns: ledger.record(arns, digest)) if ledger else None
+
+    def written(arns):
+        if record:
+            record(arns)
+        if on_written:
+            on_written(arns)
+
+    writer = TagWriter(client, on_written=written,
+                       on_failed=None if journal else (lambda ids, tags, error: None))
+    examined = 0
+    failed = []
+
+    for chunk in chunked(unique_arns(arns), READ_BATCH_SIZE):
+        examined += len(chunk)
+        try:
+            existing = read_tags(client, chunk)
+        except Exception as e:
+            log.resources('read', 'failed', chunk, service='tagging', error=e)
+            if journal:
+                get_journal().record(chunk, region, required_tags, e, service='tagging')
+            failed.extend(chunk)
+            continue
+        compliant = []
+        for arn in chunk:
+            delta = tag_delta(existing.get(arn, {}), required_tags)
+            if delta:
+                writer.add(arn, delta)
+            else:
+                compliant.append(arn)
+        log.resources('tag', 'compliant', compliant, service='tagging')
+        if record and compliant:
+            record(compliant)
+
+    writer.flush()
+    if ledger:
+        ledger.flush()
+    return {'examined': examined, 'tagged': writer.tagged, 'failed': failed + writer.failed, 'rejected': writer.rejected}
+
+
+def iter_tag_mappings(client, **params):
+    """Yield GetResources pages' ResourceTagMappingList one page at a time."""
+    paginator = client.get_paginator('get_resources')
+    for page in paginator.paginate(**params):
+        yield page.get('ResourceTagMappingList', [])
+
+
+def sweep_region(region, required_tags, client=None):
+    """Stream every tagged resource in the region and fix the noncompliant ones.
+
+    The tags GetResources already returns with each page are diffed as the page
+    arrives, so no per-resource reads are made and only the current page plus
+    the writer's partially filled batches are held in memory.
+    """
+    if client is None:
+        client = get_client('resourcegroupstaggingapi', region_name=region)
+    writer = TagWriter(client)
+    examined = 0
+    pages = 0
+
+    try:
+        for mappings in iter_tag_mappings(client):
+            pages += 1
+            for mapping in mappings:
+                examined += 1
+                existing = {tag['Key']: tag['Value'] for tag in mapping.get('Tags', [])}
+                delta = tag_delta(existing, required_tags)
+                if delta:
+                    writer.add(mapping['ResourceARN'], delta)
+    except Exception as e:
+        log.error("Error getting resources", region=region, error=str(e))
+
+    writer.flush()
+    return {'examined': examined, 'pages': pages, 'tagged': writer.tagged, 'failed': writer.failed,
+            'rejected': writer.rejected}
@@ -0,0 +1,152 @@
+"""Build a trimmed, reproducible deployment bundle for the tagging function.
+
+The bundle holds the sources in ./lambda plus a pinned boto3/botocore from
+lambda/requirements.txt. botocore's data/ is cut down to the service models
+the function can call, and every module is precompiled to hash-checked
+bytecode for the runtime's Python. The script reports the bundle size and the
+time a fresh interpreter takes to import the handler from it.
+
+    python scripts/bundle_lambda.py --out build/lambda --python python3.10
+    cdk deploy -c lambdaAsset=build/lambda
+
+Building needs network access to PyPI, and precompiling needs an interpreter
+matching the runtime (see RUNTIME_PYTHON).
+"""
+import argparse
+import os
+import re
+import shutil
+import subprocess
+import sys
+import zipfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LAMBDA_DIR = os.path.join(ROOT, 'lambda')
+
+# Must match the runtime in AutoTagResourceStack.
+RUNTIME_PYTHON = '3.10'
+PLATFORM = 'manylinux2014_x86_64'
+
+# Models botocore may need outside of the services the handlers call.
+ALWAYS_KEEP = {'sts'}
+
+# A fixed timestamp so the same inputs always produce the same zip.
+ZIP_DATE = (1980, 1, 1, 0, 0, 0)
+
+
+def services_used(source_dir=LAMBDA_DIR):
+    """Return the boto3 service names the function can build clients for.
+
+    That is every registry service plus every literal get_client('...') call in
+    the sources.
+    """
+    sys.path.insert(0, source_dir)
+    try:
+        from registry import RESOURCE_TYPES
+    finally:
+        sys.path.remove(source_dir)
+    services = {rtype.service for rtype in RESOURCE_TYPES} | ALWAYS_KEEP
+    for name in os.listdir(source_dir):
+        if name.endswith('.py'):
+            with open(os.path.join(source_dir, name), encoding='utf-8') as source:
+                services.update(re.findall(r"get_client\(\s*'([\w-]+)'", source.read()))
+    return services
+
+
+def prune_models(data_dir, keep):
+    """Delete every service model directory under botocore's data/ not named in `keep`.
+
+    Top-level files (endpoints.json, partitions.json, _retry.json, ...) are kept.
+    Returns the names removed.
+    """
+    removed = []
+    for name in sorted(os.listdir(data_dir)):
+        path = os.path.join(data_dir, name)
+        if os.path.isdir(path) and name not in keep:
+            shutil.rmtree(path)
+            removed.append(name)
+    return removed
+
+
+def install(out):
+    subprocess.run([sys.executable, '-m', 'pip', 'install', '--quiet', '--no-compile', '--target', out,
+                    '--platform', PLATFORM, '--python-version', RUNTIME_PYTHON, '--only-binary=:all:',
+                    '-r', os.path.join(LAMBDA_DIR, 'requirements.txt')], check=True)
+    # Nothing in the bundle uses boto3 resources, the CLI entry points or package metadata.
+    for name in os.listdir(out):
+        if name.endswith(('.dist-info', '.egg-info')) or name == 'bin':
+            shutil.rmtree(os.path.join(out, name))
+    shutil.rmtree(os.path.join(out, 'boto3', 'data'), ignore_errors=True)
+    os.makedirs(os.path.join(out, 'boto3', 'data'))
+
+
+def copy_sources(out):
+    for name in sorted(os.listdir(LAMBDA_DIR)):
+        if name.endswith('.py'):
+            shutil.copy2(os.path.join(LAMBDA_DIR, name), os.path.join(out, name))
+
+
+def precompile(out, python):
+    """Compile to unchecked-hash .pyc so zip timestamps never make the runtime recompile."""
+    version = subprocess.run([python, '-c', 'import sys; print("%d.%d" % sys.version_info[:2])'],
+                             capture_output=True, text=True, check=True).stdout.strip()
+    if version != RUNTIME_PYTHON:
+        print(f"Skipping bytecode: {python} is Python {version}, the runtime is {RUNTIME_PYTHON}")
+        return False
+    subprocess.run([python, '-m', 'compileall', '-q', '-j', '0', '--invalidation-mode', 'unchecked-hash', out], check=True)
+    return True
+
+
+def write_zip(out, path):
+    """Zip `out` with sorted entries and fixed timestamps."""
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for folder, dirs, files in os.walk(out):
+            dirs.sort()
+            for name in sorted(files):
+                full = os.path.join(folder, name)
+                info = zipfile.ZipInfo(os.path.relpath(full, out), ZIP_DATE)
+                info.external_attr = 0o644 << 16
+                info.compress_type = zipfile.ZIP_DEFLATED
+                with open(full, 'rb') as source:
+                    archive.writestr(info, source.read())
+    return os.path.getsize(path)
+
+
+def import_seconds(out, python):
+    code = 'import time; started = time.perf_counter(); import index, clients; clients.get_client("resourcegroupstaggingapi"); print(time.perf_counter() - started)'
+    env = dict(os.environ, tags='{}', AWS_DEFAULT_REGION='us-east-1', PYTHONPATH=out, PRELOAD_SERVICES='')
+    output = subprocess.run([python, '-c', code], cwd=out, env=env, capture_output=True, text=True, check=True).stdout
+    return float(output.strip().splitlines()[-1])
+
+
+def tree_size(path):
+    return sum(os.path.getsize(os.path.join(folder, name)) for folder, _, files in os.walk(path) for name in files)
+
+
+def build(out, python=sys.executable, zip_path=None):
+    shutil.rmtree(out, ignore_errors=True)
+    os.makedirs(out)
+    install(out)
+    keep = services_used()
+    removed = prune_models(os.path.join(out, 'botocore', 'data'), keep)
+    copy_sources(out)
+    compiled = precompile(out, python)
+    report = {
+        'services': sorted(keep),
+        'models_removed': len(removed),
+        'bytecode': compiled,
+        'unzipped_bytes': tree_size(out),
+        'zip_bytes': write_zip(out, zip_path or out.rstrip('/') + '.zip'),
+    }
+    if compiled:
+        report['import_seconds'] = import_seconds(out, python)
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--out', default=os.path.join(ROOT, 'build', 'lambda'))
+    parser.add_argument('--python', default=sys.executable, help=f'interpreter matching the Python {RUNTIME_PYTHON} runtime')
+    args = parser.parse_args()
+    for key, value in build(args.out, args.python).items():
+        print(f"{key}: {value}")
@@ -0,0 +1,10 @@
+import os
+import sys
+
+# The Lambda sources live in ./lambda, which is a Python keyword and so can't
+# be imported as a package; put the directory itself on the path instead.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'lambda'))
+
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+os.environ.setdefault('AWS_ACCESS_KEY_ID', 'testing')
+os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'testing')
@@ -3,13 +3,157 @@ import aws_cdk.assertions as assertions
 
 from auto_tag_resource.auto_tag_resource_stack import AutoTagResourceStack
 
-# example tests. To run these tests, uncomment this file along with the example
-# resource in auto_tag_resource/auto_tag_resource_stack.py
-def test_sqs_queue_created():
-    app = core.App()
+
+def _template(context=None):
+    app = core.App(context=context)
     stack = AutoTagResourceStack(app, "auto-tag-resource")
-    template = assertions.Template.from_stack(stack)
+    return assertions.Template.from_stack(stack)
+
+
+def test_rule_targets_function_directly_by_default():
+    template = _template()
+
+    # Only the deferred re-check queue and the failure journal.
+    template.resource_count_is("AWS::SQS::Queue", 2)
+    template.has_resource_properties("AWS::Lambda::Function", {"Handler": "index.main", "MemorySize": 512})
+
+
+def test_event_buffer_adds_batched_queue_source():
+    template = _template({"eventBuffer": "true", "eventBatchSize": "50", "eventBatchWindowSeconds": "20"})
+
+    template.resource_count_is("AWS::SQS::Queue", 4)
+    template.has_resource_properties("AWS::Lambda::EventSourceMapping", {
+        "BatchSize": 50,
+        "MaximumBatchingWindowInSeconds": 20,
+        "FunctionResponseTypes": ["ReportBatchItemFailures"],
+    })
+
+
+def test_reconciliation_schedule_is_configurable():
+    _template().has_resource_properties("AWS::Events::Rule", {"ScheduleExpression": "rate(12 hours)"})
+    _template({"reconcileSchedule": "cron(0 3 * * ? *)"}).has_resource_properties(
+        "AWS::Events::Rule", {"ScheduleExpression": "cron(0 3 * * ? *)"})
+    _template({"reconcileSchedule": "off", "replaySchedule": "off"}).resource_count_is("AWS::Events::Rule", 1)
+
+
+def test_ledger_table_is_wired_to_function():
+    template = _template({"ledgerTtlSeconds": "3600"})
+
+    template.has_resource_properties("AWS::DynamoDB::Table", {
+        "TimeToLiveSpecification": {"AttributeName": "expires_at", "Enabled": True},
+    })
+    template.has_resource_properties("AWS::Lambda::Function", {
+        "Environment": {"Variables": assertions.Match.object_like({"LEDGER_TTL_SECONDS": "3600"})},
+    })
+
+
+def test_recheck_queue_feeds_function():
+    template = _template()
+
+    template.has_resource_properties("AWS::Lambda::Function", {
+        "Environment": {"Variables": assertions.Match.object_like({"RECHECK_QUEUE_URL": assertions.Match.any_value()})},
+    })
+    template.has_resource_properties("AWS::Lambda::EventSourceMapping", {"BatchSize": 10})
+
+
+def _event_rule_pattern():
+    [rule] = [resource for resource in _template().find_resources("AWS::Events::Rule").values()
+              if "EventPattern" in resource["Properties"]]
+    return rule["Properties"]["EventPattern"]
+
+
+OWN_SESSIONS = "arn:aws:sts::111122223333:assumed-role/resource-tagging-role-us-east-1/"
+
+
+def _matches(pattern, source, event_name, caller="arn:aws:iam::111122223333:user/admin"):
+    """Match a CloudTrail event against the rule (the subset of the pattern syntax it uses).
+
+    The own-role prefix is a CloudFormation join, so callers under OWN_SESSIONS stand in for it.
+    """
+    if source not in pattern["source"]:
+        return False
+    [caller_filter] = pattern["detail"]["userIdentity"]["arn"]
+    assert "prefix" in caller_filter["anything-but"]
+    if caller.startswith(OWN_SESSIONS):
+        return False
+    return any(f"{source[4:]}.amazonaws.com" in clause["eventSource"] and event_name in clause["eventName"]
+               for clause in pattern["detail"]["$or"])
+
+
+def test_rule_excludes_the_functions_own_calls():
+    pattern = _event_rule_pattern()
+    [join] = pattern["detail"]["userIdentity"]["arn"][0]["anything-but"]["prefix"]["Fn::Join"][1:]
+
+    assert join[2] == ":sts::" and join[4] == ":assumed-role/" and list(join[5]) == ["Ref"] and join[6] == "/"
+    assert _matches(pattern, "aws.ec2", "CreateVpc")
+    assert _matches(pattern, "aws.ec2", "CreateVpc", caller="arn:aws:sts::111122223333:assumed-role/admin/alice")
+    assert not _matches(pattern, "aws.ec2", "CreateVpc", caller=OWN_SESSIONS + "resource-tagging-automation-function")
+
+
+def test_rule_is_generated_from_the_handled_events():
+    pattern = _event_rule_pattern()
+
+    assert "aws.ec2" in pattern["source"] and "aws.gamelift" not in pattern["source"]
+    assert "aws.docdb" not in pattern["source"]
+    assert _matches(pattern, "aws.ec2", "RunInstances")
+    assert not any(_matches(pattern, "aws.ec2", name) for name in ("CreateTags", "workspaceId", "DeleteCluster"))
+    assert not _matches(pattern, "aws.workspaces", "CreateDirectory")
+    assert pattern["detail"]["errorCode"] == [{"exists": False}]
+
+
+def test_rule_pattern_fits_put_rule_limit():
+    import json
+
+    pattern = _event_rule_pattern()
+
+    # PutRule rejects an EventPattern longer than 4096 characters.
+    assert len(json.dumps(pattern, separators=(",", ":"))) <= 4096
+    assert len(pattern["detail"]["$or"]) == len(pattern["source"])
+
+
+def test_rule_does_not_match_another_services_event_names():
+    pattern = _event_rule_pattern()
+
+    assert _matches(pattern, "aws.rds", "CreateDBInstance")
+    assert _matches(pattern, "aws.eks", "CreateCluster")
+    # Each name is handled for some service, just not for this one.
+    assert not _matches(pattern, "aws.rds", "RunInstances")
+    assert not _matches(pattern, "aws.s3", "CreateTable")
+    assert not _matches(pattern, "aws.eks", "CreateBucket")
+
+
+def test_failure_journal_is_replayed_on_a_schedule():
+    template = _template()
+
+    template.has_resource_properties("AWS::Lambda::Function", {
+        "Environment": {"Variables": assertions.Match.object_like({"FAILURE_QUEUE_URL": assertions.Match.any_value()})},
+    })
+    template.has_resource_properties("AWS::Events::Rule", {
+        "ScheduleExpression": "rate(1 hour)",
+        "Targets": [assertions.Match.object_like({"Input": '{"replay":{}}'})],
+    })
+
+
+def test_role_allows_every_registry_operation():
+    import fnmatch
+
+    from auto_tag_resource import auto_tag_resource_stack as stack_module
+
+    allowed = []
+    for policy in _template().find_resources("AWS::IAM::Policy").values():
+        for statement in policy["Properties"]["PolicyDocument"]["Statement"]:
+            actions = statement["Action"]
+            allowed.extend(action.lower() for action in ([actions] if isinstance(actions, str) else actions))
+
+    def is_allowed(action):
+        # IAM action names are case-insensitive and may use wildcards.
+        return any(fnmatch.fnmatchcase(action.lower(), pattern) for pattern in allowed)
 
-#     template.has_resource_properties("AWS::SQS::Queue", {
-#         "VisibilityTimeout": 300
-#     })
+    for rtype in stack_module._load_lambda_module("registry").RESOURCE_TYPES:
+        for operation in filter(None, (rtype.list_op, rtype.detail and rtype.detail[0],
+                                       rtype.read and rtype.read[0], rtype.write and rtype.write[0])):
+            assert is_allowed(stack_module._iam_action(rtype.service, operation)), (rtype.kind, operation)
+    for action in ("ec2:DescribeInstances", "lambda:ListFunctions", "dynamodb:ListTagsOfResource", "s3:ListAllMyBuckets",
+                   "rds:DescribeDBClusters", "es:ListDomainNames", "elasticloadbalancing:DescribeLoadBalancers",
+                   "elasticfilesystem:DescribeFileSystems", "docdb-elastic:ListClusters", "route53resolver:ListResolverEndpoints"):
+        assert is_allowed(action), action
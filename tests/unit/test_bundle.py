@@ -0,0 +1,20 @@
+import os
+
+from registry import RESOURCE_TYPES
+from scripts.bundle_lambda import prune_models, services_used
+
+
+def test_bundle_keeps_every_service_the_function_calls():
+    services = services_used()
+
+    assert {rtype.service for rtype in RESOURCE_TYPES} <= services
+    assert {'resourcegroupstaggingapi', 'sqs', 'dynamodb', 'workspaces'} <= services
+
+
+def test_prune_models_keeps_shared_data_files(tmp_path):
+    for name in ('ec2', 's3', 'iot'):
+        (tmp_path / name).mkdir()
+    (tmp_path / 'endpoints.json').write_text('{}')
+
+    assert prune_models(str(tmp_path), {'ec2', 's3'}) == ['iot']
+    assert sorted(os.listdir(tmp_path)) == ['ec2', 'endpoints.json', 's3']
@@ -0,0 +1,16 @@
+import clients
+
+
+def test_clients_are_reused_per_service_region_and_credentials():
+    clients.reset_clients()
+    first = clients.get_client('sqs', region_name='us-east-1')
+    assert clients.get_client('sqs', region_name='us-east-1') is first
+    assert clients.get_client('sqs', region_name='eu-west-2') is not first
+    assumed = {'AccessKeyId': 'AKIA', 'SecretAccessKey': 'secret', 'SessionToken': 'token'}
+    assert clients.get_client('sqs', region_name='us-east-1', credentials=assumed) is not first
+
+    stats = clients.client_stats()
+    assert (stats['hits'], stats['misses'], stats['cached']) == (1, 3, 3)
+    assert stats['construction_seconds'] > 0
+    assert first.meta.config.retries['mode'] == 'adaptive'
+    assert first.meta.config.max_pool_connections == clients.MAX_WORKERS
@@ -0,0 +1,17 @@
+import os
+
+from benchmarks.cold_start import measure
+
+# Generous budgets in seconds: importing the handler used to take about 0.2s
+# with boto3 loaded eagerly and now takes about 0.05s.
+IMPORT_BUDGET = float(os.getenv('COLD_START_IMPORT_BUDGET', '0.15'))
+INVOCATION_BUDGET = float(os.getenv('COLD_START_INVOCATION_BUDGET', '1.5'))
+
+
+def test_cold_start_stays_within_budget():
+    result = measure(samples=3)
+
+    assert result['status'] == 200
+    assert result['eager_modules'] == []
+    assert result['import'] < IMPORT_BUDGET
+    assert result['first_invocation'] < INVOCATION_BUDGET
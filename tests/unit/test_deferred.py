@@ -0,0 +1,79 @@
+import time
+
+import pytest
+from botocore.stub import Stubber
+
+import deferred
+from clients import get_client, reset_clients
+from deferred import LocalDelayQueue, defer, recheck
+
+ARN = 'arn:aws:kafka:us-east-1:111122223333:cluster/orders/abc'
+
+
+@pytest.fixture(autouse=True)
+def fresh_clients():
+    reset_clients()
+    yield
+    reset_clients()
+
+
+def test_defer_queues_job_after_base_delay():
+    queue = LocalDelayQueue()
+
+    assert defer('msk-cluster', 'us-east-1', {'id': ARN}, arn=ARN, queue=queue)
+    assert queue.due() == []
+    [job] = queue.due(time.time() + deferred.RECHECK_BASE_DELAY * 1.2)
+    assert job['check'] == 'msk-cluster' and job['attempt'] == 0
+
+
+def test_pending_resource_backs_off_and_ready_resource_is_returned():
+    queue = LocalDelayQueue()
+    job = {'check': 'msk-cluster', 'region': 'us-east-1', 'account': '111122223333', 'arn': ARN,
+           'params': {'id': ARN}, 'attempt': 3, 'first_seen': time.time()}
+    client = get_client('kafka', region_name='us-east-1')
+
+    with Stubber(client) as stub:
+        stub.add_response('describe_cluster_v2', {'ClusterInfo': {'State': 'CREATING'}}, {'ClusterArn': ARN})
+        stub.add_response('describe_cluster_v2', {'ClusterInfo': {'State': 'ACTIVE'}}, {'ClusterArn': ARN})
+        assert recheck(job, queue) == []
+        [(when, requeued)] = queue.jobs
+        assert requeued['attempt'] == 4
+        assert when - time.time() >= deferred.RECHECK_BASE_DELAY * 2 ** 4 * 0.8 - 1
+        assert recheck(requeued, queue) == [ARN]
+        stub.assert_no_pending_responses()
+
+    assert len(queue.jobs) == 1
+
+
+def test_stale_and_failed_checks_are_dropped():
+    queue = LocalDelayQueue()
+    stale = {'check': 'msk-cluster', 'region': 'us-east-1', 'account': None, 'arn': ARN, 'params': {'id': ARN},
+             'attempt': 6, 'first_seen': time.time() - deferred.RECHECK_MAX_AGE - 1}
+    client = get_client('kafka', region_name='us-east-1')
+
+    with Stubber(client) as stub:
+        stub.add_client_error('describe_cluster_v2', 'InternalServerErrorException')
+        stub.add_response('describe_cluster_v2', {'ClusterInfo': {'State': 'FAILED'}}, {'ClusterArn': ARN})
+        assert recheck(stale, queue) == []
+        assert recheck(dict(stale, first_seen=time.time()), queue) == []
+
+    assert queue.jobs == []
+
+
+def test_dynamodb_table_is_ready_once_active():
+    queue = LocalDelayQueue()
+    arn = 'arn:aws:dynamodb:us-east-1:111122223333:table/orders'
+    job = {'check': 'dynamodb-table', 'region': 'us-east-1', 'account': '111122223333', 'arn': arn,
+           'params': {'id': 'orders'}, 'attempt': 0, 'first_seen': time.time()}
+    client = get_client('dynamodb', region_name='us-east-1')
+
+    with Stubber(client) as stub:
+        stub.add_response('describe_table', {'Table': {'TableStatus': 'CREATING'}}, {'TableName': 'orders'})
+        stub.add_response('describe_table', {'Table': {'TableStatus': 'ACTIVE'}}, {'TableName': 'orders'})
+        assert recheck(job, queue) == []
+        assert recheck(job, queue) == [arn]
+    assert len(queue.jobs) == 1
+
+
+def test_nat_gateway_search_starts_just_before_the_event():
+    assert deferred.nat_gateway_since({'time': '2024-01-01T00:00:00Z'}) == 1704067200 - deferred.NAT_GATEWAY_SINCE_SLACK
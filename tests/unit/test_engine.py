@@ -0,0 +1,217 @@
+import time
+from datetime import datetime, timezone
+
+import pytest
+from botocore.stub import Stubber
+
+import executor
+from clients import get_client, reset_clients
+import engine
+from engine import format_tags, iter_items, parse_tags, sweep_ec2, sweep_type, tag_ec2_launch
+from ledger import Ledger, SqliteStore, tags_hash
+from registry import RESOURCE_TYPES, type_by_kind
+
+REQUIRED = {'map-migrated': 'mig123'}
+
+
+@pytest.fixture(autouse=True)
+def single_worker(monkeypatch):
+    # Stubber answers in order, so keep per-item calls on one worker.
+    for rtype in RESOURCE_TYPES:
+        monkeypatch.setitem(executor.SERVICE_CONCURRENCY, rtype.service, 1)
+    reset_clients()
+    yield
+    reset_clients()
+
+
+def test_registry_kinds_are_unique_and_complete():
+    kinds = [rtype.kind for rtype in RESOURCE_TYPES]
+    assert len(kinds) == len(set(kinds))
+    for rtype in RESOURCE_TYPES:
+        assert rtype.write and rtype.tag_shape in ('list', 'map', 'kms')
+        assert rtype.arn or rtype.arn_template or rtype.target == 'id'
+
+
+def test_tag_shapes_round_trip():
+    for shape in ('list', 'map', 'kms'):
+        assert parse_tags(shape, format_tags(shape, REQUIRED)) == REQUIRED
+
+
+def test_ec2_types_diff_inline_tags_and_batch_writes():
+    client = get_client('ec2', region_name='us-east-1')
+    vpcs = [{'VpcId': 'vpc-1', 'Tags': [{'Key': 'map-migrated', 'Value': 'mig123'}]},
+            {'VpcId': 'vpc-2'},
+            {'VpcId': 'vpc-3', 'Tags': [{'Key': 'map-migrated', 'Value': 'old'}]}]
+
+    with Stubber(client) as stub:
+        stub.add_response('describe_vpcs', {'Vpcs': vpcs}, {})
+        stub.add_response('create_tags', {}, {'Resources': ['vpc-2', 'vpc-3'], 'Tags': [{'Key': 'map-migrated', 'Value': 'mig123'}]})
+        summary = sweep_type(type_by_kind('VPC'), 'us-east-1', '111122223333', REQUIRED)
+        stub.assert_no_pending_responses()
+
+    assert summary == {'kind': 'VPC', 'examined': 3, 'skipped': 0, 'tagged': 2, 'failed': []}
+
+
+def test_arn_template_read_and_write():
+    client = get_client('dynamodb', region_name='us-east-1')
+    arn = 'arn:aws:dynamodb:us-east-1:111122223333:table/orders'
+
+    with Stubber(client) as stub:
+        stub.add_response('list_tables', {'TableNames': ['orders']}, {})
+        stub.add_response('list_tags_of_resource', {'Tags': []}, {'ResourceArn': arn})
+        stub.add_response('tag_resource', {}, {'ResourceArn': arn, 'Tags': [{'Key': 'map-migrated', 'Value': 'mig123'}]})
+        summary = sweep_type(type_by_kind('DynamoDB table'), 'us-east-1', '111122223333', REQUIRED)
+        stub.assert_no_pending_responses()
+
+    assert summary['tagged'] == 1 and summary['failed'] == []
+
+
+def test_s3_merges_existing_tags_and_treats_missing_tag_set_as_empty():
+    client = get_client('s3', region_name='us-east-1')
+
+    with Stubber(client) as stub:
+        stub.add_response('list_buckets', {'Buckets': [{'Name': 'logs'}, {'Name': 'data'}]}, {})
+        stub.add_client_error('get_bucket_tagging', 'NoSuchTagSet', expected_params={'Bucket': 'logs'})
+        stub.add_response('put_bucket_tagging', {}, {'Bucket': 'logs', 'Tagging': {'TagSet': [{'Key': 'map-migrated', 'Value': 'mig123'}]}})
+        stub.add_response('get_bucket_tagging', {'TagSet': [{'Key': 'owner', 'Value': 'me'}]}, {'Bucket': 'data'})
+        stub.add_response('put_bucket_tagging', {}, {'Bucket': 'data', 'Tagging': {'TagSet': [
+            {'Key': 'owner', 'Value': 'me'}, {'Key': 'map-migrated', 'Value': 'mig123'}]}})
+        summary = sweep_type(type_by_kind('bucket'), 'us-east-1', '111122223333', REQUIRED)
+        stub.assert_no_pending_responses()
+
+    assert summary['tagged'] == 2
+
+
+def test_kms_skips_aws_managed_keys():
+    client = get_client('kms', region_name='us-east-1')
+    metadata = {'KeyId': 'k1', 'Arn': 'arn:aws:kms:us-east-1:111122223333:key/k1', 'KeyManager': 'AWS'}
+
+    with Stubber(client) as stub:
+        stub.add_response('list_keys', {'Keys': [{'KeyId': 'k1'}, {'KeyId': 'k2'}]}, {})
+        stub.add_response('describe_key', {'KeyMetadata': metadata}, {'KeyId': 'k1'})
+        stub.add_response('describe_key', {'KeyMetadata': dict(metadata, KeyId='k2', KeyManager='CUSTOMER')}, {'KeyId': 'k2'})
+        stub.add_response('list_resource_tags', {'Tags': []}, {'KeyId': 'k2'})
+        stub.add_response('tag_resource', {}, {'KeyId': 'k2', 'Tags': [{'TagKey': 'map-migrated', 'TagValue': 'mig123'}]})
+        summary = sweep_type(type_by_kind('KMS key'), 'us-east-1', '111122223333', REQUIRED)
+        stub.assert_no_pending_responses()
+
+    assert summary == {'kind': 'KMS key', 'examined': 2, 'skipped': 0, 'tagged': 1, 'failed': []}
+
+
+def test_listing_follows_every_page():
+    client = get_client('lambda', region_name='us-east-1')
+    arns = [f'arn:aws:lambda:us-east-1:111122223333:function:fn-{i}' for i in range(3)]
+
+    with Stubber(client) as stub:
+        stub.add_response('list_functions', {'Functions': [{'FunctionArn': arns[0]}], 'NextMarker': 'm1'}, {})
+        stub.add_response('list_functions', {'Functions': [{'FunctionArn': arns[1]}, {'FunctionArn': arns[2]}]}, {'Marker': 'm1'})
+        items = iter_items(client, type_by_kind('Lambda function'))
+        assert list(items) == arns
+        stub.assert_no_pending_responses()
+
+
+def test_ec2_sweep_diffs_describe_tags_and_batches_across_types():
+    client = get_client('ec2', region_name='us-east-1')
+    describe_tags = {'Filters': [{'Name': 'key', 'Values': ['map-migrated']}], 'MaxResults': 1000}
+
+    with Stubber(client) as stub:
+        stub.add_response('describe_tags', {'Tags': [
+            {'ResourceId': 'vpc-1', 'ResourceType': 'vpc', 'Key': 'map-migrated', 'Value': 'mig123'},
+            {'ResourceId': 'subnet-1', 'ResourceType': 'subnet', 'Key': 'map-migrated', 'Value': 'old'}]}, describe_tags)
+        stub.add_response('describe_vpcs', {'Vpcs': [{'VpcId': 'vpc-1'}, {'VpcId': 'vpc-2'}]}, {})
+        stub.add_response('describe_subnets', {'Subnets': [{'SubnetId': 'subnet-1'}]}, {})
+        stub.add_response('create_tags', {}, {'Resources': ['vpc-2', 'subnet-1'], 'Tags': [{'Key': 'map-migrated', 'Value': 'mig123'}]})
+        summaries = sweep_ec2([type_by_kind('VPC'), type_by_kind('subnet')], 'us-east-1', '111122223333', REQUIRED)
+        stub.assert_no_pending_responses()
+
+    assert [(s['kind'], s['examined'], s['tagged'], s['failed']) for s in summaries] == [
+        ('VPC', 2, 1, []), ('subnet', 1, 1, [])]
+
+
+def test_ec2_sweep_falls_back_to_inline_tags_without_describe_tags():
+    client = get_client('ec2', region_name='us-east-1')
+
+    with Stubber(client) as stub:
+        stub.add_client_error('describe_tags', 'UnauthorizedOperation')
+        stub.add_response('describe_vpcs', {'Vpcs': [{'VpcId': 'vpc-1', 'Tags': [{'Key': 'map-migrated', 'Value': 'mig123'}]}]}, {})
+        [summary] = sweep_ec2([type_by_kind('VPC')], 'us-east-1', '111122223333', REQUIRED)
+        stub.assert_no_pending_responses()
+
+    assert summary['examined'] == 1 and summary['tagged'] == 0
+
+
+def test_launch_is_tagged_with_one_create_tags_call():
+    client = get_client('ec2', region_name='us-east-1')
+    filters = {'Filters': [{'Name': 'attachment.instance-id', 'Values': ['i-1', 'i-2']}]}
+
+    with Stubber(client) as stub:
+        stub.add_response('describe_volumes', {'Volumes': [{'VolumeId': 'vol-1'}, {'VolumeId': 'vol-2'}]}, filters)
+        stub.add_response('describe_network_interfaces', {'NetworkInterfaces': [{'NetworkInterfaceId': 'eni-1'}]}, filters)
+        stub.add_response('create_tags', {}, {'Resources': ['i-1', 'i-2', 'vol-1', 'vol-2', 'eni-1'],
+                                              'Tags': [{'Key': 'map-migrated', 'Value': 'mig123'}]})
+        summary = tag_ec2_launch('us-east-1', ['i-1', 'i-2'], REQUIRED)
+        stub.assert_no_pending_responses()
+
+    assert summary == {'examined': 5, 'tagged': 5, 'failed': [], 'rejected': []}
+
+
+def test_failed_launch_is_journaled(monkeypatch):
+    import journal
+    import tagging
+    from journal import FailureJournal, LocalJournal
+
+    monkeypatch.setattr(tagging, 'WRITE_RETRY_BASE_DELAY', 0)
+    failures = FailureJournal(LocalJournal())
+    monkeypatch.setattr(journal, '_journal', failures)
+    client = get_client('ec2', region_name='us-east-1')
+
+    with Stubber(client) as stub:
+        stub.add_client_error('describe_volumes', 'UnauthorizedOperation')
+        for _ in range(tagging.WRITE_RETRIES + 1):
+            stub.add_client_error('create_tags', 'InternalError', http_status_code=500)
+        summary = tag_ec2_launch('us-east-1', ['i-1'], REQUIRED)
+        stub.assert_no_pending_responses()
+
+    assert summary == {'examined': 1, 'tagged': 0, 'failed': ['i-1'], 'rejected': []}
+    assert [(entry['target'], entry['service']) for entry in failures.pending] == [('i-1', 'ec2')]
+
+
+def test_snapshots_are_listed_incrementally_from_the_watermark():
+    client = get_client('ec2', region_name='us-east-1')
+    ledger = Ledger(SqliteStore())
+    digest = tags_hash(REQUIRED)
+    name = engine._watermark_name(type_by_kind('snapshot'), 'us-east-1', '111122223333')
+    now = time.time()
+    ledger.set_mark(name + ':full', digest, now - 3600)
+    ledger.set_mark(name, digest, now)
+    today = datetime.fromtimestamp(now, timezone.utc)
+    describe_tags = {'Filters': [{'Name': 'key', 'Values': ['map-migrated']}], 'MaxResults': 1000}
+
+    with Stubber(client) as stub:
+        stub.add_response('describe_tags', {'Tags': []}, describe_tags)
+        stub.add_response('describe_snapshots', {'Snapshots': [{'SnapshotId': 'snap-1', 'StartTime': today}]}, {
+            'OwnerIds': ['self'], 'Filters': [{'Name': 'start-time', 'Values': [f'{today.date()}*']}]})
+        stub.add_response('create_tags', {}, {'Resources': ['snap-1'], 'Tags': [{'Key': 'map-migrated', 'Value': 'mig123'}]})
+        [summary] = sweep_ec2([type_by_kind('snapshot')], 'us-east-1', '111122223333', REQUIRED, ledger)
+        stub.assert_no_pending_responses()
+
+    assert summary['tagged'] == 1
+    assert ledger.mark(name + ':full', digest) == pytest.approx(now - 3600)
+
+
+def test_first_sweep_is_full_and_records_a_watermark():
+    rtype = type_by_kind('AMI')
+    ledger = Ledger(SqliteStore())
+    digest = tags_hash(REQUIRED)
+
+    assert engine.incremental_params(rtype, ledger, digest, 'us-east-1', '111122223333') is None
+    client = get_client('ec2', region_name='us-east-1')
+    with Stubber(client) as stub:
+        stub.add_response('describe_tags', {'Tags': []})
+        stub.add_response('describe_images', {'Images': [{'ImageId': 'ami-1', 'CreationDate': '2026-10-01T11:04:43.000Z'}]}, {'Owners': ['self']})
+        stub.add_response('create_tags', {})
+        sweep_ec2([rtype], 'us-east-1', '111122223333', REQUIRED, ledger)
+
+    name = engine._watermark_name(rtype, 'us-east-1', '111122223333')
+    assert ledger.mark(name, digest) == datetime(2026, 10, 1, 11, 4, 43, tzinfo=timezone.utc).timestamp()
+    assert ledger.mark(name, tags_hash({'other': 'tags'})) is None
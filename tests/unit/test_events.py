@@ -0,0 +1,21 @@
+import inspect
+
+import events
+import index
+
+
+def test_handled_events_match_the_index_handlers():
+    handlers = {name for name in dir(index) if name.startswith('aws_') and callable(getattr(index, name))}
+
+    assert {source.replace('.', '_') for source in events.HANDLED_EVENTS} == handlers
+    for source, names in events.HANDLED_EVENTS.items():
+        code = inspect.getsource(getattr(index, source.replace('.', '_')))
+        assert all(f"'{name}'" in code for name in names), source
+
+
+def test_failed_and_unimplemented_calls_are_not_handled():
+    event = {'source': 'aws.ec2', 'detail': {'eventName': 'CreateVpc'}}
+
+    assert events.is_handled(event)
+    assert not events.is_handled({'source': 'aws.ec2', 'detail': {'eventName': 'CreateTags'}})
+    assert not events.is_handled(dict(event, detail={'eventName': 'CreateVpc', 'errorCode': 'Client.UnauthorizedOperation'}))
@@ -0,0 +1,38 @@
+import threading
+import time
+
+import executor
+
+
+def test_map_resources_bounds_concurrency_and_collects_errors(monkeypatch):
+    monkeypatch.setitem(executor.SERVICE_CONCURRENCY, 'rds', 3)
+    lock = threading.Lock()
+    active = {'now': 0, 'peak': 0}
+
+    def process(item):
+        with lock:
+            active['now'] += 1
+            active['peak'] = max(active['peak'], active['now'])
+        time.sleep(0.01)
+        with lock:
+            active['now'] -= 1
+        if item % 5 == 0:
+            raise ValueError(f"bad {item}")
+        return item
+
+    summary = executor.map_resources('rds', process, (i for i in range(20)))
+
+    assert summary['processed'] == 20
+    assert sorted(summary['results']) == [i for i in range(20) if i % 5]
+    assert sorted(ident for ident, _ in summary['errors']) == [0, 5, 10, 15]
+    assert 1 < active['peak'] <= 3
+
+
+def test_run_sweeps_aggregates_per_service():
+    def broken():
+        raise RuntimeError("boom")
+
+    outcome = executor.run_sweeps({'s3': lambda: 'ok', 'kms': broken})
+
+    assert outcome['s3'] == {'result': 'ok', 'error': None}
+    assert isinstance(outcome['kms']['error'], RuntimeError)
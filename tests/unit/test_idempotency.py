@@ -0,0 +1,53 @@
+import boto3
+from botocore.stub import Stubber
+
+from idempotency import DynamoStore, Idempotency, SqliteStore
+
+
+def test_claims_are_shared_across_containers_and_expire():
+    store = SqliteStore()
+    first, second = Idempotency(store, ttl=100, in_flight=50), Idempotency(store, ttl=100, in_flight=50)
+
+    assert first.claim('e-1', now=1000)
+    assert not first.claim('e-1', now=1001)     # same container, answered by the LRU
+    assert not second.claim('e-1', now=1001)    # other container, answered by the store
+    assert second.claim('e-1', now=1051)        # the first claim was never completed
+    second.complete('e-1', now=1051)
+    assert not first.claim('e-1', now=1100)
+    assert first.claim('e-1', now=1152)
+
+
+def test_released_claims_can_be_retried():
+    idempotency = Idempotency(SqliteStore(), cache_size=1)
+
+    assert idempotency.claim('e-1') and idempotency.claim('e-2')
+    idempotency.release('e-1')
+
+    assert idempotency.claim('e-1')
+    assert not idempotency.claim('e-2')
+
+
+def test_dynamo_store_claims_with_a_conditional_put():
+    client = boto3.client('dynamodb', region_name='us-east-1')
+    store = DynamoStore('ledger', client)
+    params = {'TableName': 'ledger',
+              'Item': {'resource': {'S': 'event#e-1'}, 'state': {'S': 'in_flight'}, 'expires_at': {'N': '1900'}},
+              'ConditionExpression': 'attribute_not_exists(#r) OR expires_at < :now',
+              'ExpressionAttributeNames': {'#r': 'resource'}, 'ExpressionAttributeValues': {':now': {'N': '1000'}}}
+
+    with Stubber(client) as stub:
+        stub.add_response('put_item', {}, params)
+        stub.add_client_error('put_item', 'ConditionalCheckFailedException', expected_params=params)
+        assert store.claim('event#e-1', 1900, 1000)
+        assert not store.claim('event#e-1', 1900, 1000)
+        stub.assert_no_pending_responses()
+
+
+def test_retry_after_a_timeout_is_processed():
+    store = SqliteStore()
+    crashed, retry = Idempotency(store), Idempotency(store)
+
+    # The first invocation had 120 s left when it claimed the event, then timed out.
+    assert crashed.claim('e-1', now=1000, in_flight=120)
+    # Lambda retries the async event a minute or two later.
+    assert retry.claim('e-1', now=1180)
@@ -0,0 +1,168 @@
+import json
+
+import pytest
+
+import engine
+import events
+import index
+from idempotency import Idempotency, SqliteStore
+
+
+@pytest.fixture
+def calls(monkeypatch):
+    calls = {'reconcile': [], 'region': [], 'groups': [], 'journal': []}
+    monkeypatch.setenv('tags', json.dumps({'map-migrated': 'mig123'}))
+    monkeypatch.setattr(index, 'reconcile_tags', lambda arns, region, tags, on_written=None, journal=True: (
+        calls['reconcile'].append(sorted(arns)) or calls['journal'].append(journal)
+        or {'examined': len(arns), 'tagged': 0, 'failed': [a for a in arns if 'bad' in a]}))
+    monkeypatch.setattr(index, 'sweep_region', lambda region, tags: (
+        calls['region'].append(region) or {'examined': 0, 'pages': 0, 'tagged': 0, 'failed': []}))
+    monkeypatch.setattr(index, '_run_sweep_group', lambda group, region, account, tags: calls['groups'].append((group, region)))
+    return calls
+
+
+def _record(message_id, name):
+    event = {'source': 'aws.lambda', 'region': 'us-east-1', 'account': '111122223333',
+             'detail': {'eventName': 'CreateFunction20150331',
+                        'responseElements': {'functionArn': f'arn:aws:lambda:us-east-1:111122223333:function:{name}'}}}
+    return {'messageId': message_id, 'body': json.dumps(event)}
+
+
+def test_batch_dedupes_arns_and_only_tags_event_resources(calls):
+    event = {'Records': [_record('m1', 'a'), _record('m2', 'a'), _record('m3', 'bad'),
+                         {'messageId': 'm4', 'body': 'not json'}]}
+
+    response = index.main(event, None)
+
+    assert sorted(f['itemIdentifier'] for f in response['batchItemFailures']) == ['m3', 'm4']
+    assert calls['reconcile'] == [['arn:aws:lambda:us-east-1:111122223333:function:a',
+                                   'arn:aws:lambda:us-east-1:111122223333:function:bad']]
+    assert calls['region'] == [] and calls['groups'] == []
+    # Redelivered through batchItemFailures, so not journaled as well.
+    assert calls['journal'] == [False]
+
+
+def test_direct_invocation_keeps_status_codes(calls):
+    event = json.loads(_record('m1', 'a')['body'])
+
+    assert index.main(event, None)['statusCode'] == 200
+    assert index.main(dict(event, source='aws.unknown'), None)['statusCode'] == 400
+
+
+def test_direct_invocation_reports_failed_resources(calls):
+    event = json.loads(_record('m1', 'bad')['body'])
+
+    assert index.main(event, None)['statusCode'] == 500
+    assert calls['journal'] == [True]
+
+
+def test_scheduled_event_reconciles_every_group(calls):
+    event = {'source': 'aws.events', 'detail-type': 'Scheduled Event', 'region': 'us-east-1', 'account': '111122223333'}
+
+    assert index.main(event, None)['statusCode'] == 200
+    assert calls['region'] == ['us-east-1']
+    assert sorted(calls['groups']) == sorted((group, 'us-east-1') for group in index.groups())
+    assert calls['reconcile'] == []
+
+
+def test_recheck_record_tags_resources_that_became_ready(calls, monkeypatch):
+    arn = 'arn:aws:kafka:us-east-1:111122223333:cluster/orders/abc'
+    monkeypatch.setattr(index, 'recheck', lambda job: [job['arn']] if job['attempt'] else [])
+    job = {'check': 'msk-cluster', 'region': 'us-east-1', 'arn': arn, 'params': {'id': arn}, 'attempt': 1}
+    event = {'Records': [{'messageId': 'm1', 'body': json.dumps({'recheck': job})},
+                         {'messageId': 'm2', 'body': json.dumps({'recheck': dict(job, attempt=0)})}]}
+
+    assert index.main(event, None)['batchItemFailures'] == []
+    assert calls['reconcile'] == [[arn]]
+
+
+def test_run_instances_tags_every_instance_of_the_launch(calls, monkeypatch):
+    launched = []
+    monkeypatch.setattr(engine, 'tag_ec2_launch', lambda region, ids, tags: launched.append(ids) or {
+        'examined': len(ids), 'tagged': len(ids), 'failed': [], 'rejected': []})
+    event = {'source': 'aws.ec2', 'region': 'us-east-1', 'account': '111122223333',
+             'detail': {'eventName': 'RunInstances', 'responseElements': {'instancesSet': {'items': [
+                 {'instanceId': 'i-1'}, {'instanceId': 'i-2'}, {'instanceId': 'i-3'}]}}}}
+
+    assert index.main(event, None)['statusCode'] == 200
+    assert launched == [['i-1', 'i-2', 'i-3']]
+    assert calls['reconcile'] == []
+
+
+def test_elasticache_clusters_are_rechecked_until_available(calls, monkeypatch):
+    deferred = []
+    monkeypatch.setattr(index, 'defer', lambda check, region, params, arn=None, account=None: (
+        deferred.append((check, params, arn))))
+    arn = 'arn:aws:elasticache:us-east-1:111122223333:'
+
+    def created(message_id, name, elements):
+        event = {'source': 'aws.elasticache', 'region': 'us-east-1', 'account': '111122223333',
+                 'detail': {'eventName': name, 'responseElements': elements}}
+        return {'messageId': message_id, 'body': json.dumps(event)}
+
+    event = {'Records': [
+        created('m1', 'CreateServerlessCache', {'serverlessCache': {'serverlessCacheName': 's', 'aRN': arn + 'serverlesscache:s'}}),
+        created('m2', 'CreateReplicationGroup', {'replicationGroup': {'replicationGroupId': 'g', 'aRN': arn + 'replicationgroup:g'}}),
+        created('m3', 'CreateCacheCluster', {'cacheCluster': {'cacheClusterId': 'c', 'aRN': arn + 'cluster:c'}})]}
+
+    assert index.main(event, None)['batchItemFailures'] == []
+    assert sorted(deferred) == [
+        ('elasticache-cache-cluster', {'id': 'c'}, arn + 'cluster:c'),
+        ('elasticache-replication-group', {'id': 'g'}, arn + 'replicationgroup:g'),
+        ('elasticache-serverless', {'id': 's'}, arn + 'serverlesscache:s')]
+    assert calls['reconcile'] == []
+
+
+def test_events_caused_by_the_functions_own_role_are_dropped(calls, monkeypatch):
+    role = 'arn:aws:iam::111122223333:role/resource-tagging-role-us-east-1'
+    monkeypatch.setattr(events, 'SELF_ROLE_ARN', role)
+    own = {'source': 'aws.ec2', 'region': 'us-east-1', 'account': '111122223333',
+           'detail': {'eventName': 'CreateTags', 'userIdentity': {
+               'arn': 'arn:aws:sts::111122223333:assumed-role/resource-tagging-role-us-east-1/tagger',
+               'sessionContext': {'sessionIssuer': {'arn': role}}}}}
+    other = json.loads(_record('m2', 'a')['body'])
+
+    assert index.main(own, None)['body'] == json.dumps("Ignored self-caused event")
+    response = index.main({'Records': [{'messageId': 'm1', 'body': json.dumps(own)}, _record('m2', 'a')]}, None)
+    assert response['batchItemFailures'] == []
+    assert calls['reconcile'] == [[other['detail']['responseElements']['functionArn']]]
+
+
+def test_duplicate_deliveries_are_processed_once(calls, monkeypatch):
+    monkeypatch.setattr(index, 'get_idempotency', lambda: idempotency)
+    idempotency = Idempotency(SqliteStore())
+
+    def delivery(message_id, name):
+        record = _record(message_id, name)
+        event = json.loads(record['body'])
+        event['detail']['eventID'] = f'event-{name}'
+        return dict(record, body=json.dumps(event))
+
+    first = index.main({'Records': [delivery('m1', 'a'), delivery('m2', 'a'), delivery('m3', 'bad')]}, None)
+    retry = index.main({'Records': [delivery('m4', 'a'), delivery('m5', 'bad')]}, None)
+
+    assert first['batchItemFailures'] == [{'itemIdentifier': 'm3'}]
+    assert retry['batchItemFailures'] == [{'itemIdentifier': 'm5'}]
+    assert calls['reconcile'] == [['arn:aws:lambda:us-east-1:111122223333:function:a',
+                                   'arn:aws:lambda:us-east-1:111122223333:function:bad'],
+                                  ['arn:aws:lambda:us-east-1:111122223333:function:bad']]
+
+
+def test_claims_last_only_as_long_as_the_invocation(calls, monkeypatch):
+    monkeypatch.setattr(index, 'get_idempotency', lambda: idempotency)
+    idempotency = Idempotency(SqliteStore())
+    claimed = []
+    claim = idempotency.claim
+    monkeypatch.setattr(idempotency, 'claim', lambda event_id, now=None, in_flight=None: (
+        claimed.append(in_flight) or claim(event_id, now, in_flight)))
+    event = json.loads(_record('m1', 'a')['body'])
+    event['detail']['eventID'] = 'event-a'
+
+    class Context:
+        aws_request_id = 'r-1'
+
+        def get_remaining_time_in_millis(self):
+            return 90000
+
+    assert index.main(event, Context())['statusCode'] == 200
+    assert claimed == [90.0]
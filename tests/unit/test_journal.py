@@ -0,0 +1,88 @@
+import boto3
+from botocore.stub import Stubber
+
+import journal
+import tagging
+from clients import get_client, reset_clients
+from journal import FailureJournal, LocalJournal, replay
+from tagging import TagWriter
+
+
+def _failing_writer(on_failed=None):
+    def write(arns, tags):
+        raise RuntimeError('boom')
+    return TagWriter(boto3.client('resourcegroupstaggingapi', region_name='us-east-1'), write=write, service='aws_sqs',
+                     on_failed=on_failed)
+
+
+def test_failed_writes_are_journaled_and_replayed_in_one_batch(monkeypatch):
+    monkeypatch.setattr(tagging, 'WRITE_RETRY_BASE_DELAY', 0)
+    failures = FailureJournal(LocalJournal())
+    monkeypatch.setattr(journal, '_journal', failures)
+    arns = [f'arn:aws:sqs:us-east-1:111122223333:q{n}' for n in range(3)]
+
+    writer = _failing_writer()
+    for arn in arns:
+        writer.add(arn, {'map-migrated': 'mig123'})
+    writer.flush()
+    failures.flush()
+    assert sorted(entry['target'] for entry in failures.sink.entries.values()) == arns
+    assert {entry['error_class'] for entry in failures.sink.entries.values()} == {'RuntimeError'}
+
+    reset_clients()
+    client = get_client('resourcegroupstaggingapi', region_name='us-east-1')
+    with Stubber(client) as stub:
+        stub.add_response('tag_resources', {'FailedResourcesMap': {}},
+                          {'ResourceARNList': arns, 'Tags': {'map-migrated': 'mig123'}})
+        summary = replay()
+        stub.assert_no_pending_responses()
+    reset_clients()
+
+    assert summary == {'examined': 3, 'tagged': 3, 'failed': 0, 'dropped': 0}
+    assert failures.sink.entries == {}
+
+
+def test_replay_gives_up_after_max_attempts(monkeypatch):
+    failures = FailureJournal(LocalJournal())
+    monkeypatch.setattr(journal, 'REPLAY_MAX_ATTEMPTS', 2)
+    monkeypatch.setattr(tagging, 'WRITE_RETRY_BASE_DELAY', 0)
+    failures.sink.write([{'target': 'arn:aws:sqs:us-east-1:111122223333:q', 'region': 'us-east-1',
+                          'tags': {'map-migrated': 'mig123'}, 'service': 'aws_sqs', 'attempt': 0},
+                         {'target': 'queue-url', 'region': 'us-east-1', 'tags': {}, 'service': 'sqs', 'attempt': 0}])
+    monkeypatch.setattr(journal, '_writer_for', lambda region, kind, on_written, on_failed: _failing_writer(on_failed=on_failed))
+
+    assert replay(journal=failures) == {'examined': 2, 'tagged': 0, 'failed': 1, 'dropped': 1}
+    [entry] = failures.sink.entries.values()
+    assert entry['attempt'] == 1
+    assert replay(journal=failures) == {'examined': 1, 'tagged': 0, 'failed': 1, 'dropped': 1}
+    assert failures.sink.entries == {}
+
+
+def test_non_arn_failures_are_replayed_through_the_registry_write(monkeypatch):
+    import executor
+    from engine import sweep_type
+    from ledger import Ledger, SqliteStore
+    from registry import type_by_kind
+
+    failures = FailureJournal(LocalJournal())
+    monkeypatch.setattr(journal, '_journal', failures)
+    monkeypatch.setitem(executor.SERVICE_CONCURRENCY, 'sqs', 1)
+    url = 'https://sqs.us-east-1.amazonaws.com/111122223333/orders'
+
+    reset_clients()
+    client = get_client('sqs', region_name='us-east-1')
+    with Stubber(client) as stub:
+        stub.add_response('list_queues', {'QueueUrls': [url]}, {})
+        stub.add_response('list_queue_tags', {'Tags': {}}, {'QueueUrl': url})
+        stub.add_client_error('tag_queue', 'InternalError', http_status_code=500)
+        summary = sweep_type(type_by_kind('SQS queue'), 'us-east-1', '111122223333', {'map-migrated': 'mig123'},
+                             ledger=Ledger(SqliteStore()))
+        failures.flush()
+        stub.add_response('tag_queue', {}, {'QueueUrl': url, 'Tags': {'map-migrated': 'mig123'}})
+        replayed = replay()
+        stub.assert_no_pending_responses()
+    reset_clients()
+
+    assert summary['failed'] == [url]
+    assert replayed == {'examined': 1, 'tagged': 1, 'failed': 0, 'dropped': 0}
+    assert failures.sink.entries == {}
@@ -0,0 +1,73 @@
+import boto3
+from botocore.stub import Stubber
+
+import executor
+from clients import get_client, reset_clients
+from engine import sweep_type
+from ledger import DynamoStore, Ledger, SqliteStore, tags_hash
+from registry import type_by_kind
+
+REQUIRED = {'map-migrated': 'mig123'}
+DIGEST = tags_hash(REQUIRED)
+
+
+def test_fresh_honours_tag_set_and_ttl():
+    ledger = Ledger(SqliteStore(), ttl=1000)
+    ledger.record(['a', 'b'], DIGEST, now=10_000)
+    ledger.record(['c'], tags_hash({'other': 'x'}), now=10_000)
+    ledger.flush()
+
+    assert ledger.fresh(['a', 'b', 'c', 'd'], DIGEST, now=10_500) == {'a', 'b'}
+    assert ledger.fresh(['a', 'b'], DIGEST, now=11_001) == set()
+
+
+def test_dynamo_store_batches_and_dedupes():
+    client = boto3.client('dynamodb', region_name='us-east-1')
+    store = DynamoStore('ledger', client)
+    item = {'resource': {'S': 'a'}, 'tags_hash': {'S': DIGEST}, 'verified_at': {'N': '100'}, 'expires_at': {'N': str(100 + 2 * 7 * 24 * 3600)}}
+
+    with Stubber(client) as stub:
+        stub.add_response('batch_write_item', {}, {'RequestItems': {'ledger': [{'PutRequest': {'Item': item}}]}})
+        stub.add_response('batch_get_item', {'Responses': {'ledger': [item]}}, {'RequestItems': {'ledger': {
+            'Keys': [{'resource': {'S': 'a'}}, {'resource': {'S': 'b'}}],
+            'ProjectionExpression': '#r, tags_hash, verified_at', 'ExpressionAttributeNames': {'#r': 'resource'}}}})
+        store.put_many([('a', 'old', 50), ('a', DIGEST, 100)], now=100)
+        assert store.get_many(['a', 'b', 'a']) == {'a': (DIGEST, 100.0)}
+        stub.assert_no_pending_responses()
+
+
+def test_old_watermarks_expire_from_when_they_are_written(monkeypatch):
+    import time
+
+    client = boto3.client('dynamodb', region_name='us-east-1')
+    store = DynamoStore('ledger', client)
+    monkeypatch.setattr(time, 'time', lambda: 1_000_000_000)
+    # The newest snapshot is far older than the ledger TTL.
+    item = {'resource': {'S': 'watermark:ec2'}, 'tags_hash': {'S': DIGEST}, 'verified_at': {'N': '100'},
+            'expires_at': {'N': str(1_000_000_000 + 2 * 7 * 24 * 3600)}}
+
+    with Stubber(client) as stub:
+        stub.add_response('batch_write_item', {}, {'RequestItems': {'ledger': [{'PutRequest': {'Item': item}}]}})
+        Ledger(store).set_mark('watermark:ec2', DIGEST, 100)
+        stub.assert_no_pending_responses()
+
+
+def test_sweep_skips_recently_verified_and_records_the_rest(monkeypatch):
+    monkeypatch.setitem(executor.SERVICE_CONCURRENCY, 'sns', 1)
+    reset_clients()
+    client = get_client('sns', region_name='us-east-1')
+    arns = [f'arn:aws:sns:us-east-1:111122223333:topic-{i}' for i in range(3)]
+    ledger = Ledger(SqliteStore())
+    ledger.record(arns[:2], DIGEST)
+    ledger.flush()
+
+    with Stubber(client) as stub:
+        stub.add_response('list_topics', {'Topics': [{'TopicArn': arn} for arn in arns]}, {})
+        stub.add_response('list_tags_for_resource', {'Tags': []}, {'ResourceArn': arns[2]})
+        stub.add_response('tag_resource', {}, {'ResourceArn': arns[2], 'Tags': [{'Key': 'map-migrated', 'Value': 'mig123'}]})
+        summary = sweep_type(type_by_kind('SNS topic'), 'us-east-1', '111122223333', REQUIRED, ledger=ledger)
+        stub.assert_no_pending_responses()
+    reset_clients()
+
+    assert summary == {'kind': 'SNS topic', 'examined': 1, 'skipped': 2, 'tagged': 1, 'failed': []}
+    assert ledger.fresh(arns, DIGEST) == set(arns)
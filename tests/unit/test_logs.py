@@ -0,0 +1,39 @@
+import json
+
+from logs import Logger
+
+
+def _records(capsys):
+    return [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+
+
+def test_successes_are_counted_and_failures_always_logged(capsys):
+    log = Logger(level='INFO', sample_rate=0)
+    log.bind(request_id='req-1')
+
+    log.resources('tag', 'tagged', [f'arn:aws:sqs:us-east-1:111122223333:q{n}' for n in range(1000)], service='aws_sqs')
+    log.resources('tag', 'failed', ['arn:aws:sqs:us-east-1:111122223333:broken'], service='aws_sqs',
+                  error=RuntimeError('AccessDenied'), event_id='e-1')
+    log.debug('Resource ARNs', arns=['ignored'])
+    log.flush()
+
+    failure, summary = _records(capsys)
+    assert failure == dict(failure, level='ERROR', arn='arn:aws:sqs:us-east-1:111122223333:broken', action='tag',
+                           outcome='failed', service='aws_sqs', error='AccessDenied', event_id='e-1', request_id='req-1')
+    assert summary['message'] == 'summary'
+    assert summary['outcomes'] == [
+        {'service': 'aws_sqs', 'action': 'tag', 'outcome': 'failed', 'count': 1},
+        {'service': 'aws_sqs', 'action': 'tag', 'outcome': 'tagged', 'count': 1000},
+    ]
+
+    log.info('after flush')
+    [record] = _records(capsys)
+    assert 'request_id' not in record
+
+
+def test_debug_level_logs_every_resource(capsys):
+    log = Logger(level='DEBUG')
+
+    log.resources('tag', 'tagged', ['arn:a', 'arn:b'], service='aws_sqs')
+
+    assert [record['arn'] for record in _records(capsys)] == ['arn:a', 'arn:b']
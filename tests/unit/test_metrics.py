@@ -0,0 +1,75 @@
+import json
+
+from botocore.stub import Stubber
+
+from clients import get_client, reset_clients
+from metrics import Metrics, metrics
+
+
+def test_client_calls_are_counted_per_operation():
+    reset_clients()
+    metrics.records()
+    client = get_client('sqs', region_name='us-east-1')
+
+    with Stubber(client) as stub:
+        stub.add_response('list_queues', {'QueueUrls': []})
+        stub.add_response('list_queues', {'QueueUrls': []})
+        stub.add_client_error('list_queue_tags', 'AccessDenied', http_status_code=403)
+        client.list_queues()
+        client.list_queues()
+        try:
+            client.list_queue_tags(QueueUrl='https://sqs/q')
+        except client.exceptions.ClientError:
+            pass
+
+    records = {(r['Service'], r['Operation']): r for r in metrics.records()}
+    reset_clients()
+    assert records[('sqs', 'ListQueues')]['Calls'] == 2
+    assert len(records[('sqs', 'ListQueues')]['Latency']) == 2
+    assert records[('sqs', 'ListQueueTags')]['Errors'] == 1
+
+
+def test_handler_counts_are_emitted_as_emf(capsys):
+    recorder = Metrics(namespace='Test')
+    recorder.count('aws_ec2', examined=3, tagged=1)
+    recorder.count('aws_ec2', examined=2, skipped=2)
+
+    recorder.flush()
+    [record] = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+
+    assert record['Handler'] == 'aws_ec2'
+    assert (record['ResourcesExamined'], record['ResourcesTagged'], record['ResourcesSkipped']) == (5, 1, 2)
+    [directive] = record['_aws']['CloudWatchMetrics']
+    assert directive['Namespace'] == 'Test' and directive['Dimensions'] == [['Handler']]
+    assert recorder.records() == []
+
+
+def test_disabled_flush_still_resets(monkeypatch, capsys):
+    import metrics as metrics_module
+
+    monkeypatch.setattr(metrics_module, 'METRICS_ENABLED', False)
+    recorder = Metrics(namespace='Test')
+    recorder.count('aws_ec2', examined=3)
+
+    recorder.flush()
+
+    assert capsys.readouterr().out == ''
+    assert recorder.records() == []
+
+
+def test_connection_errors_keep_their_exception():
+    import boto3
+    import pytest
+    from botocore.config import Config
+    from botocore.exceptions import EndpointConnectionError
+
+    recorder = Metrics(namespace='Test')
+    client = boto3.client('sqs', region_name='us-east-1', endpoint_url='http://127.0.0.1:9',
+                          config=Config(retries={'total_max_attempts': 1}, connect_timeout=1))
+    recorder.attach(client, 'sqs')
+
+    with pytest.raises(EndpointConnectionError):
+        client.list_queues()
+
+    [record] = recorder.records()
+    assert (record['Service'], record['Operation'], record['Errors']) == ('sqs', 'ListQueues', 1)
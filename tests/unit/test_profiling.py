@@ -0,0 +1,35 @@
+import json
+import os
+
+import profiling
+from executor import map_resources
+
+
+def test_profiled_invocation_writes_phase_and_profile_reports(monkeypatch, tmp_path):
+    monkeypatch.setattr(profiling, 'PROFILE_CPU', True)
+    monkeypatch.setattr(profiling, 'PROFILE_MEMORY', True)
+    monkeypatch.setattr(profiling, 'PROFILE_DIR', str(tmp_path))
+
+    class Context:
+        aws_request_id = 'req-1'
+
+    @profiling.profiled
+    def handler(event, context):
+        with profiling.phase('event_parse'):
+            items = list(range(event['n']))
+        with profiling.phase('writes'):
+            return map_resources('sqs', lambda item: item * 2, items)['results']
+
+    assert sorted(handler({'n': 20}, Context())) == [n * 2 for n in range(20)]
+
+    directory = tmp_path / 'profile-req-1'
+    assert sorted(os.listdir(directory)) == ['cprofile.pstats', 'cprofile.txt', 'phases.json', 'tracemalloc.txt']
+    phases = json.loads((directory / 'phases.json').read_text())['phases']
+    assert set(phases) == {'event_parse', 'writes'}
+    assert profiling._session is None
+
+
+def test_phases_cost_nothing_when_profiling_is_off():
+    with profiling.phase('writes'):
+        pass
+    assert profiling.traced(len) is len
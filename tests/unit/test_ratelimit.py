@@ -0,0 +1,57 @@
+import time
+
+from ratelimit import RateLimiter, TokenBucket
+
+
+class _Operation:
+    name = 'TagResources'
+
+
+class _HttpResponse:
+    def __init__(self, status_code):
+        self.status_code = status_code
+
+
+def test_bucket_halves_on_throttle_and_recovers_additively():
+    bucket = TokenBucket(10)
+    bucket.throttled()
+    bucket.throttled()
+    assert bucket.rate == 2.5
+    for _ in range(10):
+        bucket.succeeded()
+    assert bucket.rate == 7.5
+    for _ in range(100):
+        bucket.succeeded()
+    assert bucket.rate == 20
+
+
+def test_bucket_paces_requests_to_its_rate():
+    bucket = TokenBucket(50)
+    bucket.tokens = 0
+    started = time.monotonic()
+    for _ in range(5):
+        bucket.acquire()
+    assert time.monotonic() - started >= 0.08
+
+
+def test_limiter_feeds_throttles_back_to_the_operation_bucket():
+    limiter = RateLimiter(seed_rates={('resourcegroupstaggingapi', 'TagResources'): 4}, default_rate=8)
+    handlers = {}
+
+    class _Events:
+        def register(self, name, handler):
+            handlers[name] = handler
+
+    class _Meta:
+        events = _Events()
+
+    class _Client:
+        meta = _Meta()
+
+    limiter.attach(_Client(), 'resourcegroupstaggingapi')
+    handlers['before-send'](event_name='before-send.resource-groups-tagging-api.TagResources')
+    throttle = (_HttpResponse(400), {'Error': {'Code': 'ThrottlingException'}})
+    assert handlers['needs-retry'](response=throttle, operation=_Operation()) is None
+
+    assert limiter.snapshot()[('resourcegroupstaggingapi', 'TagResources')] == (2.0, 1)
+    assert limiter.bucket('resourcegroupstaggingapi', 'GetResources').rate == 8
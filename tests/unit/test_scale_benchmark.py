@@ -0,0 +1,20 @@
+from benchmarks.scale import run_scenario
+
+
+def test_reconciliation_leaves_the_fake_account_fully_tagged(monkeypatch):
+    monkeypatch.setenv('tags', '{}')
+
+    result = run_scenario('reconcile', 200, tagged_ratio=0.5)
+
+    assert result['still_untagged'] == 0
+    assert result['resources_tagged'] == 100
+    assert result['calls_by_operation']['ec2.create_tags'] == 1
+
+
+def test_repeat_reconciliation_skips_verified_resources(monkeypatch):
+    monkeypatch.setenv('tags', '{}')
+
+    result = run_scenario('reconcile-repeat', 200)
+
+    assert result['resources_tagged'] == 0
+    assert 'rds.list_tags_for_resource' not in result['calls_by_operation']
@@ -0,0 +1,155 @@
+import boto3
+from botocore.stub import Stubber
+
+import tagging
+from tagging import (ACCESS_DENIED, INVALID, THROTTLED, TRANSIENT, UNSUPPORTED, TagWriter, classify_error,
+                     reconcile_tags, sweep_region)
+
+REQUIRED = {'map-migrated': 'mig123', 'team': 'ops'}
+
+
+def _arn(i):
+    return f'arn:aws:sqs:us-east-1:111122223333:queue-{i}'
+
+
+def test_reconcile_reads_in_chunks_and_groups_writes_by_delta():
+    client = boto3.client('resourcegroupstaggingapi', region_name='us-east-1')
+    arns = [_arn(i) for i in range(150)]
+    # 0-99 compliant, 100-129 missing only 'team', 130-149 never tagged.
+    first = [{'ResourceARN': arn, 'Tags': [{'Key': 'map-migrated', 'Value': 'mig123'}, {'Key': 'team', 'Value': 'ops'}]}
+             for arn in arns[:100]]
+    second = [{'ResourceARN': arn, 'Tags': [{'Key': 'map-migrated', 'Value': 'mig123'}, {'Key': 'team', 'Value': 'old'}]}
+              for arn in arns[100:130]]
+
+    with Stubber(client) as stub:
+        stub.add_response('get_resources', {'ResourceTagMappingList': first}, {'ResourceARNList': arns[:100]})
+        stub.add_response('get_resources', {'ResourceTagMappingList': second}, {'ResourceARNList': arns[100:]})
+        stub.add_response('tag_resources', {'FailedResourcesMap': {}},
+                          {'ResourceARNList': arns[100:120], 'Tags': {'team': 'ops'}})
+        stub.add_response('tag_resources', {'FailedResourcesMap': {}},
+                          {'ResourceARNList': arns[130:150], 'Tags': REQUIRED})
+        stub.add_response('tag_resources', {'FailedResourcesMap': {}},
+                          {'ResourceARNList': arns[120:130], 'Tags': {'team': 'ops'}})
+
+        summary = reconcile_tags(arns + [arns[0], None, 'd-1234567890'], 'us-east-1', REQUIRED, client=client)
+        stub.assert_no_pending_responses()
+
+    assert summary == {'examined': 150, 'tagged': 50, 'failed': [], 'rejected': []}
+
+
+def test_sweep_region_diffs_page_tags_without_extra_reads():
+    client = boto3.client('resourcegroupstaggingapi', region_name='us-east-1')
+    page1 = [{'ResourceARN': _arn(0), 'Tags': [{'Key': 'map-migrated', 'Value': 'mig123'}, {'Key': 'team', 'Value': 'ops'}]},
+             {'ResourceARN': _arn(1), 'Tags': [{'Key': 'map-migrated', 'Value': 'mig123'}]}]
+    page2 = [{'ResourceARN': _arn(2), 'Tags': []}]
+
+    with Stubber(client) as stub:
+        stub.add_response('get_resources', {'ResourceTagMappingList': page1, 'PaginationToken': 'next'}, {})
+        stub.add_response('get_resources', {'ResourceTagMappingList': page2, 'PaginationToken': ''},
+                          {'PaginationToken': 'next'})
+        stub.add_response('tag_resources', {}, {'ResourceARNList': [_arn(2)], 'Tags': REQUIRED})
+        stub.add_response('tag_resources', {}, {'ResourceARNList': [_arn(1)], 'Tags': {'team': 'ops'}})
+
+        summary = sweep_region('us-east-1', REQUIRED, client=client)
+        stub.assert_no_pending_responses()
+
+    assert summary == {'examined': 3, 'pages': 2, 'tagged': 2, 'failed': [], 'rejected': []}
+
+
+def test_writer_retries_only_retryable_failed_resources(monkeypatch):
+    monkeypatch.setattr(tagging, 'WRITE_RETRY_BASE_DELAY', 0)
+    client = boto3.client('resourcegroupstaggingapi', region_name='us-east-1')
+    journaled = []
+    writer = TagWriter(client, on_failed=lambda arns, tags, error: journaled.append((arns, tags)))
+    arns = [_arn(i) for i in range(5)]
+    first = {
+        _arn(1): {'StatusCode': 500, 'ErrorCode': 'InternalServiceException', 'ErrorMessage': 'Internal error'},
+        _arn(2): {'StatusCode': 400, 'ErrorCode': 'InvalidParameterException', 'ErrorMessage': 'Rate exceeded'},
+        _arn(3): {'StatusCode': 400, 'ErrorCode': 'InvalidParameterException',
+                  'ErrorMessage': 'The resource type is not supported'},
+        _arn(4): {'StatusCode': 403, 'ErrorCode': 'InvalidParameterException',
+                  'ErrorMessage': 'User is not authorized to perform: sqs:TagQueue'},
+    }
+
+    with Stubber(client) as stub:
+        stub.add_response('tag_resources', {'FailedResourcesMap': first}, {'ResourceARNList': arns, 'Tags': REQUIRED})
+        stub.add_response('tag_resources', {'FailedResourcesMap': {_arn(2): first[_arn(1)]}},
+                          {'ResourceARNList': [_arn(1), _arn(2)], 'Tags': REQUIRED})
+        stub.add_client_error('tag_resources', 'ThrottlingException', http_status_code=400,
+                              expected_params={'ResourceARNList': [_arn(2)], 'Tags': REQUIRED})
+        stub.add_client_error('tag_resources', 'ThrottlingException', http_status_code=400,
+                              expected_params={'ResourceARNList': [_arn(2)], 'Tags': REQUIRED})
+        for arn in arns:
+            writer.add(arn, REQUIRED)
+        writer.flush()
+        stub.assert_no_pending_responses()
+
+    assert writer.tagged == 2
+    assert writer.rejected == [_arn(3), _arn(4)]
+    assert writer.failed == [_arn(2)]
+    assert journaled == [([_arn(2)], REQUIRED)]
+
+
+def test_classify_error():
+    assert classify_error('ThrottlingException') == THROTTLED
+    assert classify_error('InternalServiceException', 'Internal error', 500) == TRANSIENT
+    assert classify_error('AccessDeniedException', '', 403) == ACCESS_DENIED
+    assert classify_error('InvalidParameterException', 'ResourceType is not supported') == UNSUPPORTED
+    assert classify_error('InvalidParameterException', 'Invalid ARN') == INVALID
+    assert classify_error('InvalidInstanceID.NotFound', "The instance ID 'i-1' does not exist", 400) == INVALID
+    assert classify_error('InvalidVolumeID.Malformed', 'Invalid id: "vol-x"', 400) == INVALID
+
+
+def test_writer_isolates_bad_ids_in_whole_call_errors():
+    client = boto3.client('ec2', region_name='us-east-1')
+    tags = [{'Key': 'map-migrated', 'Value': 'mig123'}]
+    writer = TagWriter(client, 1000, on_failed=lambda *args: None,
+                       write=lambda ids, delta: client.create_tags(Resources=ids, Tags=tags))
+
+    with Stubber(client) as stub:
+        # The message names the missing id: it is rejected and the rest written again.
+        stub.add_client_error('create_tags', 'InvalidInstanceID.NotFound', "The instance ID 'i-2' does not exist",
+                              400, expected_params={'Resources': ['i-1', 'i-2', 'i-3'], 'Tags': tags})
+        stub.add_response('create_tags', {}, {'Resources': ['i-1', 'i-3'], 'Tags': tags})
+        # It names none: the batch is split in half until the bad id is alone.
+        stub.add_client_error('create_tags', 'InvalidID', 'An invalid id was given', 400,
+                              expected_params={'Resources': ['vol-1', 'vol-2', 'vol-3', 'vol-4'], 'Tags': tags})
+        stub.add_response('create_tags', {}, {'Resources': ['vol-1', 'vol-2'], 'Tags': tags})
+        stub.add_client_error('create_tags', 'InvalidID', 'An invalid id was given', 400,
+                              expected_params={'Resources': ['vol-3', 'vol-4'], 'Tags': tags})
+        stub.add_response('create_tags', {}, {'Resources': ['vol-3'], 'Tags': tags})
+        stub.add_client_error('create_tags', 'InvalidID', 'An invalid id was given', 400,
+                              expected_params={'Resources': ['vol-4'], 'Tags': tags})
+        for ident in ('i-1', 'i-2', 'i-3'):
+            writer.add(ident, {'map-migrated': 'mig123'})
+        writer.flush()
+        for ident in ('vol-1', 'vol-2', 'vol-3', 'vol-4'):
+            writer.add(ident, {'map-migrated': 'mig123'})
+        writer.flush()
+        stub.assert_no_pending_responses()
+
+    assert writer.tagged == 5
+    assert writer.rejected == ['i-2', 'vol-4']
+    assert writer.failed == []
+
+
+def test_reconcile_journals_only_when_asked(monkeypatch):
+    client = boto3.client('resourcegroupstaggingapi', region_name='us-east-1')
+    journaled = []
+    monkeypatch.setattr(tagging, 'WRITE_RETRIES', 0)
+    monkeypatch.setattr(tagging, 'get_journal', lambda: type('Journal', (), {
+        'record': lambda self, targets, *args, **kwargs: journaled.append(list(targets))})())
+    busy = {'FailedResourcesMap': {_arn(1): {'StatusCode': 500, 'ErrorCode': 'InternalServiceException',
+                                             'ErrorMessage': 'busy'}}}
+
+    for journal in (False, True):
+        with Stubber(client) as stub:
+            stub.add_client_error('get_resources', 'InternalServiceException', http_status_code=500,
+                                  expected_params={'ResourceARNList': [_arn(0)]})
+            stub.add_response('get_resources', {'ResourceTagMappingList': []}, {'ResourceARNList': [_arn(1)]})
+            stub.add_response('tag_resources', busy, {'ResourceARNList': [_arn(1)], 'Tags': REQUIRED})
+            unread = reconcile_tags([_arn(0)], 'us-east-1', REQUIRED, client=client, journal=journal)
+            unwritten = reconcile_tags([_arn(1)], 'us-east-1', REQUIRED, client=client, journal=journal)
+            stub.assert_no_pending_responses()
+        assert unread['failed'] == [_arn(0)] and unwritten['failed'] == [_arn(1)]
+        assert journaled == ([[_arn(0)], [_arn(1)]] if journal else [])